@@ -1,5 +1,4 @@
-from BeamlineStatusLogger.logger import Logger
-from BeamlineStatusLogger import sources, processors, sinks, timer
+import importlib
 
 __all__ = [
     "sources",
@@ -7,4 +6,26 @@ __all__ = [
     "sinks",
     "timer",
     "Logger",
+    "AsyncLogger",
+    "LoggerStats",
 ]
+
+SUBMODULES = ["archive", "config", "logger", "processors", "sinks",
+              "sources", "supervisor", "timer", "utils"]
+LOGGER_CLASSES = ["Logger", "AsyncLogger", "LoggerStats"]
+
+
+def __getattr__(name):
+    # the submodules are imported on first access, so that a logger only
+    # imports the dependencies of the components it uses, e.g., scipy and
+    # matplotlib only if it has a PeakFitter
+    if name in SUBMODULES:
+        return importlib.import_module(__name__ + "." + name)
+    if name in LOGGER_CLASSES:
+        return getattr(importlib.import_module(__name__ + ".logger"), name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(SUBMODULES) | set(LOGGER_CLASSES))
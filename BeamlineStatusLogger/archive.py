@@ -0,0 +1,471 @@
+import BeamlineStatusLogger.utils as utils
+from collections import deque
+from datetime import datetime
+import glob
+import logging
+import os
+import queue
+import re
+import threading
+import zipfile
+from time import monotonic
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# the files of an archived frame, relative to its base name
+FRAME_SUFFIXES = [".npy", "_fit.npy", ".png", "_zoomed.png"]
+
+
+def render_frame(img, p, filename, figure=None):
+    """
+        Save the plots of an image with its fitted Gaussian as png files
+
+        The plots of the whole image and of the peak are saved as
+        `filename`.png and `filename`_zoomed.png.
+
+        Parameters
+        ----------
+        img : array_like
+            A 2d image
+        p : tuple
+            The fitted parameters h, a, x0, y0, sx, sy, rot, cutoff
+        filename : str
+            The path of the files without suffix
+        figure : matplotlib.figure.Figure, optional
+            The figure is cleared and reused instead of creating a new one
+    """
+    if figure is None:
+        from matplotlib.figure import Figure
+        figure = Figure()
+    for zoom, suffix in [(False, ".png"), (True, "_zoomed.png")]:
+        figure.clear()
+        fig, *axes = utils.setup_axes(figure)
+        utils.plot_gauss(img, p, axes, zoom=zoom)
+        figure.savefig(filename + suffix)
+
+
+def render_archived_frame(filename, figure=None):
+    """
+        Render the plots of a frame that was archived without them
+
+        Parameters
+        ----------
+        filename : str
+            The path of the archived frame without suffix
+        figure : matplotlib.figure.Figure, optional
+            The figure is cleared and reused instead of creating a new one
+    """
+    img = np.load(filename + ".npy")
+    p = tuple(np.load(filename + "_fit.npy"))
+    render_frame(img, p, filename, figure)
+
+
+# one record per frame in the index of a ChunkedFrameStore
+INDEX_DTYPE = np.dtype([
+    ("time", "<f8"), ("chunk", "<i4"), ("slot", "<i4"),
+    ("h", "<f8"), ("a", "<f8"), ("x0", "<f8"), ("y0", "<f8"),
+    ("sx", "<f8"), ("sy", "<f8"), ("rot", "<f8"), ("cutoff", "<f8")])
+
+
+def _timestamp(time):
+    if isinstance(time, datetime):
+        return time.timestamp()
+    return time
+
+
+class ChunkedFrameStore:
+    """Stores frames and their fits in a few compressed chunk files
+
+    Each chunk is a zip file of up to `chunk_frames` compressed .npy
+    members, i.e., it can be opened with `np.load`. The current chunk is
+    written to a file with the suffix .open, which is kept open, so that
+    appending a frame only writes the frame. When the chunk is full or the
+    store is closed, the zip directory is written and the file is renamed
+    to .npz. The time and the fitted parameters of every frame are
+    appended to the binary file index.bin in the directory, which is read
+    as a memory map of `INDEX_DTYPE` records. Since the frames are appended
+    in time order, a time window is found by a binary search of the index
+    without listing the directory.
+
+    If the process crashes, only the frames of the current chunk are lost.
+    Its .open file cannot be read with `np.load` and is deleted first if
+    the disk quota is exceeded.
+
+    Parameters
+    ----------
+    directory : str
+        The directory of the store. It is created if it does not exist
+    chunk_frames : int, optional
+        The maximum number of frames per chunk
+    """
+    index_name = "index.bin"
+
+    def __init__(self, directory, chunk_frames=100):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_frames = chunk_frames
+        index = self.index()
+        self.slot = 0
+        self._zip = None
+        # paths and sizes of the closed chunks, the oldest first. Leftover
+        # .open files of a crashed run are deleted before any chunk
+        leftovers = []
+        chunks = []
+        for name in os.listdir(directory):
+            match = re.fullmatch(r"chunk_(\d+)\.npz(\.open)?", name)
+            if match:
+                path = os.path.join(directory, name)
+                entry = (int(match.group(1)), path, os.path.getsize(path))
+                (leftovers if match.group(2) else chunks).append(entry)
+        self._chunks = deque((path, size) for number, path, size
+                             in sorted(leftovers) + sorted(chunks))
+        # a new chunk is started to never modify chunks of previous runs,
+        # including leftovers whose first frame was not indexed yet
+        numbers = [number for number, path, size in leftovers + chunks]
+        if len(index):
+            numbers.append(int(index["chunk"][-1]))
+        self.chunk = max(numbers, default=-1) + 1
+        self._chunk_bytes = sum(size for path, size in self._chunks)
+        self._index_bytes = len(index) * INDEX_DTYPE.itemsize
+
+    def chunk_path(self, chunk):
+        return os.path.join(self.directory, "chunk_{:08d}.npz".format(chunk))
+
+    def append(self, time, img, p):
+        """
+            Append an image and its fitted parameters
+
+            Parameters
+            ----------
+            time : datetime or number
+                The time of the image as datetime or POSIX timestamp. Times
+                must not decrease
+            img : array_like
+                A 2d image
+            p : tuple
+                The fitted parameters h, a, x0, y0, sx, sy, rot, cutoff
+        """
+        if self.slot >= self.chunk_frames:
+            self._close_chunk()
+            self.chunk += 1
+            self.slot = 0
+        if self._zip is None:
+            self._zip = zipfile.ZipFile(
+                self.chunk_path(self.chunk) + ".open", "w",
+                compression=zipfile.ZIP_DEFLATED)
+        name = "frame_{}.npy".format(self.slot)
+        with self._zip.open(name, "w", force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asanyarray(img))
+        self._zip.fp.flush()
+        record = np.zeros(1, INDEX_DTYPE)
+        record["time"] = _timestamp(time)
+        record["chunk"] = self.chunk
+        record["slot"] = self.slot
+        for name, value in zip(INDEX_DTYPE.names[3:], p):
+            record[name] = value
+        # the record is only written once the frame is complete
+        with open(os.path.join(self.directory, self.index_name), "ab") as f:
+            f.write(record.tobytes())
+        self._index_bytes += INDEX_DTYPE.itemsize
+        self.slot += 1
+
+    def close(self):
+        """
+            Close the current chunk, which makes its frames readable
+        """
+        self._close_chunk()
+
+    def index(self):
+        """
+            Return the index records of all frames as read-only memory map
+        """
+        path = os.path.join(self.directory, self.index_name)
+        try:
+            # a record that is currently written is ignored
+            n = os.path.getsize(path) // INDEX_DTYPE.itemsize
+        except FileNotFoundError:
+            n = 0
+        if not n:
+            return np.zeros(0, INDEX_DTYPE)
+        return np.memmap(path, INDEX_DTYPE, mode="r", shape=(n,))
+
+    def read_window(self, start, end):
+        """
+            Read the frames with start <= time < end
+
+            Frames of chunks that were deleted or are not closed yet are
+            skipped.
+
+            Parameters
+            ----------
+            start, end : datetime or number
+                The time window as datetimes or POSIX timestamps
+
+            Returns
+            -------
+            records : ndarray
+                The index records of the frames
+            frames : list of ndarray
+                The images
+        """
+        index = self.index()
+        times = index["time"]
+        first = np.searchsorted(times, _timestamp(start), side="left")
+        last = np.searchsorted(times, _timestamp(end), side="left")
+        records = np.array(index[first:last])
+        keep = np.ones(len(records), bool)
+        frames = []
+        for chunk in np.unique(records["chunk"]):
+            selected = np.nonzero(records["chunk"] == chunk)[0]
+            try:
+                npz = np.load(self.chunk_path(chunk))
+            except FileNotFoundError:
+                keep[selected] = False
+                continue
+            with npz:
+                for i in selected:
+                    frames.append(npz["frame_{}".format(records["slot"][i])])
+        # chunks and thereby frames are in time order
+        return records[keep], frames
+
+    def chunks(self):
+        """
+            Return the numbers of all closed chunk files, the oldest first
+        """
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = re.fullmatch(r"chunk_(\d+)\.npz", name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def size(self):
+        """
+            Return the disk usage of the store in bytes
+        """
+        size = self._chunk_bytes + self._index_bytes
+        if self._zip is not None:
+            size += self._zip.fp.tell()
+        return size
+
+    def delete_oldest(self, max_bytes):
+        """
+            Delete the oldest chunks until the store is at most `max_bytes`
+
+            The current chunk is never deleted.
+        """
+        size = self.size()
+        while size > max_bytes and self._chunks:
+            path, chunk_size = self._chunks.popleft()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._chunk_bytes -= chunk_size
+            size -= chunk_size
+            log.info("Archive quota exceeded, deleted %s", path)
+
+    def _close_chunk(self):
+        if self._zip is None:
+            return
+        self._zip.close()
+        self._zip = None
+        path = self.chunk_path(self.chunk)
+        os.rename(path + ".open", path)
+        size = os.path.getsize(path)
+        self._chunks.append((path, size))
+        self._chunk_bytes += size
+
+
+class FrameArchiver:
+    """Archives images and their fits from a background thread
+
+    `submit` only puts the frame into a bounded queue. The image is saved as
+    .npy file and the fitted parameters as _fit.npy file by a background
+    thread, which also renders the plots if `render` is True. Thereby, the
+    time spent in `submit` does not depend on how many frames are archived.
+    Frames are dropped if the queue is full or if they are submitted faster
+    than `max_rate`.
+
+    With `format` "chunked", the frames are instead appended to a
+    `ChunkedFrameStore` in the directory, no plots are rendered and the
+    quota is enforced by deleting the oldest chunks.
+
+    Parameters
+    ----------
+    directory : str
+        The archive directory, which must exist
+    max_rate : number, optional
+        The maximum number of archived frames per second
+    max_bytes : int, optional
+        The disk quota of the archived frames. If it is exceeded, the oldest
+        frames are deleted. The frames in the directory are only listed
+        once on construction, afterwards their total size is tracked
+    max_queue : int, optional
+        The maximum number of frames waiting to be archived
+    render : Boolean, optional
+        If False, no plots are rendered. They can be rendered later with
+        `render_archived_frame`
+    format : {"files", "chunked"}, optional
+        Whether every frame is saved as separate files or frames are
+        appended to compressed chunks
+    chunk_frames : int, optional
+        The number of frames per chunk, if `format` is "chunked"
+
+    Attributes
+    ----------
+    dropped : int
+        The number of frames that were not archived
+    """
+    def __init__(self, directory, max_rate=None, max_bytes=None,
+                 max_queue=10, render=True, format="files",
+                 chunk_frames=100):
+        if not os.path.isdir(directory):
+            raise ValueError(directory + " is not a directory")
+        if format == "chunked":
+            self.store = ChunkedFrameStore(directory, chunk_frames)
+        elif format == "files":
+            self.store = None
+        else:
+            raise ValueError("Unknown archive format " + repr(format))
+        self.directory = directory
+        self.max_rate = max_rate
+        self.max_bytes = max_bytes
+        self.render = render
+        self.queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self.last_submit = None
+        self.figure = None
+        if self.store is None:
+            # base names and sizes of the archived frames, the oldest first
+            self._archived = deque(self._frames())
+            self._bytes = sum(size for base, size in self._archived)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, time, img, p):
+        """
+            Queue an image and its fitted parameters for archiving
+
+            The image must not be modified afterwards.
+
+            Parameters
+            ----------
+            time : datetime
+                The time of the image, which determines the file names
+            img : array_like
+                A 2d image
+            p : tuple
+                The fitted parameters h, a, x0, y0, sx, sy, rot, cutoff
+
+            Returns
+            -------
+            Boolean
+                False, if the frame was dropped
+        """
+        now = monotonic()
+        if (self.max_rate and self.last_submit is not None and
+                now - self.last_submit < 1/self.max_rate):
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put_nowait((time, img, p))
+        except queue.Full:
+            self.dropped += 1
+            log.debug("Archive queue is full, dropping frame")
+            return False
+        self.last_submit = now
+        return True
+
+    def flush(self):
+        """
+            Wait until all queued frames are archived
+        """
+        self.queue.join()
+
+    def close(self):
+        """
+            Archive all queued frames and stop the background thread
+        """
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+        if self.store is not None:
+            self.store.close()
+
+    def size(self):
+        """
+            Return the disk usage of the archived frames in bytes
+        """
+        if self.store is not None:
+            return self.store.size()
+        return self._bytes
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception:
+                log.error("Archiving a frame failed", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def _write(self, time, img, p):
+        if self.store is not None:
+            self.store.append(time, img, p)
+            if self.max_bytes is not None:
+                self.store.delete_oldest(self.max_bytes)
+            return
+        filename = os.path.join(self.directory, "img_" + time.isoformat())
+        np.save(filename, img)
+        np.save(filename + "_fit", np.asarray(p, dtype=np.float64))
+        if self.render:
+            if self.figure is None:
+                from matplotlib.figure import Figure
+                self.figure = Figure()
+            render_frame(img, p, filename, self.figure)
+        size = 0
+        for suffix in FRAME_SUFFIXES:
+            try:
+                size += os.path.getsize(filename + suffix)
+            except FileNotFoundError:
+                pass
+        self._archived.append((filename, size))
+        self._bytes += size
+        if self.max_bytes is not None:
+            self._enforce_quota()
+
+    def _frames(self):
+        # base names and sizes of all archived frames, the oldest first
+        frames = []
+        for path in glob.glob(os.path.join(self.directory, "img_*_fit.npy")):
+            base = path[:-len("_fit.npy")]
+            size = 0
+            mtime = None
+            for suffix in FRAME_SUFFIXES:
+                try:
+                    stat = os.stat(base + suffix)
+                except FileNotFoundError:
+                    continue
+                size += stat.st_size
+                if mtime is None or stat.st_mtime < mtime:
+                    mtime = stat.st_mtime
+            frames.append((mtime, base, size))
+        frames.sort()
+        return [(base, size) for mtime, base, size in frames]
+
+    def _enforce_quota(self):
+        while self._bytes > self.max_bytes and self._archived:
+            base, frame_size = self._archived.popleft()
+            for suffix in FRAME_SUFFIXES:
+                try:
+                    os.remove(base + suffix)
+                except FileNotFoundError:
+                    pass
+            log.info("Archive quota exceeded, deleted %s", base)
+            self._bytes -= frame_size
@@ -0,0 +1,181 @@
+import configparser
+import glob
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+
+class ConfigError(Exception):
+    pass
+
+
+def get_typed_value(section, key):
+    for converter in [section.getboolean, section.getint, section.getfloat]:
+        try:
+            value = converter(key)
+        except ValueError:
+            pass
+        else:
+            return value
+    return section[key]
+
+
+def config_to_dict(config):
+    return {sec: {key: get_typed_value(config[sec], key)
+                  for key in config.options(sec)}
+            for sec in config.sections()}
+
+
+def get_base_path(derived_path, section):
+    base_path = next(iter(section.keys()))
+    if not os.path.isabs(base_path):
+        base_path = os.path.join(os.path.dirname(derived_path), base_path)
+    if not os.path.exists(base_path):
+        raise FileNotFoundError("File not found: " + base_path)
+    return base_path
+
+
+def _parse_config_files(path):
+    cp = configparser.ConfigParser(allow_no_value=True)
+    cp.read(path)
+    if "based on" in cp:
+        base_path = get_base_path(path, cp["based on"])
+        cp.remove_section("based on")
+        cp_base = _parse_config_files(base_path)
+        cp_base.read_dict(cp)
+        return cp_base
+    else:
+        return cp
+
+
+def parse_config_file(path):
+    """
+        Parse a logger config file including the files it is based on
+
+        Returns
+        -------
+        dict
+            Maps each section to a dict of its typed options
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError("File not found: " + path)
+    config = configparser.ConfigParser(
+        allow_no_value=True,
+        interpolation=configparser.ExtendedInterpolation())
+    config.read_dict(_parse_config_files(path))
+    return config_to_dict(config)
+
+
+def config_chain(path):
+    """
+        Return the paths of a config file and of all files it is based on
+    """
+    paths = [path]
+    while True:
+        cp = configparser.ConfigParser(allow_no_value=True)
+        cp.read(paths[-1])
+        if "based on" not in cp:
+            return paths
+        base_path = get_base_path(paths[-1], cp["based on"])
+        if base_path in paths:
+            raise ConfigError("Config file " + path + " is based on itself")
+        paths.append(base_path)
+
+
+def logger_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def config_files(config_path):
+    """
+        Return `config_path` if it is a file, else the .logger files in it
+    """
+    if os.path.isfile(config_path):
+        return [config_path]
+    return sorted(glob.glob(os.path.join(config_path, "*.logger")))
+
+
+class ConfigWatcher:
+    """
+        Detects added, changed and removed logger config files by polling
+
+        The modification times of the config files and of all files they are
+        based on are compared to the previous call of `poll`. Only files
+        whose times changed are parsed again, and a logger only counts as
+        changed if its parsed configuration differs. Thereby, touching a
+        file or editing a comment does not restart a logger. A file that
+        cannot be parsed is reported in the log and otherwise ignored until
+        it is modified again, i.e., the logger keeps its last configuration.
+
+        Parameters
+        ----------
+        config_path : str
+            A config file or a directory of .logger files
+
+        Attributes
+        ----------
+        configs : dict
+            Maps the name of each logger to its parsed configuration
+        paths : dict
+            Maps the name of each logger to the path of its config file
+    """
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self.configs = {}
+        self.paths = {}
+        self.mtimes = {}
+
+    def poll(self):
+        """
+            Parse new and modified config files
+
+            Returns
+            -------
+            added, changed, removed : list of str
+                The names of the loggers whose config file was added,
+                changed or removed since the previous call
+        """
+        added = []
+        changed = []
+        current = {}
+        for path in config_files(self.config_path):
+            name = logger_name(path)
+            current[name] = path
+            try:
+                mtimes = self._mtimes(path)
+            except OSError:
+                # the file was removed meanwhile
+                continue
+            # the path of the file is one of the keys
+            if self.mtimes.get(name) == mtimes:
+                continue
+            self.mtimes[name] = mtimes
+            try:
+                config = parse_config_file(path)
+            except Exception:
+                log.error("Parsing config file %s failed", path,
+                          exc_info=True)
+                continue
+            if name not in self.configs:
+                added.append(name)
+            elif config != self.configs[name]:
+                changed.append(name)
+            self.configs[name] = config
+            self.paths[name] = path
+        removed = [name for name in self.configs if name not in current]
+        for name in removed:
+            del self.configs[name]
+            del self.paths[name]
+        for name in list(self.mtimes):
+            if name not in current:
+                del self.mtimes[name]
+        return added, changed, removed
+
+    def _mtimes(self, path):
+        try:
+            files = config_chain(path)
+        except (OSError, configparser.Error, ConfigError):
+            # the error is reported when the file is parsed
+            files = [path]
+        return {file: os.stat(file).st_mtime_ns for file in files}
@@ -1,4 +1,12 @@
-from collections import Iterable
+from collections.abc import Iterable
+from datetime import datetime, timezone
+from time import monotonic
+import asyncio
+import logging
+
+from BeamlineStatusLogger.sources import Data
+
+log = logging.getLogger(__name__)
 
 
 def as_iterable(object):
@@ -8,14 +16,148 @@ def as_iterable(object):
         return [object]
 
 
+def stage_name(proc, index):
+    name = getattr(proc, "__name__", type(proc).__name__)
+    return "processor{}_{}".format(index, name)
+
+
+class LoggerStats:
+    """
+        Collects the durations of the stages of a logger cycle
+
+        The durations of the timer, the source, each processor and the sink
+        are measured with a monotonic clock. Every `interval` seconds, the
+        count, mean and maximum duration of each stage are written as one
+        data object to `sink`, together with the number of cycles and
+        overruns. An overrun is a cycle whose work, i.e., everything but the
+        timer, took longer than the period of the timer. Additionally, the
+        increase of each watched counter during the interval is written.
+
+        Parameters
+        ----------
+        sink : Sink
+            Receives the statistics, e.g., an `InfluxDBSink` writing to a
+            separate measurement
+        interval : number
+            The time in seconds between two writes
+        metadata : dict_like
+            The metadata is added to every written data object
+    """
+    def __init__(self, sink, interval=60, metadata={}):
+        self.sink = sink
+        self.interval = interval
+        self.metadata = metadata
+        self.counters = {}
+        self.reset()
+
+    def reset(self):
+        """
+            Discard all collected durations
+        """
+        self.durations = {}
+        self.cycles = 0
+        self.overruns = 0
+        self.counts = {name: counter()
+                       for name, counter in self.counters.items()}
+        self.start = monotonic()
+
+    def watch(self, name, counter):
+        """
+            Write the increase of `counter()` per interval as `name`
+        """
+        self.counters[name] = counter
+        self.counts[name] = counter()
+
+    def add(self, stage, duration):
+        """
+            Record the `duration` of `stage` in seconds
+        """
+        stats = self.durations.get(stage)
+        if stats is None:
+            self.durations[stage] = [1, duration, duration]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+            if duration > stats[2]:
+                stats[2] = duration
+
+    def add_cycle(self, duration, period=None):
+        """
+            Record a cycle whose work took `duration` seconds
+        """
+        self.cycles += 1
+        if period is not None and duration > period:
+            self.overruns += 1
+
+    def due(self):
+        """
+            Return True if the statistics should be written
+        """
+        return monotonic() - self.start >= self.interval
+
+    def to_data(self):
+        value = {"cycles": self.cycles, "overruns": self.overruns}
+        for name, counter in self.counters.items():
+            value[name] = counter() - self.counts[name]
+        for stage, (count, total, maximum) in self.durations.items():
+            value[stage + "_count"] = count
+            value[stage + "_mean"] = total/count
+            value[stage + "_max"] = maximum
+        return Data(datetime.now(timezone.utc), value,
+                    metadata=self.metadata.copy())
+
+    def write(self):
+        """
+            Write the statistics to the sink and reset them
+
+            Failures of the sink are logged but do not affect the logger.
+        """
+        if self.cycles or self.durations:
+            try:
+                if not self.sink.write(self.to_data()):
+                    log.warning("Writing the logger statistics failed")
+            except Exception:
+                log.warning("Writing the logger statistics failed",
+                            exc_info=True)
+        self.reset()
+
+    def close(self):
+        close = getattr(self.sink, "close", None)
+        if close:
+            close()
+
+
 class Logger:
-    def __init__(self, source, processors, sink, timer):
+    """
+        Periodically reads data from a source, processes and writes it
+
+        Parameters
+        ----------
+        source : Source
+        processors : processor or iterable of processors
+        sink : Sink
+        timer : Timer
+            If the timer has a `bind` method, it is called with the source
+        stats : LoggerStats, optional
+            If given, the duration of each stage of every cycle is recorded.
+            If the source counts dropped data, e.g., a `LatestOnlySource`,
+            the number of drops is recorded as "source_dropped"
+    """
+    def __init__(self, source, processors, sink, timer, stats=None):
         self.source = source
         self.processors = as_iterable(processors)
         self.sink = sink
         self.timer = timer
+        self.stats = stats
+        if stats is not None and hasattr(source, "dropped"):
+            stats.watch("source_dropped", lambda: source.dropped)
+        bind = getattr(timer, "bind", None)
+        if bind:
+            bind(source)
 
     def run(self):
+        if self.stats is not None:
+            return self._run_instrumented()
         self.timer.reset()
         success = True
         while self.timer(success):
@@ -24,5 +166,122 @@ class Logger:
                 data = proc(data)
             success = self.sink.write(data)
 
+    def _run_instrumented(self):
+        stats = self.stats
+        names = [stage_name(proc, i)
+                 for i, proc in enumerate(self.processors)]
+        self.timer.reset()
+        stats.reset()
+        success = True
+        try:
+            while True:
+                t0 = monotonic()
+                if not self.timer(success):
+                    break
+                t1 = monotonic()
+                data = self.source.read()
+                t2 = monotonic()
+                stats.add("timer", t1 - t0)
+                stats.add("read", t2 - t1)
+                for name, proc in zip(names, self.processors):
+                    t = monotonic()
+                    data = proc(data)
+                    stats.add(name, monotonic() - t)
+                t3 = monotonic()
+                success = self.sink.write(data)
+                t4 = monotonic()
+                stats.add("write", t4 - t3)
+                stats.add_cycle(t4 - t1, getattr(self.timer, "period", None))
+                if stats.due():
+                    stats.write()
+        finally:
+            stats.write()
+
     def abort(self):
         self.timer.abort()
+
+    def close(self):
+        """
+            Release the resources of all components with a close method
+        """
+        for component in [self.source, *self.processors, self.sink,
+                          self.timer, self.stats]:
+            close = getattr(component, "close", None)
+            if close:
+                close()
+
+
+def is_async(func):
+    """
+        Return True if calling `func` returns a coroutine
+    """
+    return (asyncio.iscoroutinefunction(func) or
+            asyncio.iscoroutinefunction(getattr(func, "__call__", None)))
+
+
+class AsyncLogger(Logger):
+    """
+        A logger that runs as a coroutine on an asyncio event loop
+
+        Many instances can share one event loop and thereby one thread. The
+        timer must be asynchronous, e.g., an `AsyncSynchronizedPeriodicTimer`.
+        The `read` method of the source and the `write` method of the sink
+        may be coroutines. Otherwise, they are executed in the default
+        executor of the event loop, as are the processors.
+    """
+    def __init__(self, source, processors, sink, timer, stats=None):
+        if not is_async(timer):
+            raise TypeError("The timer of an AsyncLogger must return a "
+                            "coroutine")
+        super().__init__(source, processors, sink, timer, stats=stats)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stats = self.stats
+        self.timer.reset()
+        if stats is not None:
+            stats.reset()
+        success = True
+        try:
+            while True:
+                t0 = monotonic()
+                if not await self.timer(success):
+                    break
+                t1 = monotonic()
+                if is_async(self.source.read):
+                    data = await self.source.read()
+                else:
+                    data = await loop.run_in_executor(None, self.source.read)
+                t2 = monotonic()
+                if self.processors:
+                    data = await loop.run_in_executor(None, self._process,
+                                                      data)
+                t3 = monotonic()
+                if is_async(self.sink.write):
+                    success = await self.sink.write(data)
+                else:
+                    success = await loop.run_in_executor(
+                        None, self.sink.write, data)
+                if stats is not None:
+                    t4 = monotonic()
+                    stats.add("timer", t1 - t0)
+                    stats.add("read", t2 - t1)
+                    stats.add("write", t4 - t3)
+                    stats.add_cycle(t4 - t1,
+                                    getattr(self.timer, "period", None))
+                    if stats.due():
+                        await loop.run_in_executor(None, stats.write)
+        finally:
+            if stats is not None:
+                await loop.run_in_executor(None, stats.write)
+
+    def _process(self, data):
+        if self.stats is None:
+            for proc in self.processors:
+                data = proc(data)
+            return data
+        for i, proc in enumerate(self.processors):
+            t = monotonic()
+            data = proc(data)
+            self.stats.add(stage_name(proc, i), monotonic() - t)
+        return data
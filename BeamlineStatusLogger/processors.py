@@ -1,13 +1,26 @@
 import BeamlineStatusLogger.utils as utils
+from BeamlineStatusLogger.archive import FrameArchiver
 from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import functools
+import importlib
+import logging
+import multiprocessing
 import os
+import re
+import threading
+import time
+import traceback
+import weakref
+try:
+    from multiprocessing import shared_memory
+except ImportError as err:  # Python < 3.8
+    shared_memory = None
+    shared_memory_import_err = err
 import numpy as np
-# Work around GTK backend issue with pandas, see
-# https://github.com/pandas-dev/pandas/issues/23040
-import matplotlib
-matplotlib.use("agg")
-import matplotlib.pyplot as plt  # noqa
+
+log = logging.getLogger(__name__)
 
 
 def pass_failures(func):
@@ -32,6 +45,123 @@ def pass_failures(func):
     return wrapper
 
 
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(max_workers=None):
+    """
+        Return the process pool that is shared by all processors
+
+        The pool is created on the first call. Later calls return the same
+        pool and ignore `max_workers`.
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            The number of worker processes. Defaults to the number of CPUs
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # forking a process with running logger threads is unsafe
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+            else:
+                context = None
+            _process_pool = ProcessPoolExecutor(max_workers,
+                                                mp_context=context)
+        return _process_pool
+
+
+def _discard_process_pool(pool):
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False)
+
+
+def _call_shared(func, name, shape, dtype, args, kwargs):
+    # executed in a worker process of the pool
+    shm = shared_memory.SharedMemory(name=name)
+    img = None
+    try:
+        img = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        return func(img, *args, **kwargs)
+    except Exception as err:
+        # the traceback must not keep views of the shared buffer alive
+        traceback.clear_frames(err.__traceback__)
+        raise
+    finally:
+        img = None
+        shm.close()
+
+
+def _unlink_shared(shm):
+    shm.close()
+    shm.unlink()
+
+
+class SharedImageCaller:
+    """
+        Call functions of an image in a worker process of the process pool
+
+        The image is copied into a shared memory block instead of being
+        pickled. The block is reused as long as it is large enough.
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            Forwarded to `get_process_pool`
+    """
+    def __init__(self, max_workers=None):
+        if shared_memory is None:
+            raise shared_memory_import_err
+        self.max_workers = max_workers
+        self.shm = None
+        self._finalizer = None
+
+    def __call__(self, func, img, *args, **kwargs):
+        """
+            Return `func(img, *args, **kwargs)` evaluated in the process pool
+
+            Exceptions raised by `func` are reraised. If a worker process
+            died, the pool is replaced on the next call.
+        """
+        img = np.asarray(img)
+        shm = self._get_shared_memory(img.nbytes)
+        shared = np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf)
+        shared[...] = img
+        del shared
+        pool = get_process_pool(self.max_workers)
+        try:
+            future = pool.submit(_call_shared, func, shm.name, img.shape,
+                                 img.dtype.str, args, kwargs)
+            return future.result()
+        except BrokenProcessPool:
+            _discard_process_pool(pool)
+            raise
+
+    def close(self):
+        """
+            Release the shared memory block
+        """
+        if self._finalizer:
+            self._finalizer()
+        self.shm = None
+        self._finalizer = None
+
+    def _get_shared_memory(self, size):
+        if self.shm is None or self.shm.size < size:
+            self.close()
+            self.shm = shared_memory.SharedMemory(create=True,
+                                                  size=max(size, 1))
+            self._finalizer = weakref.finalize(self, _unlink_shared,
+                                               self.shm)
+        return self.shm
+
+
 def ToString():
     """
         A processor that converts all values to strings
@@ -48,6 +178,179 @@ def ToString():
     return to_string
 
 
+def _call_local(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+# offsets of the 8 neighbours of a pixel
+_NEIGHBOURS = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+               if dy or dx]
+
+
+class DeadPixelMap:
+    """
+        A persistent map of the dead and hot pixels of a camera
+
+        Dead pixels are physical and stable. Instead of searching them in
+        every frame, the map is learned from the pixels that `improve_img`
+        replaces in `learn_frames` frames. Pixels replaced in at least the
+        fraction `threshold` of these frames are considered bad. Afterwards,
+        only the bad pixels are corrected by the median of their good
+        neighbours.
+
+        If the map is older than `max_age`, it is learned again from the next
+        frames while the old map is kept until the new one is complete.
+        These frames are still corrected with the old map, but are also
+        filtered with `improve_img` for learning.
+
+        Parameters
+        ----------
+        shape : tuple of int
+            The shape of the images
+        path : str, optional
+            If given, the map is loaded from and saved to this npz file
+        learn_frames : int, optional
+            The number of frames the map is learned from
+        threshold : number, optional
+            The fraction of frames in which a pixel must be replaced to be
+            considered bad
+        max_age : number, optional
+            The time in seconds after which the map is learned again
+    """
+    def __init__(self, shape, path=None, learn_frames=20, threshold=0.5,
+                 max_age=24*3600):
+        self.shape = tuple(shape)
+        self.path = path
+        self.learn_frames = learn_frames
+        self.threshold = threshold
+        self.max_age = max_age
+        self.mask = None
+        self.created = None
+        self._counts = None
+        self._frames = 0
+        if path and os.path.exists(path):
+            try:
+                self.load()
+            except (OSError, ValueError, KeyError):
+                log.warning("Ignoring the dead pixel map %s", path,
+                            exc_info=True)
+
+    @property
+    def ready(self):
+        """
+            True if a map was learned or loaded
+        """
+        return self.mask is not None
+
+    def needs_update(self):
+        """
+            Return True if frames should be passed to `update`
+        """
+        return (self.mask is None or
+                time.time() - self.created > self.max_age)
+
+    def update(self, replaced):
+        """
+            Count the pixels replaced in one frame
+
+            Once `learn_frames` frames were counted, the map is replaced and
+            saved.
+
+            Parameters
+            ----------
+            replaced : ndarray of bool
+                The pixels that `improve_img` replaced in a frame
+        """
+        if replaced.shape != self.shape:
+            raise ValueError("Expected an image of shape {}, got {}"
+                             .format(self.shape, replaced.shape))
+        if self._counts is None:
+            self._counts = np.zeros(self.shape, np.uint16)
+            self._frames = 0
+        self._counts += replaced
+        self._frames += 1
+        if self._frames >= self.learn_frames:
+            self.set_mask(self._counts >= self.threshold*self._frames)
+            self._counts = None
+            if self.path:
+                self.save()
+
+    def set_mask(self, mask, created=None):
+        """
+            Use `mask` as map of the bad pixels
+        """
+        self.mask = np.asarray(mask, bool)
+        self.created = time.time() if created is None else created
+        rows, cols = np.nonzero(self.mask)
+        height, width = self.shape
+        n_rows = np.empty((len(rows), len(_NEIGHBOURS)), np.intp)
+        n_cols = np.empty_like(n_rows)
+        for i, (dy, dx) in enumerate(_NEIGHBOURS):
+            n_rows[:, i] = rows + dy
+            n_cols[:, i] = cols + dx
+        good = ((n_rows >= 0) & (n_rows < height) &
+                (n_cols >= 0) & (n_cols < width))
+        np.clip(n_rows, 0, height - 1, out=n_rows)
+        np.clip(n_cols, 0, width - 1, out=n_cols)
+        good &= ~self.mask[n_rows, n_cols]
+        # pixels without a good neighbour cannot be corrected
+        correctable = good.any(axis=1)
+        self._index = (rows[correctable], cols[correctable],
+                       n_rows[correctable], n_cols[correctable],
+                       good[correctable])
+
+    def correct(self, img, out=None):
+        """
+            Return a copy of `img` in which the bad pixels are replaced
+
+            Each bad pixel is replaced by the median of its neighbours that
+            are not bad themselves. If given, the copy is written to `out`.
+        """
+        if img.shape != self.shape:
+            raise ValueError("Expected an image of shape {}, got {}"
+                             .format(self.shape, img.shape))
+        if out is None:
+            corrected = img.copy()
+        else:
+            corrected = out
+            np.copyto(corrected, img)
+        rows, cols, n_rows, n_cols, good = self._index
+        if rows.size:
+            values = img[n_rows, n_cols].astype(np.float64)
+            values[~good] = np.nan
+            corrected[rows, cols] = np.nanmedian(values, axis=1)
+        return corrected
+
+    def save(self):
+        """
+            Save the map to `path`
+        """
+        tmp = self.path + ".tmp.npz"
+        np.savez_compressed(tmp, mask=self.mask, created=self.created)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        """
+            Load the map from `path`
+        """
+        with np.load(self.path) as f:
+            mask = f["mask"]
+            created = float(f["created"])
+        if mask.shape != self.shape:
+            raise ValueError("The dead pixel map " + self.path +
+                             " does not match the image shape")
+        self.set_mask(mask, created)
+
+
+def dead_pixel_map_path(directory, camera, shape):
+    """
+        Return the path of the dead pixel map of a camera and image shape
+    """
+    name = re.sub(r"[^\w.-]+", "_", camera).strip("_")
+    return os.path.join(directory,
+                        "{}_{}x{}.npz".format(name, shape[0], shape[1]))
+
+
 class PeakFitter:
     """
         A processor that expects an image and returns the parameters of a
@@ -72,7 +375,15 @@ class PeakFitter:
         cutoff : float
             The maximum value of the peak
     """
-    def __init__(self, key=None, log_dir=None, log_thresh=1):
+    def __init__(self, key=None, log_dir=None, log_thresh=1, log_max_rate=1,
+                 log_max_bytes=None, log_render=True, log_format="files",
+                 log_chunk_frames=100, track=False,
+                 track_window=5, track_drift=10, track_residual=0.1,
+                 process_pool=False, pool_workers=None, binning=1,
+                 dead_pixel_dir=None, camera=None, dead_pixel_frames=20,
+                 dead_pixel_max_age=24*3600, dtype="float32",
+                 background="median", background_step=4,
+                 background_smoothing=0):
         """
             Construct a PeakFitter processor instance
 
@@ -87,10 +398,103 @@ class PeakFitter:
             log_thresh : number, optional
                 Threshold for logging peak movements. Only has an effect if
                 `log_dir` is given.
+            log_max_rate : number, optional
+                The maximum number of logged images per second. The images
+                are saved by a background thread
+            log_max_bytes : int, optional
+                The disk quota of the logged images. If it is exceeded, the
+                oldest images are deleted
+            log_render : Boolean, optional
+                If False, the plots of the logged images are not rendered.
+                They can be rendered later with
+                `archive.render_archived_frame`
+            log_format : {"files", "chunked"}, optional
+                If "chunked", the logged images and their fits are appended
+                to the compressed chunks of an `archive.ChunkedFrameStore`
+                in `log_dir` instead of being saved as separate files
+            log_chunk_frames : int, optional
+                The number of images per chunk if `log_format` is "chunked"
+            track : Boolean, optional
+                If True and the previous fit was successful, the peak is only
+                refitted within a window around its last position, starting
+                from the last parameters. The full search is only done if
+                tracking fails
+            track_window : number, optional
+                Half size of the tracking window in units of the larger
+                standard deviation of the last fit
+            track_drift : number, optional
+                Maximum peak movement in pixels between two frames before
+                tracking falls back to the full search
+            track_residual : number, optional
+                Maximum rms residual of the tracking fit relative to the peak
+                height before tracking falls back to the full search
+            process_pool : Boolean, optional
+                If True, the fits are computed in a process pool that is
+                shared by all PeakFitter instances. The image is passed to
+                the worker process through shared memory
+            pool_workers : int, optional
+                The number of worker processes. Only has an effect for the
+                first instance that uses the process pool
+            binning : int, optional
+                If larger than 1, the search for the peak is done on an image
+                binned by this factor and only the region of interest is
+                fitted at full resolution
+            dead_pixel_dir : str, optional
+                If given, a `DeadPixelMap` per image shape is learned and
+                saved in this directory. Once learned, only the pixels in
+                the map are corrected instead of filtering each frame with
+                `improve_img`. The directory must exist
+            camera : str, optional
+                The name of the camera, which identifies its dead pixel maps.
+                Required if `dead_pixel_dir` is given
+            dead_pixel_frames : int, optional
+                The number of frames a dead pixel map is learned from
+            dead_pixel_max_age : number, optional
+                The time in seconds after which a dead pixel map is learned
+                again
+            dtype : str or data-type, optional
+                The floating point type in which the image is processed. The
+                final fit on the region of interest always uses float64
+            background : {"median", "subsample", "histogram"}, optional
+                The method used to estimate the background of each image
+            background_step : int, optional
+                The stride of the "subsample" background method
+            background_smoothing : number, optional
+                The weight in [0, 1) of the previous background estimate in
+                an exponential moving average over consecutive images. Not
+                supported together with `process_pool`
+
+            See Also
+            --------
+            BeamlineStatusLogger.utils.get_peak_parameters
+            BeamlineStatusLogger.utils.track_peak_parameters
         """
         self.key = key
         self.log_dir = log_dir
         self.log_thresh = log_thresh
+        self.track = track
+        self.track_window = track_window
+        self.track_drift = track_drift
+        self.track_residual = track_residual
+        self.binning = binning
+        self.dtype = np.dtype(dtype)
+        # import the fitting dependencies now instead of at the first frame
+        for module in utils.FIT_MODULES:
+            importlib.import_module(module)
+        self.background = utils.BackgroundEstimator(
+            background, step=background_step, smoothing=background_smoothing)
+        self.last_fit = None
+        if process_pool and background_smoothing:
+            # the estimator is copied to the worker for every image
+            raise ValueError("Background smoothing is not supported with a "
+                             "process pool")
+        if process_pool:
+            self.call = SharedImageCaller(pool_workers)
+            # the workers cannot share the buffers of this instance
+            self.buffers = None
+        else:
+            self.call = _call_local
+            self.buffers = utils.WorkBuffers()
         self.last_h = None
         self.last_a = None
         self.last_x0 = None
@@ -101,8 +505,24 @@ class PeakFitter:
         self.last_cutoff = None
 
         if self.log_dir:
-            if not os.path.isdir(self.log_dir):
-                raise ValueError(self.log_dir + " is not a directory")
+            self.archiver = FrameArchiver(
+                self.log_dir, max_rate=log_max_rate, max_bytes=log_max_bytes,
+                render=log_render, format=log_format,
+                chunk_frames=log_chunk_frames)
+        else:
+            self.archiver = None
+
+        self.dead_pixel_dir = dead_pixel_dir
+        self.camera = camera
+        self.dead_pixel_frames = dead_pixel_frames
+        self.dead_pixel_max_age = dead_pixel_max_age
+        self.dead_pixel_maps = {}
+        if dead_pixel_dir:
+            if not os.path.isdir(dead_pixel_dir):
+                raise ValueError(dead_pixel_dir + " is not a directory")
+            if not camera:
+                raise ValueError("A camera name is required for dead pixel "
+                                 "maps")
 
     @pass_failures
     def __call__(self, data):
@@ -114,12 +534,8 @@ class PeakFitter:
         if img is None:
             return data
 
-        img = img.astype(np.float64)
-
-        try:
-            p_fit = utils.get_peak_parameters(img)
-        except utils.FittingError:
-            p_fit = None
+        # get_peak_parameters converts the image to self.dtype
+        p_fit = self.fit(img)
 
         if p_fit:
             self.log_frames(data.timestamp, img, p_fit)
@@ -144,6 +560,92 @@ class PeakFitter:
 
         return data
 
+    def fit(self, img):
+        """
+            Fit the peak parameters of an image
+
+            Returns the parameters from `get_peak_parameters` or None if no
+            peak was found. In tracking mode, the last successful fit is used
+            as the starting point if possible. If a worker process of the
+            process pool died, the fit is retried once on a new pool and
+            counts as failed if this breaks as well.
+        """
+        improve = True
+        if self.dead_pixel_dir:
+            img = self.correct_dead_pixels(img)
+            improve = False
+
+        p_fit = None
+        if self.track and self.last_fit:
+            try:
+                p_fit = self._call(
+                    utils.track_peak_parameters,
+                    img, self.last_fit, n_sigma=self.track_window,
+                    max_drift=self.track_drift,
+                    max_residual=self.track_residual, improve=improve)
+            except utils.FittingError:
+                p_fit = None
+
+        if p_fit is None:
+            try:
+                p_fit = self._call(utils.get_peak_parameters, img,
+                                   binning=self.binning, improve=improve,
+                                   dtype=self.dtype, buffers=self.buffers,
+                                   background=self.background)
+            except utils.FittingError:
+                p_fit = None
+
+        self.last_fit = p_fit
+        return p_fit
+
+    def _call(self, func, img, *args, **kwargs):
+        # the shared pool is replaced after a worker died, e.g., because it
+        # ran out of memory, which breaks the calls of all PeakFitters
+        for retry in [True, False]:
+            try:
+                return self.call(func, img, *args, **kwargs)
+            except BrokenProcessPool:
+                log.warning("A worker of the process pool died%s",
+                            ", retrying" if retry else "", exc_info=True)
+        raise utils.FittingError("The process pool is broken")
+
+    def correct_dead_pixels(self, img):
+        """
+            Correct the dead pixels of an image with its dead pixel map
+
+            Until the first map of the image shape is learned, the image
+            is filtered with `improve_img` instead. While an outdated map
+            is learned again, it is still used.
+        """
+        dead_pixels = self.dead_pixel_maps.get(img.shape)
+        if dead_pixels is None:
+            path = dead_pixel_map_path(self.dead_pixel_dir, self.camera,
+                                       img.shape)
+            dead_pixels = DeadPixelMap(img.shape, path,
+                                       learn_frames=self.dead_pixel_frames,
+                                       max_age=self.dead_pixel_max_age)
+            self.dead_pixel_maps[img.shape] = dead_pixels
+
+        if dead_pixels.needs_update():
+            improved = utils.improve_img(img)
+            dead_pixels.update(improved != img)
+            if not dead_pixels.ready:
+                return improved
+        if self.buffers is None:
+            return dead_pixels.correct(img)
+        return dead_pixels.correct(
+            img, out=self.buffers.get("dead_pixels", img.shape, img.dtype))
+
+    def close(self):
+        """
+            Release the resources used for the process pool and archive the
+            remaining logged images
+        """
+        if isinstance(self.call, SharedImageCaller):
+            self.call.close()
+        if self.archiver is not None:
+            self.archiver.close()
+
     def log_frames(self, time, img, p):
         if self.log_dir:
             h, a, x0, y0, sx, sy, theta, cutoff = p
@@ -151,13 +653,7 @@ class PeakFitter:
                (self.last_y0 and abs(y0 - self.last_y0) > self.log_thresh) or
                (self.last_sx and abs(sx - self.last_sx) > self.log_thresh) or
                (self.last_sy and abs(sy - self.last_sy) > self.log_thresh)):
-                filename = os.path.join(self.log_dir,
-                                        "img_" + time.isoformat())
-                np.save(filename, img)
-                utils.plot_gauss(img, p)
-                plt.savefig(filename + ".png")
-                utils.plot_gauss(img, p, zoom=True)
-                plt.savefig(filename + "_zoomed.png")
+                self.archiver.submit(time, img, p)
 
             self.last_h = h
             self.last_a = a
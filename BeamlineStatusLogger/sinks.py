@@ -1,12 +1,250 @@
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+from influxdb.line_protocol import make_lines
 from collections.abc import Mapping
+import glob
+import itertools
+import logging
 import os
+import queue
+import threading
+from time import monotonic
+
+log = logging.getLogger(__name__)
 
 
 def filter_nones(dic):
     return {key: value for key, value in dic.items() if value is not None}
 
 
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _is_transient(err):
+    # connection problems and server errors may go away, while the server
+    # rejects the same points again, e.g., due to a field type conflict
+    if isinstance(err, (OSError, InfluxDBServerError)):
+        return True
+    return (isinstance(err, InfluxDBClientError) and err.code is not None and
+            err.code >= 500)
+
+
+class LineProtocolSpool:
+    """An append-only on-disk spool of InfluxDB line protocol records.
+
+    Records are appended to a segment file that is closed once it grows
+    larger than `segment_bytes` or, when a segment is claimed, if it is
+    older than `segment_age`. Closed
+    segments can be claimed for replay and are removed afterwards, or
+    renamed to .rejected if the database refuses them. If the spool
+    directory grows larger than `max_bytes`, the oldest rejected and then
+    the oldest closed segments are deleted.
+
+    Several spools, also in different processes, can share a directory as
+    long as all records belong to the same database. Segments left behind by
+    a process that died are picked up when a new spool is created.
+
+    Parameters
+    ----------
+    directory : string
+        The spool directory. It is created if it does not exist
+    max_bytes : int
+        The maximum disk usage of the directory
+    segment_bytes : int
+        The size at which a segment is closed
+    segment_age : number
+        The time in seconds after which a segment is closed
+    """
+    _counter = itertools.count()
+
+    def __init__(self, directory, max_bytes=100*2**20, segment_bytes=2**20,
+                 segment_age=60):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.prefix = "{}_{}_".format(os.getpid(), next(self._counter))
+        self.seq = itertools.count()
+        self.file = None
+        self.opened = None
+        self.lock = threading.Lock()
+        self._recover()
+
+    def append(self, lines):
+        """
+            Append line protocol records to the current segment
+        """
+        with self.lock:
+            if self.file is None:
+                name = "{}{:08d}.open".format(self.prefix, next(self.seq))
+                self.file = open(os.path.join(self.directory, name), "a")
+                self.opened = monotonic()
+            self.file.write("".join(line + "\n" for line in lines))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            if self.file.tell() >= self.segment_bytes:
+                self._close_segment()
+            self._enforce_limit()
+
+    def claim(self):
+        """
+            Claim the oldest closed segment for replay
+
+            The current segment is closed first, if it reached its size or
+            age limit.
+
+            Returns
+            -------
+            string or None
+                The path of the claimed segment or None if the spool is empty
+        """
+        with self.lock:
+            if self.file is not None and (
+                    self.file.tell() >= self.segment_bytes or
+                    monotonic() - self.opened >= self.segment_age):
+                self._close_segment()
+        for path in self._segments():
+            claimed = "{}.{}.replay".format(path[:-len(".lp")], os.getpid())
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # claimed by someone else in the meantime
+                continue
+            return claimed
+        return None
+
+    def release(self, path, done):
+        """
+            Remove a claimed segment if `done` or return it to the spool
+        """
+        if done:
+            os.remove(path)
+        else:
+            os.rename(path, path.rsplit(".", 2)[0] + ".lp")
+
+    def reject(self, path):
+        """
+            Keep a claimed segment that the database refused as .rejected
+
+            Rejected segments are not replayed again but can be inspected and
+            are deleted first if the spool is full.
+        """
+        rejected = path.rsplit(".", 2)[0] + ".rejected"
+        os.rename(path, rejected)
+        return rejected
+
+    def size(self):
+        """
+            Return the disk usage of the spool directory in bytes
+        """
+        size = 0
+        for path in glob.glob(os.path.join(self.directory, "*")):
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return size
+
+    def close(self):
+        """
+            Close the current segment
+        """
+        with self.lock:
+            self._close_segment()
+
+    def _close_segment(self):
+        if self.file is not None:
+            self.file.close()
+            path = self.file.name
+            self.file = None
+            os.rename(path, path[:-len(".open")] + ".lp")
+
+    def _segments(self):
+        paths = glob.glob(os.path.join(self.directory, "*.lp"))
+        return sorted(paths, key=_mtime)
+
+    def _enforce_limit(self):
+        rejected = glob.glob(os.path.join(self.directory, "*.rejected"))
+        segments = sorted(rejected, key=_mtime) + self._segments()
+        size = self.size()
+        while size > self.max_bytes and segments:
+            path = segments.pop(0)
+            try:
+                segment_size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            log.warning("Spool is full, dropped %s", path)
+            size -= segment_size
+
+    def _recover(self):
+        for path in glob.glob(os.path.join(self.directory, "*.open")):
+            pid = int(os.path.basename(path).split("_")[0])
+            if not _pid_alive(pid):
+                os.rename(path, path[:-len(".open")] + ".lp")
+        for path in glob.glob(os.path.join(self.directory, "*.replay")):
+            pid = int(path.rsplit(".", 2)[1])
+            if not _pid_alive(pid):
+                self.release(path, done=False)
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
+
+
+class InfluxDBClientPool:
+    """A thread-safe cache of InfluxDBClient instances.
+
+    Sinks with the same connection parameters share one client and thereby
+    its HTTP connections, also after a logger was rebuilt. Clients are
+    created on first use.
+    """
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def get(self, host, port, database, **kwargs):
+        """
+            Return the client for the given parameters, creating it if
+            necessary
+
+            Additional parameters are forwarded to the InfluxDBClient.
+        """
+        key = (host, str(port), database, repr(sorted(kwargs.items())))
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                client = InfluxDBClient(host, port, database=database,
+                                        **kwargs)
+                self.clients[key] = client
+            return client
+
+    def clear(self):
+        """
+            Remove all clients from the pool
+        """
+        with self.lock:
+            self.clients.clear()
+
+    def __len__(self):
+        return len(self.clients)
+
+
+#: The client pool shared by all sinks of this process
+influxdb_clients = InfluxDBClientPool()
+
+
 class InfluxDBSink:
     """A wrapper around an InfluxDBClient that satisfies the Sink interface.
 
@@ -30,16 +268,38 @@ class InfluxDBSink:
         If True, the database is created if it does not already exist
     metadata : mapping
         These entries are appended as the tags to each point
+    spool_dir : string
+        If given, points that cannot be written are appended to a
+        `LineProtocolSpool` in a subdirectory named after the database and
+        written later by a background thread. Spooled points count as
+        successfully written. Only points that failed due to connection or
+        server errors are spooled. Points that the database rejects, e.g.,
+        due to a field type conflict, are dropped
+    spool_max_bytes : int
+        The maximum disk usage of the spool
+    spool_segment_age : number
+        The maximum time in seconds points are spooled before they can be
+        replayed
+    replay_interval : number
+        The time in seconds between attempts to write spooled points
+    replay_batch_size : int
+        The maximum number of spooled points per request
 
-    Additional parameters are forwarded to the InfluxDBClient.
+    Additional parameters are forwarded to the InfluxDBClient, which is
+    shared with other sinks through `influxdb_clients`.
     """
     def __init__(self, database, measurement,
                  host=os.environ.get("INFLUXDB_HOST", "localhost"),
                  port=os.environ.get("INFLUXDB_PORT", "8086"),
                  create_db=False,
                  metadata={},
+                 spool_dir=None,
+                 spool_max_bytes=100*2**20,
+                 spool_segment_age=60,
+                 replay_interval=10,
+                 replay_batch_size=5000,
                  **kwargs):
-        self.client = InfluxDBClient(host, port, database=database, **kwargs)
+        self.client = influxdb_clients.get(host, port, database, **kwargs)
         self.measurement = measurement
         self.metadata = metadata
         if create_db:
@@ -49,16 +309,112 @@ class InfluxDBSink:
             if not {"name": database} in self.client.get_list_database():
                 raise ValueError("Database " + database + " does not exist")
 
+        if spool_dir:
+            self.spool = LineProtocolSpool(os.path.join(spool_dir, database),
+                                           max_bytes=spool_max_bytes,
+                                           segment_age=spool_segment_age)
+            self.replay_interval = replay_interval
+            self.replay_batch_size = replay_batch_size
+            self._stop_replay = threading.Event()
+            self._replay_thread = threading.Thread(target=self._replay_loop,
+                                                   daemon=True)
+            self._replay_thread.start()
+        else:
+            self.spool = None
+
     def write(self, data):
         point = self._format(data)
         if point["fields"]:
-            success = self.client.write_points([point])
+            success = self._write_points([point])
             success = success and data.failure is None
             return success
         else:
             point["fields"] = {"NoValue": True}
-            self.client.write_points([point])
+            self._write_points([point])
+            return False
+
+    def replay(self):
+        """
+            Write spooled points to the database
+
+            Replaying stops at the first segment that fails due to a
+            connection or server error. A segment that the database rejects
+            is kept as .rejected and the next segment is replayed.
+
+            Returns
+            -------
+            int
+                The number of written points
+        """
+        count = 0
+        while True:
+            path = self.spool.claim()
+            if path is None:
+                return count
+            with open(path) as f:
+                lines = f.read().splitlines()
+            try:
+                for i in range(0, len(lines), self.replay_batch_size):
+                    batch = lines[i:i+self.replay_batch_size]
+                    if not self.client.write_points(batch, protocol="line"):
+                        self.spool.release(path, done=False)
+                        return count
+                    count += len(batch)
+            except Exception as err:
+                if _is_transient(err):
+                    log.debug("Replaying spooled points failed",
+                              exc_info=True)
+                    self.spool.release(path, done=False)
+                    return count
+                path = self.spool.reject(path)
+                log.warning("The database rejected spooled points, kept "
+                            "them in %s", path, exc_info=True)
+            else:
+                self.spool.release(path, done=True)
+
+    def close(self):
+        """
+            Stop replaying spooled points
+        """
+        if self.spool is not None:
+            self._stop_replay.set()
+            self._replay_thread.join()
+            self.spool.close()
+
+    def _write_points(self, points):
+        if self.spool is None:
+            return self.client.write_points(points)
+
+        try:
+            if self.client.write_points(points):
+                return True
+        except Exception as err:
+            if not _is_transient(err):
+                log.warning("The database rejected %d points",
+                            len(points), exc_info=True)
+                return False
+            log.warning("Writing %d points failed, spooling them",
+                        len(points), exc_info=True)
+        return self._spool_points(points)
+
+    def _spool_points(self, points):
+        try:
+            self.spool.append(make_lines({"points": points}).splitlines())
+        except OSError:
+            log.error("Spooling %d points failed", len(points),
+                      exc_info=True)
             return False
+        return True
+
+    def _replay_loop(self):
+        while not self._stop_replay.wait(self.replay_interval):
+            try:
+                count = self.replay()
+            except OSError:
+                log.error("Replaying spooled points failed", exc_info=True)
+            else:
+                if count:
+                    log.info("Replayed %d spooled points", count)
 
     def _format(self, data):
         if data.failure:
@@ -77,3 +433,130 @@ class InfluxDBSink:
             "fields": fields,
             "tags": tags
         }
+
+
+class _FlushRequest:
+    def __init__(self, stop=False):
+        self.stop = stop
+        self.done = threading.Event()
+
+
+class BufferedInfluxDBSink(InfluxDBSink):
+    """An InfluxDBSink that writes points in batches from a background thread.
+
+    `write` only formats the point and puts it into a bounded queue. A
+    background thread writes the queued points with one request as soon as
+    `batch_size` points are queued or the oldest queued point is older than
+    `flush_interval` seconds. Thereby, a slow database does not delay the
+    logger.
+
+    `write` returns False if the queue is full, in which case the point is
+    dropped, or if the last batch could not be written. This way, timers can
+    back off as for the unbuffered sink.
+
+    Parameters
+    ----------
+    database : string
+        Name of the database that data is written to
+    measurement : string
+        Name of the measurement that data is written to
+    batch_size : int
+        Maximum number of points per request
+    flush_interval : number
+        Maximum time in seconds a point is kept in the queue
+    max_queue : int
+        Maximum number of queued points
+
+    Additional parameters are forwarded to the InfluxDBSink.
+    """
+    def __init__(self, database, measurement, batch_size=100,
+                 flush_interval=10, max_queue=10000, **kwargs):
+        super().__init__(database, measurement, **kwargs)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(max_queue)
+        self.flush_failed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        point = self._format(data)
+        success = bool(point["fields"]) and data.failure is None
+        if not point["fields"]:
+            point["fields"] = {"NoValue": True}
+        try:
+            self.queue.put_nowait(point)
+        except queue.Full:
+            log.warning("Write queue is full, dropping point")
+            return False
+        return success and not self.flush_failed
+
+    def flush(self, timeout=None):
+        """
+            Write all queued points and wait until this is done
+
+            Returns
+            -------
+            Boolean
+                False, if the points were not written within `timeout`
+        """
+        return self._request(_FlushRequest(), timeout)
+
+    def close(self, timeout=None):
+        """
+            Write all queued points and stop the background thread
+        """
+        if self._thread.is_alive():
+            self._request(_FlushRequest(stop=True), timeout)
+            self._thread.join(timeout)
+        super().close()
+
+    def _request(self, request, timeout):
+        if not self._thread.is_alive():
+            return False
+        self.queue.put(request, timeout=timeout)
+        return request.done.wait(timeout)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = max(deadline - monotonic(), 0)
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, _FlushRequest):
+                self._write_batch(batch)
+                batch = []
+                deadline = None
+                item.done.set()
+                if item.stop:
+                    return
+                continue
+
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = monotonic() + self.flush_interval
+
+            if (len(batch) >= self.batch_size or
+                    (deadline is not None and monotonic() >= deadline)):
+                self._write_batch(batch)
+                batch = []
+                deadline = None
+
+    def _write_batch(self, batch):
+        if not batch:
+            return
+        try:
+            success = self._write_points(batch)
+        except Exception:
+            log.warning("Writing %d points failed", len(batch),
+                        exc_info=True)
+            success = False
+        self.flush_failed = not success
@@ -1,14 +1,21 @@
 import PyTango as tango
+import PyTango.asyncio  # noqa: F401
 try:
     import PyTine as tine
 except ImportError as err:
     tine = None
     tine_import_err = err
 from concurrent import futures
+from collections import deque
+import asyncio
+import logging
+import threading
 from datetime import datetime
 import numpy as np
 from pytz import timezone
 
+log = logging.getLogger(__name__)
+
 
 class MissingDataException(Exception):
     """Can be used to indicate a reason for a missing value in a Data object.
@@ -37,6 +44,91 @@ class Data:
         self.metadata = metadata
 
 
+class DeviceProxyPool:
+    """A thread-safe cache of PyTango DeviceProxy instances.
+
+    Sources of the same device share one proxy and thereby one connection.
+    Proxies are created on first use. A proxy that lost its connection can
+    be replaced with `reconnect`.
+    """
+    def __init__(self):
+        self.proxies = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, device_name):
+        """
+            Return the proxy of `device_name`, creating it if necessary
+
+            Raises
+            ------
+            DevFailed
+                If the proxy cannot be created
+        """
+        key = device_name.lower()
+        with self._device_lock(key):
+            proxy = self.proxies.get(key)
+            if proxy is None:
+                proxy = tango.DeviceProxy(device_name)
+                self.proxies[key] = proxy
+            return proxy
+
+    def reconnect(self, device_name, proxy):
+        """
+            Replace the broken `proxy` of `device_name` by a new one
+
+            If another source already replaced the proxy, the replacement is
+            returned instead of creating yet another one.
+
+            Raises
+            ------
+            DevFailed
+                If the proxy cannot be created
+        """
+        key = device_name.lower()
+        with self._device_lock(key):
+            current = self.proxies.get(key)
+            if current is not None and current is not proxy:
+                return current
+            self.proxies.pop(key, None)
+            new = tango.DeviceProxy(device_name)
+            self.proxies[key] = new
+            return new
+
+    def clear(self):
+        """
+            Remove all proxies from the pool
+        """
+        with self.lock:
+            self.proxies.clear()
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def _device_lock(self, key):
+        # creating a proxy may take long, so only block sources of the
+        # same device
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+
+#: The proxy pool shared by all sources of this process
+device_proxies = DeviceProxyPool()
+
+#: Reasons of DevFailed errors after which a proxy is replaced
+connection_errors = {
+    "API_CantConnectToDevice",
+    "API_CommunicationFailed",
+    "API_DeviceNotExported",
+    "API_ServerNotRunning",
+}
+
+
+def is_connection_error(err):
+    return (isinstance(err, tango.DevFailed) and
+            any(e.reason in connection_errors for e in err.args))
+
+
 class TangoDeviceAttributeSource:
     """A wrapper around a PyTango DeviceProxy that satisfies the Source interface.
 
@@ -56,7 +148,7 @@ class TangoDeviceAttributeSource:
         self.device_name = device_name
         self.attribute_name = attribute_name
         # TODO: Should a possible exception be wrapped?
-        self.device = tango.DeviceProxy(device_name)
+        self.device = device_proxies.get(device_name)
         self.metadata = metadata
         if "quality" in self.metadata:
             raise ValueError("The metadata entry 'quality' is reserved for the"
@@ -72,11 +164,28 @@ class TangoDeviceAttributeSource:
             device_attribute = self.device.read_attribute(self.attribute_name)
         # TODO: Should also handle Timeout from gevent
         except (tango.DevFailed, futures.TimeoutError) as err:
-            # TODO: Check if this is close enough to the would be time of
-            #       a successful read
-            timestamp = tango.TimeVal.now().totime()
-            timestamp = datetime.fromtimestamp(timestamp, self.localtz)
-            return Data(timestamp, None, err, metadata=self.metadata.copy())
+            self._reconnect(err)
+            return self._failure(err)
+        return self._to_data(device_attribute)
+
+    def _reconnect(self, err):
+        if not is_connection_error(err):
+            return
+        try:
+            self.device = device_proxies.reconnect(self.device_name,
+                                                   self.device)
+        except tango.DevFailed:
+            log.warning("Reconnecting to %s failed", self.device_name,
+                        exc_info=True)
+
+    def _failure(self, err):
+        # TODO: Check if this is close enough to the would be time of
+        #       a successful read
+        timestamp = tango.TimeVal.now().totime()
+        timestamp = datetime.fromtimestamp(timestamp, self.localtz)
+        return Data(timestamp, None, err, metadata=self.metadata.copy())
+
+    def _to_data(self, device_attribute):
         timestamp = device_attribute.get_date().totime()
         timestamp = datetime.fromtimestamp(timestamp, self.localtz)
         value = {self.attribute_name: device_attribute.value}
@@ -85,6 +194,225 @@ class TangoDeviceAttributeSource:
         return Data(timestamp, value, metadata=metadata)
 
 
+class TangoDeviceAttributesSource(TangoDeviceAttributeSource):
+    """Reads several attributes of one device in a single round trip.
+
+    All attributes are read with one `DeviceProxy.read_attributes` call and
+    returned as one data object whose value maps each attribute name to its
+    value. The quality of each attribute is returned as the metadata entry
+    "quality_<attribute name>". The timestamp is the latest one of all
+    attributes.
+
+    Attributes that could not be read have the value None and the quality
+    "ATTR_INVALID". Only if no attribute could be read, the data object holds
+    a failure.
+
+    Parameters
+    ----------
+    device_name : string
+        Name of the device
+    attribute_names : list of strings or string
+        Names of the attributes. A string is split at commas
+    metadata : dict_like
+        The metadata is added to every returned data object
+    """
+    def __init__(self, device_name, attribute_names, metadata={}, tz=None):
+        if isinstance(attribute_names, str):
+            attribute_names = [name.strip()
+                               for name in attribute_names.split(",")]
+        if not attribute_names:
+            raise ValueError("At least one attribute name is required")
+        self.device_name = device_name
+        self.attribute_names = list(attribute_names)
+        self.device = device_proxies.get(device_name)
+        self.metadata = metadata
+        for name in self.attribute_names:
+            if "quality_" + name in self.metadata:
+                raise ValueError("The metadata entry 'quality_{0}' is "
+                                 "reserved for the quality of the device "
+                                 "attribute {0}. Choose a different name "
+                                 "instead.".format(name))
+        if tz:
+            self.localtz = tz
+        else:
+            self.localtz = timezone('Europe/Berlin')
+
+    def read(self):
+        try:
+            device_attributes = self.device.read_attributes(
+                self.attribute_names)
+        except (tango.DevFailed, futures.TimeoutError) as err:
+            self._reconnect(err)
+            return self._failure(err)
+        return self._to_data(device_attributes)
+
+    def _to_data(self, device_attributes):
+        value = {}
+        metadata = self.metadata.copy()
+        timestamp = None
+        errors = []
+        for name, device_attribute in zip(self.attribute_names,
+                                          device_attributes):
+            if device_attribute.has_failed:
+                value[name] = None
+                metadata["quality_" + name] = "ATTR_INVALID"
+                errors.append(device_attribute.get_err_stack())
+                continue
+            value[name] = device_attribute.value
+            metadata["quality_" + name] = str(device_attribute.quality)
+            time = device_attribute.get_date().totime()
+            if timestamp is None or time > timestamp:
+                timestamp = time
+        if timestamp is None:
+            return self._failure(tango.DevFailed(*errors[0]))
+        timestamp = datetime.fromtimestamp(timestamp, self.localtz)
+        return Data(timestamp, value, metadata=metadata)
+
+
+class TangoEventSource(TangoDeviceAttributeSource):
+    """Receives the values of a device attribute from Tango events.
+
+    The source subscribes to change or periodic events of the attribute and
+    buffers the pushed values. Each call of `read` returns the oldest
+    buffered value without contacting the device. Paired with an
+    `ArrivalTimer`, the logger runs exactly once per event instead of polling
+    the device periodically. If the buffer is empty, `read` returns a data
+    object with a `MissingDataException` as failure.
+
+    The "quality" tag of the device attribute is returned as part of the
+    metadata. Error events are returned as data objects with the DevFailed
+    exception as failure.
+
+    Parameters
+    ----------
+    device_name : string
+        Name of the device
+    attribute_name :
+        Name of the attribute
+    event_type : string
+        Either "change" or "periodic"
+    metadata : dict_like
+        The metadata is added to every returned data object
+    max_buffer : int
+        Maximum number of buffered values. If the buffer is full, the oldest
+        value is dropped
+    """
+    event_types = {
+        "change": tango.EventType.CHANGE_EVENT,
+        "periodic": tango.EventType.PERIODIC_EVENT
+    }
+
+    def __init__(self, device_name, attribute_name, event_type="change",
+                 metadata={}, tz=None, max_buffer=1000):
+        if event_type not in self.event_types:
+            raise ValueError("Unknown event type '" + str(event_type) +
+                             "'. Choose one of " +
+                             ", ".join(self.event_types))
+        self.buffer = deque(maxlen=max_buffer)
+        self.dropped = 0
+        self.condition = threading.Condition()
+        super().__init__(device_name, attribute_name, metadata=metadata,
+                         tz=tz)
+        self.event_id = self.device.subscribe_event(
+            attribute_name, self.event_types[event_type], self._push)
+
+    def read(self):
+        with self.condition:
+            if self.buffer:
+                return self.buffer.popleft()
+        return self._failure(MissingDataException(
+            "No event received for " + self.attribute_name))
+
+    def wait(self, timeout=None, abort=None):
+        """
+            Block until data is buffered or `abort` is set
+
+            Returns
+            -------
+            Boolean
+                True, if data is buffered
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.buffer or (abort is not None and abort.is_set()),
+                timeout)
+            return bool(self.buffer)
+
+    def interrupt(self):
+        """
+            Wake up all threads blocked in `wait`
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def close(self):
+        """
+            Unsubscribe from the events
+        """
+        if self.event_id is not None:
+            self.device.unsubscribe_event(self.event_id)
+            self.event_id = None
+
+    def _push(self, event):
+        if event.err:
+            data = self._failure(tango.DevFailed(*event.errors))
+        else:
+            data = self._to_data(event.attr_value)
+        with self.condition:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+                log.warning("Event buffer of %s/%s is full, dropping the "
+                            "oldest value", self.device_name,
+                            self.attribute_name)
+            self.buffer.append(data)
+            self.condition.notify_all()
+
+
+class AsyncTangoDeviceAttributeSource(TangoDeviceAttributeSource):
+    """An asyncio variant of the `TangoDeviceAttributeSource`.
+
+    `read` is a coroutine that uses the asyncio green mode of PyTango, so
+    that many attributes can be read concurrently by `AsyncLogger` instances
+    on one event loop. The DeviceProxy is created on the first read.
+
+    PyTango binds its asyncio executor to the first event loop used in a
+    thread. Therefore, all instances read in one thread must share one loop.
+
+    Parameters
+    ----------
+    device_name : string
+        Name of the device
+    attribute_name :
+        Name of the attribute
+    metadata : dict_like
+        The metadata is added to every returned data object
+    """
+    def __init__(self, device_name, attribute_name, metadata={}, tz=None):
+        self.device_name = device_name
+        self.attribute_name = attribute_name
+        self.device = None
+        self.metadata = metadata
+        if "quality" in self.metadata:
+            raise ValueError("The metadata entry 'quality' is reserved for the"
+                             "device attribute field of the same name. Choose"
+                             "a different name instead.")
+        if tz:
+            self.localtz = tz
+        else:
+            self.localtz = timezone('Europe/Berlin')
+
+    async def read(self):
+        try:
+            if self.device is None:
+                self.device = await tango.asyncio.DeviceProxy(
+                    self.device_name)
+            device_attribute = await self.device.read_attribute(
+                self.attribute_name)
+        except (tango.DevFailed, asyncio.TimeoutError) as err:
+            return self._failure(err)
+        return self._to_data(device_attribute)
+
+
 def get_tine_image_height(frameHeader):
     if frameHeader["aoiHeight"] > 0:
         height = frameHeader["aoiHeight"]
@@ -109,34 +437,164 @@ def get_tine_image_width(frameHeader):
     return width
 
 
-def get_tine_image_dtype(frameHeader):
-    # TODO: Endianness?
+def get_tine_image_dtype(frameHeader, byteorder="<"):
     if frameHeader["bytesPerPixel"] == 1:
         dtype = "u1"
     elif frameHeader["bytesPerPixel"] == 2:
-        dtype = "u2"
+        dtype = byteorder + "u2"
     else:
         raise ValueError("Invalid bytesPerPixel = {}".format(
             frameHeader["bytesPerPixel"]))
 
-    return dtype
+    return np.dtype(dtype)
 
 
-def tine_image_to_numpy(data):
-    frameHeader = data["frameHeader"]
+# the type and the number of channels of each pixel
+TINE_PIXEL_FORMATS = {
+    "mono8": ("u1", 1),
+    "mono16": ("u2", 1),
+    "rgb8": ("u1", 3),
+}
+
+# weights of the red, green and blue channels of gray images as used by
+# skimage.color.rgb2gray
+RGB_WEIGHTS = np.array([0.2125, 0.7154, 0.0721], np.float32)
+
+
+def _unpack_mono10p(raw):
+    # 4 pixels in 5 bytes, least significant bits first
+    b = raw.reshape(-1, 5).astype(np.uint16)
+    pixels = np.empty((b.shape[0], 4), np.uint16)
+    pixels[:, 0] = b[:, 0] | (b[:, 1] & 0x03) << 8
+    pixels[:, 1] = b[:, 1] >> 2 | (b[:, 2] & 0x0F) << 6
+    pixels[:, 2] = b[:, 2] >> 4 | (b[:, 3] & 0x3F) << 4
+    pixels[:, 3] = b[:, 3] >> 6 | b[:, 4] << 2
+    return pixels
+
+
+def _unpack_mono12p(raw):
+    # 2 pixels in 3 bytes, least significant bits first
+    b = raw.reshape(-1, 3).astype(np.uint16)
+    pixels = np.empty((b.shape[0], 2), np.uint16)
+    pixels[:, 0] = b[:, 0] | (b[:, 1] & 0x0F) << 8
+    pixels[:, 1] = b[:, 1] >> 4 | b[:, 2] << 4
+    return pixels
 
-    height = get_tine_image_height(frameHeader)
-    width = get_tine_image_width(frameHeader)
-    dtype = get_tine_image_dtype(frameHeader)
 
-    bytes = np.frombuffer(data["imageBytes"], dtype=dtype)
+# the number of pixels and bytes of a group and the unpacking function
+TINE_PACKED_FORMATS = {
+    "mono10p": (4, 5, _unpack_mono10p),
+    "mono12p": (2, 3, _unpack_mono12p),
+}
 
-    if len(bytes) != height*width:
-        raise ValueError(
-            "Dimension mismatch: len(bytes) = {}, height*width = {}".format(
-                len(bytes), height*width))
 
-    return bytes.reshape((height, width))
+def _aoi_offset(frameHeader, key):
+    # the offsets are negative if no AOI is set
+    return max(frameHeader.get(key, 0), 0)
+
+
+def _tine_image_layout(frameHeader, size, height, width, pixel_bytes):
+    # returns the offset in bytes of the first pixel and the row stride
+    row_bytes = width*pixel_bytes
+    if size == height*row_bytes:
+        return 0, row_bytes
+
+    # the AOI within a complete frame
+    source_height = frameHeader.get("sourceHeight", 0)
+    source_width = frameHeader.get("sourceWidth", 0)
+    if size == source_height*source_width*pixel_bytes:
+        x0 = _aoi_offset(frameHeader, "xStart")
+        y0 = _aoi_offset(frameHeader, "yStart")
+        if x0 + width > source_width or y0 + height > source_height:
+            raise ValueError(
+                "AOI {}x{}+{}+{} exceeds the frame of {}x{}".format(
+                    width, height, x0, y0, source_width, source_height))
+        stride = source_width*pixel_bytes
+        return y0*stride + x0*pixel_bytes, stride
+
+    # rows that are padded, e.g., to a multiple of 4 bytes
+    stride, rest = divmod(size, height)
+    if not rest and row_bytes < stride and stride % pixel_bytes == 0:
+        return 0, stride
+
+    raise ValueError(
+        "Dimension mismatch: len(bytes) = {}, height*width = {}".format(
+            size // pixel_bytes, height*width))
+
+
+def tine_image_to_numpy(data, byteorder="<", pixel_format=None):
+    """
+        Convert the image of a TINE camera property to a 2d array
+
+        For 8 and 16 bit gray images, the result is a read-only view of the
+        image bytes, so no pixel is copied. An AOI is cut from a complete
+        frame by the offsets `xStart` and `yStart` of the frame header and
+        padded rows are skipped by the strides of the view. Packed and RGB
+        images are unpacked into a new array, which is read-only as well.
+
+        Parameters
+        ----------
+        data : dict
+            The data of the property with the keys "frameHeader" and
+            "imageBytes"
+        byteorder : {"<", ">"}, optional
+            The byte order of 16 bit pixels
+        pixel_format : str, optional
+            One of "mono8", "mono16", "rgb8", "mono10p" and "mono12p". If
+            not given, it is derived from `bytesPerPixel`. The packed
+            formats store consecutive pixels without gaps and are unpacked
+            to uint16. RGB images are converted to float32 gray images
+
+        Returns
+        -------
+        ndarray
+            The image of shape (height, width)
+
+        Raises
+        ------
+        ValueError
+            If the header is invalid or does not match the image bytes
+    """
+    frameHeader = data["frameHeader"]
+
+    height = get_tine_image_height(frameHeader)
+    width = get_tine_image_width(frameHeader)
+    raw = np.frombuffer(data["imageBytes"], dtype="u1")
+
+    if pixel_format in TINE_PACKED_FORMATS:
+        group_pixels, group_bytes, unpack = TINE_PACKED_FORMATS[pixel_format]
+        if (height*width) % group_pixels:
+            raise ValueError(
+                "{} requires a multiple of {} pixels, got {}x{}".format(
+                    pixel_format, group_pixels, width, height))
+        if raw.size*group_pixels != height*width*group_bytes:
+            raise ValueError(
+                "Dimension mismatch: len(bytes) = {}, height*width = {}"
+                .format(raw.size, height*width))
+        img = unpack(raw).reshape(height, width)
+        img.flags.writeable = False
+        return img
+
+    if pixel_format is None:
+        dtype = get_tine_image_dtype(frameHeader, byteorder)
+        channels = 1
+    elif pixel_format in TINE_PIXEL_FORMATS:
+        dtype, channels = TINE_PIXEL_FORMATS[pixel_format]
+        dtype = np.dtype(dtype).newbyteorder(byteorder)
+    else:
+        raise ValueError("Unknown pixel format '{}'".format(pixel_format))
+
+    pixel_bytes = dtype.itemsize*channels
+    offset, stride = _tine_image_layout(frameHeader, raw.size, height,
+                                        width, pixel_bytes)
+    img = np.ndarray((height, width, channels), dtype, raw, offset,
+                     (stride, pixel_bytes, dtype.itemsize))
+    if channels == 1:
+        img = img[:, :, 0]
+    else:
+        img = img @ RGB_WEIGHTS
+    img.flags.writeable = False
+    return img
 
 
 class TINECameraSource:
@@ -150,12 +608,21 @@ class TINECameraSource:
         Name of the property
     metadata : dict_like
         The metadata is added to every returned data object
+    byteorder : {"<", ">"}
+        The byte order of 16 bit pixels
+    pixel_format : string
+        The pixel format of the images, see `tine_image_to_numpy`
+
+    The images are read-only views of the received bytes where possible.
     """
-    def __init__(self, device_address, property_name, metadata={}, tz=None):
+    def __init__(self, device_address, property_name, metadata={}, tz=None,
+                 byteorder="<", pixel_format=None):
         if tine is None:
             raise tine_import_err
         self.device_address = device_address
         self.property_name = property_name
+        self.byteorder = byteorder
+        self.pixel_format = pixel_format
         self.metadata = metadata
         if "status" in self.metadata:
             raise ValueError("The metadata entry 'status' is reserved for the"
@@ -182,7 +649,9 @@ class TINECameraSource:
             timestamp = datetime.fromtimestamp(
                 device_property["timestamp"], self.localtz)
             try:
-                img = tine_image_to_numpy(device_property["data"])
+                img = tine_image_to_numpy(device_property["data"],
+                                          byteorder=self.byteorder,
+                                          pixel_format=self.pixel_format)
             except ValueError as err:
                 return Data(timestamp, None, err, metadata=metadata)
             value = {self.property_name: img}
@@ -190,3 +659,137 @@ class TINECameraSource:
             timestamp = datetime.now(self.localtz)
             value = None
         return Data(timestamp, value, metadata=metadata)
+
+
+class LatestOnlySource:
+    """Reads a source from a background thread and keeps only the newest data
+
+    The background thread reads `source` whenever `timer` returns, e.g., on
+    the grid of a `SynchronizedPeriodicTimer`, independent of how long the
+    processing of the previous data takes. `read` returns the newest data
+    that was not returned before and blocks until new data is read if
+    there is none. Data that is replaced before it was returned is counted
+    as dropped. Thereby, the latency stays bounded if the processing cannot
+    keep up with the reads, instead of lagging more and more behind.
+
+    Combine the source with an `ArrivalTimer` in the `Logger` to process the
+    newest data as soon as the previous data is processed. With a periodic
+    timer, the logger still reads only at the points of its own grid.
+
+    Parameters
+    ----------
+    source : Source
+        The source that is read in the background, e.g., a
+        `TINECameraSource`
+    timer : Timer
+        Paces the reads of the background thread. The timer is called with
+        False after failed reads and while the last processed data could
+        not be written, see `feedback`. If it has a `bind` method, it is
+        called with `source`
+    timeout : number, optional
+        The maximum time in seconds `read` waits for new data, after which
+        a data object with a `MissingDataException` as failure is returned
+
+    Attributes
+    ----------
+    frames : int
+        The number of reads of the background thread
+    dropped : int
+        The number of data objects that were replaced before being returned
+    period : number or None
+        The period of `timer`, if it has one
+    """
+    def __init__(self, source, timer, timeout=None):
+        self.source = source
+        self.timer = timer
+        self.timeout = timeout
+        self.latest = None
+        self.frames = 0
+        self.dropped = 0
+        self.written = True
+        self.condition = threading.Condition()
+        bind = getattr(timer, "bind", None)
+        if bind:
+            bind(source)
+        self.timer.reset()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def read(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.latest is not None,
+                                    self.timeout)
+            data, self.latest = self.latest, None
+        if data is None:
+            return self._failure(MissingDataException(
+                "No new data within {} s".format(self.timeout)))
+        return data
+
+    @property
+    def period(self):
+        return getattr(self.timer, "period", None)
+
+    def feedback(self, success):
+        """
+            Report whether the last returned data was processed and written
+
+            Until a later call reports success, the reads count as failed
+            for the timer, which thereby backs off, e.g., while the database
+            is down.
+        """
+        self.written = success
+
+    def wait(self, timeout=None, abort=None):
+        """
+            Block until new data is available or `abort` is set
+
+            Returns
+            -------
+            Boolean
+                True, if new data is available
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: (self.latest is not None or
+                         (abort is not None and abort.is_set())),
+                timeout)
+            return self.latest is not None
+
+    def interrupt(self):
+        """
+            Wake up all threads blocked in `wait`
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def close(self):
+        """
+            Stop the background thread and close the source
+        """
+        self.timer.abort()
+        self.thread.join()
+        close = getattr(self.source, "close", None)
+        if close:
+            close()
+
+    def _failure(self, err):
+        timestamp = datetime.now(getattr(self.source, "localtz", None))
+        metadata = getattr(self.source, "metadata", {})
+        return Data(timestamp, None, err, metadata=metadata.copy())
+
+    def _run(self):
+        success = True
+        while self.timer(success and self.written):
+            try:
+                data = self.source.read()
+            except Exception as err:
+                log.error("Reading in the background failed", exc_info=True)
+                data = self._failure(err)
+            success = data.failure is None
+            with self.condition:
+                if self.latest is not None:
+                    self.dropped += 1
+                    log.debug("Dropping unprocessed data")
+                self.latest = data
+                self.frames += 1
+                self.condition.notify_all()
@@ -0,0 +1,300 @@
+from datetime import datetime, timezone
+from time import monotonic
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+
+from BeamlineStatusLogger.logger import is_async
+
+log = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+        Runs loggers side by side and restarts each one that fails
+
+        Every logger is created by its factory and run in its own thread.
+        Asynchronous loggers are run on one shared event loop instead. If
+        creating or running a logger raises an exception, only this logger
+        is closed and, after a delay, created anew by its factory. The others
+        keep running. The delay doubles with every consecutive failure up to
+        `max_backoff` and is shortened by a random fraction of up to
+        `jitter`, so that loggers that failed together, e.g., because a
+        database was down, do not reconnect at the same time.
+
+        Parameters
+        ----------
+        factories : dict_like
+            Maps the name of each logger to a callable without arguments
+            that returns a new `Logger` or `AsyncLogger`
+        backoff : number, optional
+            The delay in seconds before the first restart
+        max_backoff : number, optional
+            The maximum delay in seconds
+        jitter : number, optional
+            The maximum fraction by which a delay is shortened, in [0, 1]
+        reset_after : number, optional
+            If a logger ran for at least this many seconds before failing,
+            its delay starts again at `backoff`
+        permanent_errors : tuple of exception types, optional
+            A logger that raises one of these, e.g., due to an invalid
+            configuration, is not restarted
+        health_file : str, optional
+            If given, the output of `health` is written to this file as JSON
+            whenever the state of a logger changes
+    """
+    def __init__(self, factories, backoff=1, max_backoff=300, jitter=0.5,
+                 reset_after=600, permanent_errors=(), health_file=None):
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be between 0 and 1")
+        self.factories = dict(factories)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.reset_after = reset_after
+        self.permanent_errors = tuple(permanent_errors)
+        self.health_file = health_file
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._started = False
+        self._loggers = {}
+        self._threads = {}
+        self._stop_events = {}
+        self._loop = None
+        self._loop_thread = None
+        self._health = {}
+        for name in self.factories:
+            self._init_health(name)
+
+    def _init_health(self, name):
+        self._health[name] = {"state": "starting", "restarts": 0,
+                              "failures": 0, "last_error": None,
+                              "since": None}
+
+    def delay(self, failures):
+        """
+            Return the jittered delay after `failures` consecutive failures
+        """
+        delay = min(self.max_backoff, self.backoff * 2**(failures - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def health(self):
+        """
+            Return the state of every logger
+
+            Returns
+            -------
+            dict
+                Maps the name of each logger to a dict with the keys
+
+                state
+                    "starting", "running", "backoff" while waiting for a
+                    restart, "stopped" or "failed" after a permanent error
+                restarts
+                    The total number of restarts
+                failures
+                    The number of consecutive failures
+                last_error
+                    The representation of the last exception or None
+                since
+                    The time of the last state change in ISO format
+        """
+        with self._lock:
+            return {name: dict(health)
+                    for name, health in self._health.items()}
+
+    def start(self):
+        """
+            Start all loggers
+        """
+        self._started = True
+        for name in list(self.factories):
+            self._start(name)
+
+    def add(self, name, factory):
+        """
+            Add a logger, which is started at once if the others are running
+        """
+        if name in self.factories:
+            raise ValueError("A logger named " + name + " already exists")
+        self.factories[name] = factory
+        with self._lock:
+            self._init_health(name)
+        if self._started:
+            self._start(name)
+
+    def remove(self, name):
+        """
+            Stop a logger, wait for it and remove it from the supervisor
+        """
+        del self.factories[name]
+        stop_event = self._stop_events.pop(name, None)
+        t = self._threads.pop(name, None)
+        if stop_event is not None:
+            stop_event.set()
+            self._join_thread(t, [name])
+        with self._lock:
+            del self._health[name]
+            if self.health_file:
+                self._write_health()
+
+    def stop(self):
+        """
+            Abort all loggers and cancel pending restarts
+        """
+        self._stopping.set()
+        for stop_event in list(self._stop_events.values()):
+            stop_event.set()
+        self._abort(list(self._loggers))
+
+    def join(self):
+        """
+            Wait until all loggers have stopped
+        """
+        for t in list(self._threads.values()):
+            self._join_thread(t, list(self._threads))
+        with self._lock:
+            loop = self._loop
+            self._loop = None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            self._loop_thread.join()
+            loop.close()
+
+    def run(self):
+        """
+            Run all loggers until they stop
+
+            Returns
+            -------
+            Boolean
+                False, if a logger failed permanently
+        """
+        self.start()
+        self.join()
+        return all(health["state"] != "failed"
+                   for health in self.health().values())
+
+    def _start(self, name):
+        stop_event = threading.Event()
+        if self._stopping.is_set():
+            stop_event.set()
+        t = threading.Thread(target=self._supervise,
+                             args=(name, self.factories[name], stop_event),
+                             name="logger-" + name, daemon=True)
+        self._stop_events[name] = stop_event
+        self._threads[name] = t
+        t.start()
+
+    def _join_thread(self, t, names):
+        # loggers of `names` that should stop are aborted repeatedly, since
+        # a logger created concurrently to the abort resets its timer when it
+        # starts, which discards the abort
+        while t.is_alive():
+            self._abort([name for name in names
+                         if self._stop_events.get(name) is None or
+                         self._stop_events[name].is_set()])
+            t.join(1)
+
+    def _abort(self, names):
+        with self._lock:
+            loggers = [self._loggers[name] for name in names
+                       if name in self._loggers]
+        for logger in loggers:
+            try:
+                logger.abort()
+            except Exception:
+                log.warning("Aborting a logger failed", exc_info=True)
+
+    def _event_loop(self):
+        # the event loop shared by all asynchronous loggers
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever, name="async-loggers",
+                    daemon=True)
+                self._loop_thread.start()
+            return self._loop
+
+    def _run_logger(self, logger):
+        if is_async(logger.run):
+            future = asyncio.run_coroutine_threadsafe(logger.run(),
+                                                      self._event_loop())
+            future.result()
+        else:
+            logger.run()
+
+    def _set_state(self, name, state, error=None):
+        with self._lock:
+            health = self._health[name]
+            health["state"] = state
+            if error is not None:
+                health["last_error"] = repr(error)
+            health["since"] = datetime.now(timezone.utc).isoformat()
+            if self.health_file:
+                self._write_health()
+
+    def _write_health(self):
+        tmp = self.health_file + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self._health, f, indent=2)
+            os.replace(tmp, self.health_file)
+        except OSError:
+            log.warning("Writing the health file failed", exc_info=True)
+
+    def _supervise(self, name, factory, stop_event):
+        failures = 0
+        while not stop_event.is_set():
+            logger = None
+            started = None
+            try:
+                logger = factory()
+                with self._lock:
+                    self._loggers[name] = logger
+                if stop_event.is_set():
+                    break
+                self._set_state(name, "running")
+                started = monotonic()
+                self._run_logger(logger)
+            except self.permanent_errors as err:
+                log.error("Logger %s failed permanently", name, exc_info=True)
+                self._set_state(name, "failed", err)
+                return
+            except Exception as err:
+                error = err
+            else:
+                break
+            finally:
+                with self._lock:
+                    self._loggers.pop(name, None)
+                if logger is not None:
+                    self._close(name, logger)
+            if stop_event.is_set():
+                break
+            if started is not None and monotonic() - started >= \
+                    self.reset_after:
+                failures = 0
+            failures += 1
+            delay = self.delay(failures)
+            log.error("Logger %s failed, restarting in %.1f s", name, delay,
+                      exc_info=error)
+            with self._lock:
+                self._health[name]["failures"] = failures
+            self._set_state(name, "backoff", error)
+            if stop_event.wait(delay):
+                break
+            with self._lock:
+                self._health[name]["restarts"] += 1
+            self._set_state(name, "starting")
+        self._set_state(name, "stopped")
+
+    def _close(self, name, logger):
+        try:
+            logger.close()
+        except Exception:
+            log.warning("Closing logger %s failed", name, exc_info=True)
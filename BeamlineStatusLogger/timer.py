@@ -1,5 +1,6 @@
 from time import time
 from threading import Event
+import asyncio
 
 
 class SynchronizedPeriodicTimer:
@@ -64,15 +65,74 @@ class SynchronizedPeriodicTimer:
             Boolean
                 True, if the timer executed normally. False, if it was aborted
         """
+        self._update(success)
+        self._sleep()
+        return not self.event.is_set()
+
+    def abort(self):
+        """
+            Abort the timer execution
+        """
+        self.event.set()
+
+    def reset(self):
+        """
+            Reset the timer to its initial state
+        """
+        self.event.clear()
+        self.fail_count = 0
+        self.period = self.p_min
+
+    def _update(self, success):
         if success:
             self.fail_count = 0
             self.period = self.p_min
-            self._sleep()
         else:
             self.fail_count += 1
             if self.fail_count > self.fail_tol and self.period*2 <= self.p_max:
                 self.period = self.period*2
-            self._sleep()
+
+    def _delay(self):
+        return self.period - (time() - self.offset) % self.p_min
+
+    def _sleep(self):
+        self.event.wait(self._delay())
+
+
+class AsyncSynchronizedPeriodicTimer(SynchronizedPeriodicTimer):
+    """
+        Sleep until the end of a period without blocking the event loop
+
+        This is the asyncio variant of `SynchronizedPeriodicTimer` for the
+        `AsyncLogger`. Calling an instance returns a coroutine. All instances
+        sleep on the event loop instead of blocking one thread each. `abort`
+        may be called from any thread.
+
+        The parameters are the same as for `SynchronizedPeriodicTimer`.
+    """
+    def __init__(self, period, offset=0, p_max=None, fail_tol=3):
+        super().__init__(period, offset=offset, p_max=p_max,
+                         fail_tol=fail_tol)
+        self._loop = None
+        self._async_event = None
+
+    async def __call__(self, success=True):
+        """
+            Wait until the end of a period.
+
+            See `SynchronizedPeriodicTimer.__call__`
+        """
+        self._update(success)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._async_event = asyncio.Event()
+            if self.event.is_set():
+                self._async_event.set()
+        try:
+            await asyncio.wait_for(self._async_event.wait(), self._delay())
+        except asyncio.TimeoutError:
+            pass
         return not self.event.is_set()
 
     def abort(self):
@@ -80,17 +140,17 @@ class SynchronizedPeriodicTimer:
             Abort the timer execution
         """
         self.event.set()
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._async_event.set)
 
     def reset(self):
         """
             Reset the timer to its initial state
         """
-        self.event.clear()
-        self.fail_count = 0
-        self.period = self.p_min
-
-    def _sleep(self):
-        self.event.wait(self.period - (time() - self.offset) % self.p_min)
+        super().reset()
+        if self._async_event is not None:
+            self._async_event.clear()
 
 
 def PeriodicTimer(period, p_max=None, fail_tol=3):
@@ -123,3 +183,88 @@ def PeriodicTimer(period, p_max=None, fail_tol=3):
     """
     return SynchronizedPeriodicTimer(period, offset=time() % period,
                                      p_max=p_max, fail_tol=fail_tol)
+
+
+class ArrivalTimer:
+    """
+        Wait until the source of a logger has data available
+
+        Instead of polling the source periodically, the logger runs whenever
+        an event driven source, e.g., a `TangoEventSource`, received new
+        data. The `Logger` binds the timer to its source on construction.
+
+        If the source is read in the background by a timer of its own, e.g.,
+        a `LatestOnlySource`, the success of each cycle is passed on to the
+        source's `feedback` method, so that this timer can back off, and the
+        `period` of the source is used to count overruns.
+
+        Parameters
+        ----------
+        timeout : number, optional
+            If given, the call returns after `timeout` seconds even if no data
+            arrived. The source then returns a data object with a failure
+
+        Raises
+        ------
+        TypeError
+            On binding if the source has no `wait` method
+    """
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.source = None
+        self.event = Event()
+
+    def bind(self, source):
+        """
+            Wait for data of `source` in the following calls
+        """
+        if not hasattr(source, "wait"):
+            raise TypeError("An ArrivalTimer requires an event driven source "
+                            "with a wait method, got " +
+                            type(source).__name__)
+        self.source = source
+
+    def __call__(self, success=True):
+        """
+            Wait until the source has data available
+
+            Parameters
+            ----------
+            success : Boolean, optional
+                Passed to the `feedback` method of the source, if it has
+                one. Otherwise ignored, since the data arrival is not
+                controlled by the logger
+
+            Returns
+            -------
+            Boolean
+                True, if the timer executed normally. False, if it was aborted
+        """
+        if self.source is None:
+            raise RuntimeError("The ArrivalTimer is not bound to a source")
+        feedback = getattr(self.source, "feedback", None)
+        if feedback:
+            feedback(success)
+        self.source.wait(self.timeout, abort=self.event)
+        return not self.event.is_set()
+
+    @property
+    def period(self):
+        """
+            The period in which the source is read or None
+        """
+        return getattr(self.source, "period", None)
+
+    def abort(self):
+        """
+            Abort the timer execution
+        """
+        self.event.set()
+        if self.source is not None:
+            self.source.interrupt()
+
+    def reset(self):
+        """
+            Reset the timer to its initial state
+        """
+        self.event.clear()
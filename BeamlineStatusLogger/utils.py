@@ -1,13 +1,10 @@
 import math
 import numpy as np
 
-from scipy.signal import convolve2d
-from scipy.optimize import least_squares
-import scipy.ndimage as scimg
-import skimage.measure as skimsr
-
-import matplotlib.pyplot as plt
-from matplotlib.patches import Ellipse
+# scipy, skimage and matplotlib take about a second to import, so they are
+# imported by the functions that use them. Thereby, only loggers that fit
+# peaks or render plots pay for them
+FIT_MODULES = ["scipy.optimize", "scipy.ndimage", "skimage.measure"]
 
 
 # Adapted version inspired by agpy gaussfitter
@@ -101,43 +98,433 @@ def gauss2d_cut(x, y, h, a, x0, y0, sx, sy, theta, cutoff):
     return res
 
 
-def estimate_background(img):
+def gauss2d_cut_jacobian(x, y, h, a, x0, y0, sx, sy, theta, cutoff):
+    """
+        The values and the Jacobian of a 2d Gaussian with a cutoff.
+
+        Parameters
+        ----------
+        x, y : array_like
+            Coordinates
+        h, a, x0, y0, sx, sy, theta, cutoff : number
+            The parameters of `gauss2d_cut`
+
+        Returns
+        -------
+        res : ndarray
+            The value of the Gaussian at the given coordinates, as returned
+            by `gauss2d_cut`
+        jac : ndarray
+            The partial derivatives with respect to h, a, x0, y0, sx, sy and
+            theta along the last axis. Clipped values have a zero gradient
+
+        See Also
+        --------
+        gauss2d_cut
+    """
+    cost = np.cos(theta)
+    sint = np.sin(theta)
+    dx = x0 - x
+    dy = y0 - y
+    # rotated distances to the center, i.e., rx0 - rx and ry0 - ry
+    u = dx * cost - dy * sint
+    v = dx * sint + dy * cost
+    uu = u / sx**2
+    vv = v / sy**2
+    e = np.exp(-(u*uu + v*vv)/2)
+    ae = a * e
+
+    # fill the parameter axis first to write contiguous memory
+    jac = np.empty((7,) + np.shape(e))
+    jac[0] = 1
+    jac[1] = e
+    jac[2] = -ae * (uu*cost + vv*sint)
+    jac[3] = -ae * (vv*cost - uu*sint)
+    jac[4] = ae * u * uu / sx
+    jac[5] = ae * v * vv / sy
+    jac[6] = ae * u * v * (1/sx**2 - 1/sy**2)
+
+    res = h + ae
+    clipped = res > cutoff
+    res[clipped] = cutoff
+    jac[:, clipped] = 0
+    return res, np.moveaxis(jac, 0, -1)
+
+
+class WorkBuffers:
+    """
+        Arrays that are reused by consecutive calls of `get_peak_parameters`
+
+        Every full size temporary array of the peak search is taken from an
+        instance of this class instead of being allocated for each frame.
+        An array is only allocated again if its shape or type changes, e.g.,
+        because the camera settings changed. Hence, one instance should be
+        used per camera and must not be shared between threads.
+
+        Arrays returned by functions that are passed an instance are
+        overwritten by the next call.
+    """
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, name, shape, dtype):
+        """
+            Return the uninitialized array `name` with the given shape and type
+        """
+        dtype = np.dtype(dtype)
+        array = self.arrays.get(name)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = np.empty(shape, dtype)
+            self.arrays[name] = array
+        return array
+
+    @property
+    def nbytes(self):
+        """The total size of all arrays in bytes"""
+        return sum(array.nbytes for array in self.arrays.values())
+
+
+def _empty(buffers, name, shape, dtype):
+    if buffers is None:
+        return np.empty(shape, dtype)
+    return buffers.get(name, shape, dtype)
+
+
+def _histogram_median(img, chunk_rows=64):
+    # exact median of an unsigned integer image from its histogram, the
+    # chunks bound the temporary arrays of bincount
+    counts = np.zeros(np.iinfo(img.dtype).max + 1, np.intp)
+    for start in range(0, img.shape[0], chunk_rows):
+        chunk = img[start:start + chunk_rows].ravel()
+        counts += np.bincount(chunk, minlength=counts.size)
+    cdf = np.cumsum(counts, out=counts)
+    n = cdf[-1]
+    # the values at the ranks that np.median averages
+    lower = np.searchsorted(cdf, (n - 1) // 2, side="right")
+    upper = np.searchsorted(cdf, n // 2, side="right")
+    return (lower + upper)/2
+
+
+def estimate_background(img, buffers=None, method="median", step=4):
+    """
+        Estimate the background of an image by its median
+
+        Parameters
+        ----------
+        img : array_like
+            A 2d image
+        buffers : WorkBuffers, optional
+            If given, the copy that the "median" method partitions is taken
+            from `buffers`
+        method : {"median", "subsample", "histogram"}, optional
+            "median" computes the median of all pixels. "subsample" only
+            uses every `step`-th pixel in each direction. "histogram"
+            computes the exact median from a histogram of uint8 or uint16
+            images without partitioning a copy and falls back to
+            "subsample" for other types
+        step : int, optional
+            The stride of the "subsample" method
+
+        Returns
+        -------
+        number
+            The estimated background
+    """
     # median should be closer to background than mean
     # more accurate background estimators could be found at
     # https://photutils.readthedocs.io/en/stable/index.html
-    return np.median(img)
+    img = np.asarray(img)
+    if method == "histogram":
+        if img.dtype in (np.uint8, np.uint16):
+            return _histogram_median(img)
+        method = "subsample"
+
+    if method == "subsample":
+        return np.median(img[::step, ::step])
+    elif method != "median":
+        raise ValueError("Unknown method '" + str(method) + "'")
+
+    if buffers is None:
+        return np.median(img)
+    # np.median sorts a copy, which is kept for the next frame
+    scratch = buffers.get("median", img.shape, img.dtype)
+    np.copyto(scratch, img)
+    return np.median(scratch, overwrite_input=True)
+
+
+class BackgroundEstimator:
+    """
+        Estimates the background of consecutive images of one camera
+
+        The background usually changes slowly. Hence, the estimates of
+        consecutive images can be smoothed by an exponential moving average
+        and estimated from a subsample or histogram of the image. An
+        instance can be passed as `background` to `get_peak_parameters`.
 
+        Parameters
+        ----------
+        method : {"median", "subsample", "histogram"}, optional
+            The method of `estimate_background`
+        step : int, optional
+            The stride of the "subsample" method
+        smoothing : number, optional
+            The weight in [0, 1) of the previous estimate in the moving
+            average. 0 disables the smoothing
 
-def estimate_noise(I):
-    # from https://stackoverflow.com/a/25436112
+        See Also
+        --------
+        estimate_background
     """
-        Estimates the variance of zero mean Gaussian noise
+    def __init__(self, method="median", step=4, smoothing=0):
+        if method not in ("median", "subsample", "histogram"):
+            raise ValueError("Unknown method '" + str(method) + "'")
+        if not 0 <= smoothing < 1:
+            raise ValueError("smoothing must be in [0, 1), got " +
+                             str(smoothing))
+        self.method = method
+        self.step = step
+        self.smoothing = smoothing
+        self.value = None
+
+    def __call__(self, img, buffers=None):
+        bg = float(estimate_background(img, buffers=buffers,
+                                       method=self.method, step=self.step))
+        if self.value is not None:
+            bg = self.smoothing*self.value + (1 - self.smoothing)*bg
+        self.value = bg
+        return bg
+
+    def reset(self):
+        """
+            Forget the previous estimate
+        """
+        self.value = None
+
+
+def estimate_noise(img, chunk_rows=256, buffers=None):
+    # method of Immerkær, see https://stackoverflow.com/a/25436112
     """
-    H, W = I.shape
+        Estimate the standard deviation of zero mean Gaussian noise
 
-    M = [[1, -2, 1],
-         [-2, 4, -2],
-         [1, -2, 1]]
+        The Laplacian like mask [[1, -2, 1], [-2, 4, -2], [1, -2, 1]] is the
+        outer product of [1, -2, 1] with itself. It is therefore applied as
+        two one dimensional passes, restricted to the pixels where the mask
+        fits into the image. The image is processed in chunks of rows, so
+        that only small, reused buffers are allocated. float32 images are
+        processed in single precision.
 
-    sigma = np.sum(np.sum(np.absolute(convolve2d(I, M))))
-    sigma = sigma * math.sqrt(0.5 * math.pi) / (6 * (W-2) * (H-2))
+        Parameters
+        ----------
+        img : array_like
+            A 2d image of at least 3x3 pixels
+        chunk_rows : int, optional
+            The number of rows processed at once
+        buffers : WorkBuffers, optional
+            If given, the chunk buffers are taken from `buffers`
 
-    return sigma
+        Returns
+        -------
+        sigma : number
+            The estimated standard deviation
+    """
+    img = np.asarray(img)
+    if img.dtype != np.float32:
+        img = img.astype(np.float64, copy=False)
+    H, W = img.shape
+    if H < 3 or W < 3:
+        raise ValueError("The image must have at least 3x3 pixels, got "
+                         "{}x{}".format(H, W))
+
+    rows = max(min(chunk_rows, H - 2), 1)
+    row_pass = _empty(buffers, "noise_rows", (rows + 2, W - 2), img.dtype)
+    tmp = _empty(buffers, "noise_tmp", (rows + 2, W - 2), img.dtype)
+    col_pass = _empty(buffers, "noise_cols", (rows, W - 2), img.dtype)
+
+    total = 0.0
+    for start in range(0, H - 2, rows):
+        n = min(rows, H - 2 - start)
+        block = img[start:start + n + 2]
+        # [1, -2, 1] along the rows
+        r = row_pass[:n + 2]
+        t = tmp[:n + 2]
+        np.add(block[:, :-2], block[:, 2:], out=r)
+        np.multiply(block[:, 1:-1], 2, out=t)
+        r -= t
+        # [1, -2, 1] along the columns
+        c = col_pass[:n]
+        t = tmp[:n]
+        np.add(r[:-2], r[2:], out=c)
+        np.multiply(r[1:-1], 2, out=t)
+        c -= t
+        np.abs(c, out=c)
+        total += c.sum(dtype=np.float64)
+
+    return total * math.sqrt(0.5 * math.pi) / (6 * (W-2) * (H-2))
+
+
+def _window_medians(padded, rows, cols):
+    # medians of the 3x3 windows around the pixels (rows, cols) of an image
+    # that was padded by one pixel
+    windows = np.stack([padded[rows + dy, cols + dx]
+                        for dy in range(3) for dx in range(3)])
+    return np.partition(windows, 4, axis=0)[4]
+
+
+def _pad_symmetric(img, padded):
+    # np.pad(img, 1, mode="symmetric") into an existing array
+    padded[1:-1, 1:-1] = img
+    padded[0, 1:-1] = img[0]
+    padded[-1, 1:-1] = img[-1]
+    padded[:, 0] = padded[:, 1]
+    padded[:, -1] = padded[:, -2]
+
+
+def _window_extreme(padded, func, out, rows):
+    # separable 3x3 minimum or maximum filter of an image padded by one pixel
+    # rows is a temporary array with the shape of padded without two columns
+    func(padded[:, :-2], padded[:, 1:-1], out=rows)
+    func(rows, padded[:, 2:], out=rows)
+    func(rows[:-2], rows[1:-1], out=out)
+    func(out, rows[2:], out=out)
+    return out
+
+
+def _majority_windows(mask, counts):
+    # positions of the 3x3 windows in which mask holds for at least 5 pixels
+    # counts is a temporary uint8 array, mask is overwritten
+    import scipy.ndimage as scimg
+    ones = np.ones(3, np.uint8)
+    scimg.correlate1d(mask.view(np.uint8), ones, axis=0, output=counts)
+    scimg.correlate1d(counts, ones, axis=1, output=mask.view(np.uint8))
+    np.greater_equal(mask.view(np.uint8), 5, out=mask)
+    return np.nonzero(mask)
+
+
+def _median_filter_range(img, padded, img_min, img_max, mask, counts):
+    # The median of a window lies between its minimum and maximum. Hence,
+    # the largest median is at least the largest window minimum and can only
+    # be larger in windows in which most values are larger than it. The
+    # same holds for the smallest median.
+    f_max = img_min.max()
+    rows, cols = _majority_windows(np.greater(img, f_max, out=mask), counts)
+    if rows.size:
+        f_max = max(f_max, _window_medians(padded, rows, cols).max())
+
+    f_min = img_max.min()
+    rows, cols = _majority_windows(np.less(img, f_min, out=mask), counts)
+    if rows.size:
+        f_min = min(f_min, _window_medians(padded, rows, cols).min())
+
+    return f_max - f_min
+
+
+def improve_img(img, method="fast", buffers=None):
+    """
+        Replace dead and hot pixels by the median of their neighbourhood
 
+        A pixel is replaced by the median of its 3x3 neighbourhood if they
+        differ by more than 20 % of the range of the median filtered image.
 
-def improve_img(img):
-    # filter dead pixels
+        Parameters
+        ----------
+        img : array_like
+            A 2d image
+        method : {"fast", "median"}, optional
+            "median" applies a median filter to the whole image. "fast"
+            yields the same result, but only computes the medians of pixels
+            that differ sufficiently from the minimum or maximum of their
+            neighbourhood, since the median lies in between
+        buffers : WorkBuffers, optional
+            If given, the temporary arrays and the result of the "fast"
+            method are taken from `buffers`
+
+        Returns
+        -------
+        ndarray
+            A corrected copy of the image
+    """
     # https://stackoverflow.com/questions/18951500/automatically-remove-hot-dead-pixels-from-an-image-in-python # noqa
-    img_filtered = scimg.median_filter(img, 3)
+    if method == "median":
+        import scipy.ndimage as scimg
+        img_filtered = scimg.median_filter(img, 3)
+
+        mask = np.abs(img_filtered - img)/(img_filtered.max()
+                                           - img_filtered.min()) > 0.2
+
+        img_masked = img.copy()
+
+        img_masked[mask] = img_filtered[mask]
+
+        return img_masked
+    elif method != "fast":
+        raise ValueError("Unknown method '" + str(method) + "'")
+
+    img = np.asarray(img)
+    H, W = img.shape
+    # same boundary handling as the default of median_filter
+    padded = _empty(buffers, "improve_padded", (H + 2, W + 2), img.dtype)
+    _pad_symmetric(img, padded)
+    rows_tmp = _empty(buffers, "improve_rows", (H + 2, W), img.dtype)
+    img_min = _window_extreme(
+        padded, np.minimum, _empty(buffers, "improve_min", (H, W), img.dtype),
+        rows_tmp)
+    img_max = _window_extreme(
+        padded, np.maximum, _empty(buffers, "improve_max", (H, W), img.dtype),
+        rows_tmp)
+    mask = _empty(buffers, "improve_mask", (H, W), bool)
+    other = _empty(buffers, "improve_other", (H, W), bool)
+
+    f_range = _median_filter_range(img, padded, img_min, img_max, mask,
+                                   other.view(np.uint8))
+
+    # candidates that might differ by more than the threshold from the
+    # median, the margin only guards against rounding
+    thresh = 0.2*f_range*(1 - 1e-9)
+    # the window minimum and maximum are not needed anymore, the
+    # differences are never negative
+    np.greater(np.subtract(img, img_min, out=img_min), thresh, out=mask)
+    np.greater(np.subtract(img_max, img, out=img_max), thresh, out=other)
+    rows, cols = np.nonzero(np.logical_or(mask, other, out=mask))
+
+    img_masked = _empty(buffers, "improved", (H, W), img.dtype)
+    np.copyto(img_masked, img)
+    if rows.size:
+        values = img[rows, cols]
+        medians = _window_medians(padded, rows, cols)
+        # avoid the wrap around of unsigned integers
+        diff = np.abs(medians.astype(np.float64) - values)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mask = diff/f_range > 0.2
+        img_masked[rows[mask], cols[mask]] = medians[mask]
 
-    mask = np.abs(img_filtered - img)/(img_filtered.max()
-                                       - img_filtered.min()) > 0.2
+    return img_masked
 
-    img_masked = img.copy()
 
-    img_masked[mask] = img_filtered[mask]
+def bin_image(img, factor, dtype=np.float64):
+    """
+        Downsample an image by averaging blocks of pixels
 
-    return img_masked
+        Parameters
+        ----------
+        img : array_like
+            A 2d image
+        factor : int
+            The size of the square blocks. Rows and columns that do not fill
+            a complete block are dropped
+        dtype : data-type, optional
+            The type of the binned image, which is also used to compute the
+            averages
+
+        Returns
+        -------
+        ndarray
+            The binned image
+    """
+    height = img.shape[0] // factor
+    width = img.shape[1] // factor
+    blocks = img[:height*factor, :width*factor].reshape(
+        height, factor, width, factor)
+    return blocks.mean(axis=(1, 3), dtype=dtype)
 
 
 def find_threshold(img, background=0):
@@ -147,6 +534,11 @@ def find_threshold(img, background=0):
     return background + (max_val - background)/2
 
 
+def _too_noisy(half_height, noise):
+    # the same criterion for the full search and for tracking
+    return half_height < 3*noise
+
+
 class FittingError(Exception):
     """Base class for all fitting exceptions"""
     pass
@@ -172,6 +564,11 @@ class LeastSquareError(FittingError):
     pass
 
 
+class TrackingError(FittingError):
+    """Indicates that a previously found peak could not be tracked"""
+    pass
+
+
 def fitnd(func, y, p0):
     """
         N-dimensional function fitting
@@ -194,6 +591,8 @@ def fitnd(func, y, p0):
         out : dict
             Returns the result of scipy.optimize.least_squares
     """
+    from scipy.optimize import least_squares
+
     def cost(p):
         res = np.fromfunction(func, y.shape, p=p) - y
         return np.ravel(res)  # must return vector for least_squares
@@ -208,7 +607,58 @@ def fit_gauss2d_cut(img, p0, cutoff):
     return fitnd(f, img, p0)
 
 
-def fit_gauss2d_cut_stable(img, h, a, x0, y0, sx, sy, rot, cutoff):
+def fit_gauss2d_cut_analytic(img, p0, cutoff):
+    """
+        Fit a 2d Gaussian with cutoff to an image using the analytic Jacobian
+
+        In contrast to `fit_gauss2d_cut`, the coordinate grids are computed
+        only once per call and `least_squares` is given the Jacobian from
+        `gauss2d_cut_jacobian` instead of estimating it by finite
+        differences.
+
+        Parameters
+        ----------
+        img : array_like
+            A 2d image
+        p0 : array_like
+            The initial parameters h, a, x0, y0, sx, sy, theta
+        cutoff : number
+            The fixed cutoff
+
+        Returns
+        -------
+        out : dict
+            Returns the result of scipy.optimize.least_squares
+    """
+    from scipy.optimize import least_squares
+    img = np.asarray(img, dtype=np.float64)
+    y, x = np.indices(img.shape, dtype=np.float64)
+    x = np.ravel(x)
+    y = np.ravel(y)
+    data = np.ravel(img)
+
+    # least_squares evaluates the Jacobian at the parameters of the most
+    # recent residual evaluation, so both are computed together
+    cache = {}
+
+    def evaluate(p):
+        key = tuple(p)
+        if cache.get("key") != key:
+            res, jac = gauss2d_cut_jacobian(x, y, *p, cutoff)
+            cache.update(key=key, res=res - data, jac=jac)
+        return cache
+
+    def cost(p):
+        return evaluate(p)["res"]
+
+    def jac(p):
+        return evaluate(p)["jac"]
+
+    return least_squares(cost, p0, jac=jac)
+
+
+def fit_gauss2d_cut_stable(img, h, a, x0, y0, sx, sy, rot, cutoff,
+                           analytic=True):
     """
         Fit a 2d Gaussian with cutoff to an image
 
@@ -223,6 +673,9 @@ def fit_gauss2d_cut_stable(img, h, a, x0, y0, sx, sy, rot, cutoff):
             The initial guess for the parameters
         cutoff : number
             The cutoff has to be fixed and is not fitted to the data
+        analytic : Boolean, optional
+            If True (default), the fit uses the analytic Jacobian of
+            `gauss2d_cut`. Otherwise, the generic `fitnd` is used
 
         Returns
         -------
@@ -237,9 +690,13 @@ def fit_gauss2d_cut_stable(img, h, a, x0, y0, sx, sy, rot, cutoff):
         See Also
         --------
         gauss2d_cut
+        fit_gauss2d_cut_analytic
     """
     p0_new = (h, a, x0, y0, sx, sy, rot)
-    res = fit_gauss2d_cut(img, p0_new, cutoff)
+    if analytic:
+        res = fit_gauss2d_cut_analytic(img, p0_new, cutoff)
+    else:
+        res = fit_gauss2d_cut(img, p0_new, cutoff)
     if not res.success:
         raise LeastSquareError(res.message)
 
@@ -254,7 +711,7 @@ def fit_gauss2d_cut_stable(img, h, a, x0, y0, sx, sy, rot, cutoff):
     return h, a, x0, y0, sx, sy, rot
 
 
-def find_roi(img, thresh, min_size=10):
+def find_roi(img, thresh, min_size=10, buffers=None):
     """
         Find the roi in an image with one or more Gaussian like peaks
 
@@ -270,6 +727,9 @@ def find_roi(img, thresh, min_size=10):
                 The threshold
             min_size : number
                 Minimum number of pixels above `thresh`
+            buffers : WorkBuffers, optional
+                If given, the binary and the label image are taken from
+                `buffers`
 
         Returns
         -------
@@ -289,14 +749,17 @@ def find_roi(img, thresh, min_size=10):
         skimage.measure.label
         skimage.measure.regionprops
     """
-    img2 = img.copy()
+    import scipy.ndimage as scimg
+    import skimage.measure as skimsr
 
     # if the peak is significantly smaller than max, it will be missed
-    img2[img2 <= thresh] = 0
-    img2[img2 > thresh] = 1
+    mask = np.greater(img, thresh, out=_empty(buffers, "roi_mask", img.shape,
+                                              bool))
 
-    # find connected regions with max intensity
-    label_img = skimsr.label(img2)
+    # find connected regions with max intensity, including diagonal
+    # neighbours as skimage.measure.label does
+    label_img = _empty(buffers, "roi_labels", img.shape, np.int32)
+    scimg.label(mask, structure=np.ones((3, 3)), output=label_img)
     regions = skimsr.regionprops(label_img)
 
     if not regions:
@@ -305,9 +768,7 @@ def find_roi(img, thresh, min_size=10):
     # if there are many regions, candidate regions must be significantly larger
     n_regions = len(regions)
     if n_regions > 10:
-        min_size = 50
-    else:
-        min_size = 10
+        min_size = 5*min_size
 
     # if there are too many regions, the threshold was too low
     # this indicates that there is no pronounced peak
@@ -324,9 +785,13 @@ def find_roi(img, thresh, min_size=10):
         raise SmallRegionError("No sufficiently large regions of interest " +
                                "found")
 
-    # choose region closest to the center of mass
-    com = scimg.center_of_mass(img2)
-    com = np.asarray(com)
+    # choose region closest to the center of mass of the binary image,
+    # computed from its projections to avoid full size temporaries
+    rows = mask.sum(axis=1, dtype=np.intp)
+    cols = mask.sum(axis=0, dtype=np.intp)
+    total = rows.sum()
+    com = np.array([rows @ np.arange(rows.size) / total,
+                    cols @ np.arange(cols.size) / total])
 
     def dist(r):
         rc = np.asarray(r.centroid)
@@ -336,7 +801,8 @@ def find_roi(img, thresh, min_size=10):
     return region
 
 
-def get_peak_parameters(img):
+def get_peak_parameters(img, binning=1, improve=True, dtype=np.float32,
+                        buffers=None, background=estimate_background):
     """
         Get the parameters of a Gaussian shaped peak close to the image center
 
@@ -348,6 +814,27 @@ def get_peak_parameters(img):
         ----------
         img : array_like
             A 2d image
+        binning : int, optional
+            If larger than 1, the region of interest and the initial guess
+            are determined on a copy of the image binned by this factor in
+            each direction. Only the region of interest is processed at full
+            resolution. This bounds memory and time for large images, but
+            the peak must be at least a few binned pixels wide to be found
+        improve : Boolean, optional
+            If False, dead pixels are not filtered with `improve_img`, e.g.,
+            because they were already corrected
+        dtype : data-type, optional
+            The floating point type of the full size images in which the
+            background is removed and the region of interest is searched.
+            The fit itself is always computed in double precision on the
+            region of interest only
+        buffers : WorkBuffers, optional
+            If given, all full size temporary arrays are taken from
+            `buffers` instead of being allocated for each image
+        background : callable, optional
+            Called with the improved, possibly binned image and `buffers`
+            to estimate the background, e.g., a `BackgroundEstimator`. The
+            image still has its original type if it was not binned
 
         Returns
         -------
@@ -360,6 +847,7 @@ def get_peak_parameters(img):
 
         See Also
         --------
+        bin_image
         find_roi
         fit_gauss2d_cut_stable
     """
@@ -367,30 +855,48 @@ def get_peak_parameters(img):
     offset_x, offset_y = 20, 20
     img = img[offset_x:-offset_x, offset_y:-offset_y]
 
-    img = improve_img(img)
-
     # remove the background
-    bg = estimate_background(img)
-    img -= bg
+    if binning > 1:
+        search_img = bin_image(img, binning, dtype=dtype)
+        if improve:
+            search_img = improve_img(search_img, buffers=buffers)
+        bg = float(background(search_img, buffers=buffers))
+        search_img -= bg
+    else:
+        if improve:
+            img = improve_img(img, buffers=buffers)
+        # estimated before the conversion, e.g., for a histogram of integers
+        bg = float(background(img, buffers=buffers))
+        if improve and img.dtype == dtype:
+            # improve_img returns a copy, which may be modified
+            search_img = img
+            search_img -= bg
+        else:
+            search_img = _empty(buffers, "work", img.shape, dtype)
+            np.subtract(img, bg, out=search_img, dtype=dtype,
+                        casting="unsafe")
+        img = search_img
 
     # estimate remaining noise
-    s = math.sqrt(estimate_noise(img))
+    s = estimate_noise(search_img, buffers=buffers)
 
     # estimate a threshold
-    thresh = find_threshold(img)
-    if thresh < 3*s:
+    thresh = find_threshold(search_img)
+    if _too_noisy(thresh, s):
         raise LargeNoiseError("Data too noisy for a reliable fit")
 
     # else find roi
-    roi = find_roi(img, thresh)
+    roi = find_roi(search_img, thresh,
+                   min_size=math.ceil(10/binning**2), buffers=buffers)
 
     # increase bounding box by a factor of 2
-    by_min, bx_min, by_max, bx_max = roi.bbox
+    by_min, bx_min, by_max, bx_max = (b*binning for b in roi.bbox)
 
     bx_width = bx_max - bx_min
     by_width = by_max - by_min
 
-    y0, x0 = roi.centroid
+    # centers of the binned pixels in full resolution coordinates
+    y0, x0 = (c*binning + (binning - 1)/2 for c in roi.centroid)
 
     bx_min_new = int(max(x0-bx_width, 0))
     bx_max_new = int(min(x0+bx_width, img.shape[1] - 1))
@@ -399,12 +905,16 @@ def get_peak_parameters(img):
 
     # only consider the image within the enlarged bbox
     sliced_img = img[by_min_new:by_max_new, bx_min_new:bx_max_new]
-    img[by_max_new, bx_max_new]
+    sliced_img = sliced_img.astype(np.float64)
+    if binning > 1:
+        if improve:
+            sliced_img = improve_img(sliced_img)
+        sliced_img -= bg
 
     cutoff = sliced_img.max()
 
-    w = roi.major_axis_length
-    h = roi.minor_axis_length
+    w = roi.major_axis_length*binning
+    h = roi.minor_axis_length*binning
 
     p0 = (0, 2*cutoff, bx_width, by_width, w/4, h/4, roi.orientation)
 
@@ -421,6 +931,101 @@ def get_peak_parameters(img):
     return h, a, x0, y0, sx, sy, rot, cutoff
 
 
+def track_peak_parameters(img, p_last, n_sigma=5, max_drift=10,
+                          max_residual=0.1, improve=True):
+    """
+        Refit a peak within a window around its last known position
+
+        In contrast to `get_peak_parameters`, no region of interest is
+        searched. Instead, a window of `n_sigma` standard deviations around
+        the last peak is cut from the image and fitted with the last
+        parameters as initial guess. This is much cheaper for a stable beam,
+        but only reliable as long as the peak does not move too far.
+
+        Parameters
+        ----------
+        img : array_like
+            A 2d image
+        p_last : tuple
+            The parameters h, a, x0, y0, sx, sy, rot, cutoff of the last fit,
+            e.g., as returned by `get_peak_parameters`
+        n_sigma : number, optional
+            The half size of the window in units of the larger standard
+            deviation of the last fit
+        max_drift : number, optional
+            The maximum distance in pixels between the last and the new peak
+            position. If None, the drift is not limited
+        max_residual : number, optional
+            The maximum root mean square residual of the fit in excess of the
+            estimated noise, relative to the height of the peak above the
+            background. If None, the residual is not limited
+        improve : Boolean, optional
+            If False, dead pixels are not filtered with `improve_img`
+
+        Returns
+        -------
+        h, a, x0, y0, sx, sy, rot, cutoff : number
+            The parameters of the fitted Gaussian with cutoff
+
+        Raises
+        ------
+        TrackingError
+            If the peak drifted too far, the residual is too large, or the
+            peak does not fit into the window anymore
+        LeastSquareError
+            If the `least_squares` result does not indicate success
+
+        See Also
+        --------
+        get_peak_parameters
+    """
+    h, a, x0, y0, sx, sy, rot, cutoff = p_last
+
+    # cut the edges because they often contain artefacts
+    border = 20
+    half = max(n_sigma*max(sx, sy), 10)
+    x_min = int(max(x0 - half, border))
+    x_max = int(min(x0 + half + 1, img.shape[1] - border))
+    y_min = int(max(y0 - half, border))
+    y_max = int(min(y0 + half + 1, img.shape[0] - border))
+    if x_max - x_min < 10 or y_max - y_min < 10:
+        raise TrackingError("Peak is too close to the image border")
+
+    window = img[y_min:y_max, x_min:x_max].astype(np.float64)
+    if improve:
+        window = improve_img(window)
+
+    cutoff = window.max()
+    noise = estimate_noise(window)
+    if _too_noisy((cutoff - h)/2, noise):
+        raise TrackingError("Peak is too small compared to the noise")
+
+    p0 = (h, a, x0 - x_min, y0 - y_min, sx, sy, rot)
+    p_fit = fit_gauss2d_cut_stable(window, *p0, cutoff)
+
+    if max_residual is not None:
+        y, x = np.indices(window.shape)
+        res = gauss2d_cut(x, y, *p_fit, cutoff) - window
+        # only the part of the residual that is not explained by noise
+        excess = math.sqrt(max(np.mean(res**2) - noise**2, 0))
+        if excess > max_residual*(cutoff - p_fit[0]):
+            raise TrackingError("Fit residual too large")
+
+    h, a, x0_new, y0_new, sx, sy, rot = p_fit
+    x0_new += x_min
+    y0_new += y_min
+
+    if max_drift is not None and math.hypot(x0_new - x0,
+                                            y0_new - y0) > max_drift:
+        raise TrackingError("Peak drifted too far")
+
+    if (a <= 0 or not x_min <= x0_new < x_max or
+            not y_min <= y0_new < y_max or 2*max(sx, sy) > half):
+        raise TrackingError("Peak does not fit into the window")
+
+    return h, a, x0_new, y0_new, sx, sy, rot, cutoff
+
+
 def random_gauss_params():
     h = 10*np.random.rand()
     a = h + 100*np.random.rand()
@@ -432,13 +1037,45 @@ def random_gauss_params():
     return h, a, x0, y0, sx, sy, theta
 
 
-def create_test_image(peak=True):
+def create_test_image(peak=True, shape=(600, 800), s_noise=None,
+                      n_dead=None):
+    """
+        Create a noisy image of a random Gaussian with cutoff and dead pixels
+
+        Parameters
+        ----------
+        peak : Boolean, optional
+            If False, the image contains only noise and dead pixels
+        shape : tuple of int, optional
+            The shape of the image. The peak position scales with the shape
+        s_noise : number, optional
+            The standard deviation of the noise. Random if not given
+        n_dead : int, optional
+            The number of dead pixels. Random if not given
+
+        Returns
+        -------
+        img : ndarray
+            The image
+        h, a, x0, y0, sx, sy, theta : tuple of numbers
+            The parameters of the Gaussian
+        cutoff : number
+            The cutoff of the image
+        s_noise : number
+            The standard deviation of the noise
+    """
     h, a, x0, y0, sx, sy, theta = random_gauss_params()
+    x0 *= shape[1]/800
+    y0 *= shape[0]/600
 
+    # always draw all random numbers to keep seeded sequences reproducible
     cutoff = h + 80*np.random.rand()
-    shape = (600, 800)
-    n_dead = int(100*np.random.rand())
-    s_noise = 2*np.random.rand()
+    n_dead_rand = int(100*np.random.rand())
+    s_noise_rand = 2*np.random.rand()
+    if n_dead is None:
+        n_dead = n_dead_rand
+    if s_noise is None:
+        s_noise = s_noise_rand
 
     if peak:
         # can't use gauss2d_cut here as noise would be added on top of cutoff
@@ -455,7 +1092,7 @@ def create_test_image(peak=True):
 
     # create random dead pixel
     xi_rand = np.random.randint(0, shape[0], n_dead)
-    yi_rand = np.random.randint(0, shape[0], n_dead)
+    yi_rand = np.random.randint(0, shape[1], n_dead)
     img_gauss[xi_rand, yi_rand] = a*np.random.rand(n_dead)
 
     # now the cutoff ensures there is no larger value in the image
@@ -466,12 +1103,15 @@ def create_test_image(peak=True):
     return img_gauss, (h, a, x0, y0, sx, sy, theta), cutoff, s_noise
 
 
-def setup_axes():
-    # Set up the axes with gridspec
-    fig = plt.figure()
-    grid = plt.GridSpec(4, 4, hspace=0.2, wspace=0.2)
+def setup_axes(fig=None):
+    # Set up the axes with gridspec, in a new pyplot figure if none is given
+    from matplotlib.artist import setp
+    if fig is None:
+        import matplotlib.pyplot as plt
+        fig = plt.figure()
+    grid = fig.add_gridspec(4, 4, hspace=0.2, wspace=0.2)
     main_ax = fig.add_subplot(grid[:-1, :-1])
-    plt.setp(main_ax.get_xticklabels(), visible=False)
+    setp(main_ax.get_xticklabels(), visible=False)
     y_slice = fig.add_subplot(grid[:-1, -1], sharey=main_ax)
     x_slice = fig.add_subplot(grid[-1, 0:-1], sharex=main_ax)
     main_ax.xaxis.tick_top()
@@ -480,15 +1120,18 @@ def setup_axes():
 
 
 def plot_gauss(img, p, axes=None, zoom=False):
+    from matplotlib.patches import Ellipse
     if axes is None:
         f, *axes = setup_axes()
-    elif len(axes) == 1:
+
+    if len(axes) == 1:
         a0 = axes[0]
         a1 = None
         a2 = None
+    else:
+        a0, a1, a2 = axes
 
-    a0, a1, a2 = axes
-
+    f = a0.figure
     h, a, x0, y0, sx, sy, rot, cutoff = p
 
     fit_img = np.fromfunction(lambda x, y: gauss2d_cut(y, x, *p), img.shape)
@@ -532,8 +1175,10 @@ def plot_gauss(img, p, axes=None, zoom=False):
         height = 6*max(sx, sy)
         a0.set_xlim(x0-width, x0+width)
         a0.set_ylim(y0+height, y0-height)
-        a1.set_ylim(y0+height, y0-height)
-        a2.set_xlim(x0-width, x0+width)
+        if a1:
+            a1.set_ylim(y0+height, y0-height)
+        if a2:
+            a2.set_xlim(x0-width, x0+width)
 
     return f, (a0, a1, a2)
 
@@ -541,14 +1186,16 @@ def plot_gauss(img, p, axes=None, zoom=False):
 def plot_roi(img, roi, axes=None):
     # taken from
     # http://scikit-image.org/docs/stable/auto_examples/segmentation/plot_regionprops.html # noqa
+    from matplotlib.patches import Ellipse
     if axes is None:
         f, *axes = setup_axes()
-    elif len(axes) == 1:
+
+    if len(axes) == 1:
         a0 = axes[0]
         a1 = None
         a2 = None
-
-    a0, a1, a2 = axes
+    else:
+        a0, a1, a2 = axes
 
     a0.grid()
     a0.imshow(img)
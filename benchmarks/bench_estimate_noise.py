@@ -0,0 +1,51 @@
+"""
+Run time of estimate_noise compared to the former convolve2d implementation
+
+Run with `python -m pytest benchmarks/bench_estimate_noise.py`
+"""
+from BeamlineStatusLogger import utils
+from scipy.signal import convolve2d
+import math
+import numpy as np
+import pytest
+
+SHAPES = [(600, 800), (1200, 1600), (2400, 3200)]
+
+
+def estimate_noise_convolve2d(img):
+    # the former implementation, kept as reference
+    H, W = img.shape
+
+    M = [[1, -2, 1],
+         [-2, 4, -2],
+         [1, -2, 1]]
+
+    sigma = np.sum(np.sum(np.absolute(convolve2d(img, M))))
+    sigma = sigma * math.sqrt(0.5 * math.pi) / (6 * (W-2) * (H-2))
+
+    return sigma
+
+
+def noise_image(shape, dtype):
+    np.random.seed(1234)
+    return (100 + 2*np.random.randn(*shape)).astype(dtype)
+
+
+def shape_id(shape):
+    return "{}x{}".format(*shape)
+
+
+@pytest.mark.parametrize("shape", SHAPES, ids=shape_id)
+def test_convolve2d(benchmark, shape):
+    benchmark.group = "estimate_noise " + shape_id(shape)
+    img = noise_image(shape, np.float64)
+    benchmark(estimate_noise_convolve2d, img)
+
+
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+@pytest.mark.parametrize("shape", SHAPES, ids=shape_id)
+def test_separable(benchmark, shape, dtype):
+    benchmark.group = "estimate_noise " + shape_id(shape)
+    img = noise_image(shape, dtype)
+    sigma = benchmark(utils.estimate_noise, img)
+    assert sigma == pytest.approx(2, rel=0.01)
@@ -0,0 +1,132 @@
+"""
+Run time of the stages of get_peak_parameters and of the PeakFitter
+
+The stages are timed on synthetic frames from `create_test_image` for
+several image sizes, noise levels and dead pixel counts. The full PeakFitter
+is additionally timed on the images in tests/images.
+
+Run with `python -m pytest benchmarks/bench_peak_parameters.py`
+"""
+from BeamlineStatusLogger import utils
+from BeamlineStatusLogger.processors import PeakFitter
+from BeamlineStatusLogger.sources import Data
+from datetime import datetime
+from functools import lru_cache
+from glob import glob
+import math
+import os
+import imageio
+import numpy as np
+import pytest
+
+SHAPES = [(600, 800), (1200, 1600), (2400, 3200)]
+NOISE = [0.5, 2]
+DEAD = [0, 100]
+
+IMAGE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "tests",
+                         "images")
+IMAGES = sorted(glob(os.path.join(IMAGE_DIR, "*", "*.png")))
+
+
+def shape_id(shape):
+    return "{}x{}".format(*shape)
+
+
+def run_peak_fitter(benchmark, img, **kwargs):
+    pf = PeakFitter(**kwargs)
+
+    def setup():
+        # the PeakFitter replaces the value of the data object
+        return (Data(datetime.now(), img),), {}
+
+    return benchmark.pedantic(pf, setup=setup, rounds=5)
+
+
+@lru_cache(maxsize=None)
+def frame(shape, s_noise, n_dead):
+    # a fixed seed keeps the frames identical between runs and versions
+    np.random.seed(1234)
+    img, p, cutoff, s_noise = utils.create_test_image(
+        shape=shape, s_noise=s_noise, n_dead=n_dead)
+    return img, p, cutoff
+
+
+@lru_cache(maxsize=None)
+def prepared(shape, s_noise, n_dead):
+    """The inputs of the stages after improve_img as in get_peak_parameters"""
+    img, p, cutoff = frame(shape, s_noise, n_dead)
+    img = utils.improve_img(img[20:-20, 20:-20])
+    img -= utils.estimate_background(img)
+    thresh = utils.find_threshold(img)
+    return img, thresh
+
+
+@pytest.mark.benchmark(group="improve_img")
+@pytest.mark.parametrize("method", ["fast", "median"])
+@pytest.mark.parametrize("n_dead", DEAD)
+@pytest.mark.parametrize("shape", SHAPES, ids=shape_id)
+def test_improve_img(benchmark, shape, n_dead, method):
+    img, p, cutoff = frame(shape, NOISE[0], n_dead)
+    benchmark(utils.improve_img, img, method=method)
+
+
+@pytest.mark.benchmark(group="estimate_background")
+@pytest.mark.parametrize("method", ["median", "subsample", "histogram"])
+@pytest.mark.parametrize("shape", SHAPES, ids=shape_id)
+def test_estimate_background(benchmark, shape, method):
+    img, p, cutoff = frame(shape, NOISE[0], DEAD[0])
+    # camera frames are integers
+    img = np.round(img).clip(0).astype(np.uint16)
+    benchmark(utils.estimate_background, img, method=method)
+
+
+@pytest.mark.benchmark(group="estimate_noise")
+@pytest.mark.parametrize("s_noise", NOISE)
+@pytest.mark.parametrize("shape", SHAPES, ids=shape_id)
+def test_estimate_noise(benchmark, shape, s_noise):
+    img, thresh = prepared(shape, s_noise, DEAD[0])
+    benchmark(utils.estimate_noise, img)
+
+
+@pytest.mark.benchmark(group="find_roi")
+@pytest.mark.parametrize("s_noise", NOISE)
+@pytest.mark.parametrize("shape", SHAPES, ids=shape_id)
+def test_find_roi(benchmark, shape, s_noise):
+    img, thresh = prepared(shape, s_noise, DEAD[0])
+    benchmark(utils.find_roi, img, thresh)
+
+
+@pytest.mark.benchmark(group="fit_gauss2d_cut_stable")
+@pytest.mark.parametrize("s_noise", NOISE)
+@pytest.mark.parametrize("shape", SHAPES, ids=shape_id)
+def test_fit_gauss2d_cut_stable(benchmark, shape, s_noise):
+    img, p, cutoff = frame(shape, s_noise, DEAD[0])
+    h, a, x0, y0, sx, sy, theta = p
+    # the window that get_peak_parameters would fit
+    half = math.ceil(4*max(sx, sy))
+    x_min, y_min = int(x0) - half, int(y0) - half
+    crop = img[y_min:y_min + 2*half, x_min:x_min + 2*half]
+    # start close to, but not at the solution
+    p0 = (h, 0.9*a, x0 - x_min + 1, y0 - y_min - 1, 1.1*sx, 0.9*sy, theta)
+    benchmark.pedantic(utils.fit_gauss2d_cut_stable, args=(crop, *p0, cutoff),
+                       rounds=5)
+
+
+@pytest.mark.benchmark(group="PeakFitter")
+@pytest.mark.parametrize("dtype", ["float32", "float64"])
+@pytest.mark.parametrize("n_dead", DEAD)
+@pytest.mark.parametrize("s_noise", NOISE)
+@pytest.mark.parametrize("shape", SHAPES, ids=shape_id)
+def test_peak_fitter(benchmark, shape, s_noise, n_dead, dtype):
+    img, p, cutoff = frame(shape, s_noise, n_dead)
+    # camera frames are integers
+    img = np.round(img).clip(0).astype(np.uint16)
+    data = run_peak_fitter(benchmark, img, dtype=dtype)
+    assert data.value["beam_on"]
+
+
+@pytest.mark.benchmark(group="PeakFitter images")
+@pytest.mark.parametrize("file", IMAGES, ids=os.path.basename)
+def test_peak_fitter_images(benchmark, file):
+    img = imageio.imread(file, as_gray=True)
+    run_peak_fitter(benchmark, img)
@@ -0,0 +1,85 @@
+"""
+Replay throughput of the InfluxDBSink spool
+
+The InfluxDB HTTP API is replaced by a local stand-in server that accepts
+every write, so the benchmark measures the spool and the client overhead.
+
+Run with `python -m pytest benchmarks/bench_spool.py`
+"""
+from BeamlineStatusLogger.sinks import InfluxDBSink
+from BeamlineStatusLogger.sources import Data
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from datetime import datetime, timedelta
+from socketserver import ThreadingMixIn
+import json
+import threading
+import pytest
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # only needed for get_list_database
+        body = json.dumps({"results": [{"statement_id": 0, "series": [{
+            "name": "databases", "columns": ["name"],
+            "values": [["bench"]]}]}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        body = self.rfile.read(length)
+        self.server.lines += body.count(b"\n") + 1
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    lines = 0
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = StandInServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+@pytest.mark.parametrize("n_points", [10000, 100000])
+@pytest.mark.parametrize("batch_size", [1000, 5000])
+def test_replay(benchmark, server, tmpdir, n_points, batch_size):
+    host, port = server.server_address
+    sink = InfluxDBSink("bench", "beam_parameters", host=host, port=port,
+                        spool_dir=str(tmpdir), spool_segment_age=0,
+                        replay_interval=1e6,
+                        replay_batch_size=batch_size,
+                        metadata={"device": "lm10"})
+    time = datetime(2018, 8, 15)
+    points = [sink._format(Data(time + timedelta(seconds=5*i),
+                                {"mu_x": 1.5*i, "mu_y": 2.5*i,
+                                 "beam_on": True}))
+              for i in range(n_points)]
+
+    def fill():
+        for i in range(0, n_points, 1000):
+            sink._spool_points(points[i:i+1000])
+
+    def replay():
+        assert sink.replay() == n_points
+
+    try:
+        benchmark.pedantic(replay, setup=fill, rounds=3)
+    finally:
+        sink.close()
+    # there are no stats with --benchmark-disable
+    if benchmark.stats:
+        benchmark.extra_info["points_per_second"] = (
+            n_points/benchmark.stats.stats.mean)
@@ -0,0 +1,54 @@
+"""
+Startup time of loggers with different components
+
+Every round starts a new interpreter that imports the modules, and creates
+the processors, of one kind of logger, as the beamline_status_logger script
+would. The cumulative import times of the slowest modules, as reported by
+`python -X importtime`, are stored as extra info of each benchmark.
+
+Run with `python -m pytest benchmarks/bench_startup.py`
+"""
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+
+SCALAR = ("import BeamlineStatusLogger as bsl; "
+          "bsl.sources, bsl.sinks, bsl.timer, bsl.Logger")
+LOGGERS = {
+    "package": "import BeamlineStatusLogger",
+    "scalar": SCALAR,
+    "peak_fitter": SCALAR + "; bsl.processors.PeakFitter()",
+}
+
+
+def run(code, *options):
+    return subprocess.run([sys.executable, *options, "-c", code], cwd=ROOT,
+                          check=True, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def slowest_imports(code, n=10):
+    """The n modules with the longest cumulative import time in µs"""
+    times = []
+    for line in run(code, "-X", "importtime").stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            times.append((int(fields[1]), fields[2].strip()))
+        except ValueError:
+            # the header line
+            continue
+    times.sort(reverse=True)
+    return {name: cumulative for cumulative, name in times[:n]}
+
+
+@pytest.mark.benchmark(group="startup")
+@pytest.mark.parametrize("logger", sorted(LOGGERS))
+def test_startup(benchmark, logger):
+    code = LOGGERS[logger]
+    benchmark.extra_info["slowest_imports"] = slowest_imports(code)
+    benchmark.pedantic(run, args=(code,), rounds=5)
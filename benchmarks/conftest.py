@@ -0,0 +1,16 @@
+import importlib
+
+
+LIBRARIES = ["numpy", "scipy", "skimage", "imageio", "influxdb"]
+
+
+def pytest_benchmark_update_machine_info(config, machine_info):
+    # store the library versions with saved results, so that a regression
+    # can be attributed to an upgrade
+    versions = {}
+    for name in LIBRARIES:
+        try:
+            versions[name] = importlib.import_module(name).__version__
+        except (ImportError, AttributeError):
+            versions[name] = None
+    machine_info["libraries"] = versions
@@ -0,0 +1,310 @@
+from BeamlineStatusLogger.archive import (
+    ChunkedFrameStore, FrameArchiver, render_frame, render_archived_frame)
+import BeamlineStatusLogger.archive as archive
+from datetime import datetime, timedelta
+from glob import glob
+import os
+import threading
+from matplotlib.figure import Figure
+import numpy as np
+import pytest
+
+
+PARAMS = (0, 10, 40, 30, 5, 4, 0.3, 8)
+
+
+def image():
+    y, x = np.indices((60, 80))
+    return 10*np.exp(-((x - 40)**2/50 + (y - 30)**2/32))
+
+
+def frame_time(i):
+    return datetime(2018, 8, 28) + timedelta(seconds=i)
+
+
+class TestFrameArchiver:
+    def test_init(self, tmpdir):
+        with pytest.raises(ValueError):
+            FrameArchiver(str(tmpdir.join("missing")))
+
+    def test_submit(self, tmpdir):
+        archiver = FrameArchiver(str(tmpdir))
+        img = image()
+        assert archiver.submit(frame_time(0), img, PARAMS)
+        archiver.close()
+
+        base = os.path.join(str(tmpdir), "img_" + frame_time(0).isoformat())
+        assert np.array_equal(np.load(base + ".npy"), img)
+        assert tuple(np.load(base + "_fit.npy")) == PARAMS
+        assert os.path.exists(base + ".png")
+        assert os.path.exists(base + "_zoomed.png")
+        assert archiver.size() == sum(
+            os.path.getsize(path) for path in glob(base + "*"))
+
+    def test_no_render(self, tmpdir):
+        archiver = FrameArchiver(str(tmpdir), render=False)
+        archiver.submit(frame_time(0), image(), PARAMS)
+        archiver.close()
+        base = os.path.join(str(tmpdir), "img_" + frame_time(0).isoformat())
+        assert not os.path.exists(base + ".png")
+
+        render_archived_frame(base)
+        assert os.path.exists(base + ".png")
+        assert os.path.exists(base + "_zoomed.png")
+
+    def test_max_rate(self, tmpdir, monkeypatch):
+        clock = [0]
+        monkeypatch.setattr(archive, "monotonic", lambda: clock[0])
+        archiver = FrameArchiver(str(tmpdir), max_rate=2, render=False)
+        results = []
+        for i in range(5):
+            results.append(archiver.submit(frame_time(i), image(), PARAMS))
+            clock[0] += 0.3
+        archiver.close()
+        assert results == [True, False, True, False, True]
+        assert archiver.dropped == 2
+        assert len(glob(os.path.join(str(tmpdir), "*_fit.npy"))) == 3
+
+    def test_queue_full(self, tmpdir, monkeypatch):
+        release = threading.Event()
+        written = []
+
+        def blocking_write(time, img, p):
+            release.wait(5)
+            written.append(time)
+
+        archiver = FrameArchiver(str(tmpdir), max_queue=2)
+        monkeypatch.setattr(archiver, "_write", blocking_write)
+        results = [archiver.submit(frame_time(i), image(), PARAMS)
+                   for i in range(5)]
+        # the first frame may already be taken by the background thread
+        assert results[:2] == [True, True]
+        assert archiver.dropped >= 2
+        release.set()
+        archiver.close()
+        assert len(written) == 5 - archiver.dropped
+
+    def test_write_failure(self, tmpdir, monkeypatch):
+        archiver = FrameArchiver(str(tmpdir), render=False)
+
+        def failing_write(time, img, p):
+            raise OSError("disk full")
+
+        monkeypatch.setattr(archiver, "_write", failing_write)
+        archiver.submit(frame_time(0), image(), PARAMS)
+        archiver.flush()
+        assert archiver._thread.is_alive()
+        archiver.close()
+        assert not archiver._thread.is_alive()
+
+    def test_quota(self, tmpdir):
+        archiver = FrameArchiver(str(tmpdir), render=False)
+        for i in range(5):
+            archiver.submit(frame_time(i), image(), PARAMS)
+            archiver.flush()
+            # distinct modification times
+            base = os.path.join(str(tmpdir), "img_" +
+                                frame_time(i).isoformat())
+            for suffix in archive.FRAME_SUFFIXES[:2]:
+                os.utime(base + suffix, (i, i))
+            if i == 0:
+                archiver.max_bytes = 2.5*archiver.size()
+        archiver.close()
+        fits = sorted(glob(os.path.join(str(tmpdir), "*_fit.npy")))
+        assert [os.path.basename(path) for path in fits] == [
+            "img_" + frame_time(i).isoformat() + "_fit.npy" for i in [3, 4]]
+        assert archiver.size() <= archiver.max_bytes
+
+    def test_quota_existing_frames(self, tmpdir, monkeypatch):
+        archiver = FrameArchiver(str(tmpdir), render=False)
+        for i in range(3):
+            archiver.submit(frame_time(i), image(), PARAMS)
+            archiver.flush()
+        archiver.close()
+        frame_size = archiver.size()/3
+
+        # the frames of a previous run are listed once on construction
+        archiver = FrameArchiver(str(tmpdir), render=False,
+                                 max_bytes=3.5*frame_size)
+        assert archiver.size() == 3*frame_size
+
+        def no_glob(pattern):
+            raise AssertionError("the directory is listed again")
+
+        monkeypatch.setattr(archive.glob, "glob", no_glob)
+        for i in range(3, 5):
+            archiver.submit(frame_time(i), image(), PARAMS)
+            archiver.flush()
+        archiver.close()
+        monkeypatch.undo()
+        fits = sorted(glob(os.path.join(str(tmpdir), "*_fit.npy")))
+        assert [os.path.basename(path) for path in fits] == [
+            "img_" + frame_time(i).isoformat() + "_fit.npy"
+            for i in [2, 3, 4]]
+        assert archiver.size() == 3*frame_size
+
+    def test_chunked(self, tmpdir):
+        archiver = FrameArchiver(str(tmpdir), format="chunked",
+                                 chunk_frames=2)
+        for i in range(3):
+            archiver.submit(frame_time(i), image(), PARAMS)
+        archiver.close()
+        assert not glob(os.path.join(str(tmpdir), "img_*"))
+        store = ChunkedFrameStore(str(tmpdir))
+        assert len(store.index()) == 3
+        assert store.chunks() == [0, 1]
+        assert archiver.size() == store.size()
+
+    def test_unknown_format(self, tmpdir):
+        with pytest.raises(ValueError):
+            FrameArchiver(str(tmpdir), format="hdf5")
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for name in os.listdir(directory))
+
+
+class TestChunkedFrameStore:
+    def test_append(self, tmpdir):
+        store = ChunkedFrameStore(str(tmpdir), chunk_frames=3)
+        imgs = [image() + i for i in range(7)]
+        for i, img in enumerate(imgs):
+            store.append(frame_time(i), img, PARAMS)
+        # the current chunk is only renamed into place when it is closed
+        assert store.chunks() == [0, 1]
+        assert os.path.exists(store.chunk_path(2) + ".open")
+        assert store.size() == directory_size(str(tmpdir))
+        store.close()
+        assert store.chunks() == [0, 1, 2]
+        assert not os.path.exists(store.chunk_path(2) + ".open")
+        assert store.size() == directory_size(str(tmpdir))
+
+        index = store.index()
+        assert isinstance(index, np.memmap)
+        assert list(index["chunk"]) == [0, 0, 0, 1, 1, 1, 2]
+        assert list(index["slot"]) == [0, 1, 2, 0, 1, 2, 0]
+        assert index["time"][4] == frame_time(4).timestamp()
+        assert tuple(index[0])[3:] == PARAMS
+
+        # a chunk can be read without the store
+        with np.load(store.chunk_path(1)) as chunk:
+            assert np.array_equal(chunk["frame_2"], imgs[5])
+
+    def test_read_window(self, tmpdir):
+        store = ChunkedFrameStore(str(tmpdir), chunk_frames=3)
+        imgs = [image() + i for i in range(7)]
+        for i, img in enumerate(imgs):
+            store.append(frame_time(i), img, PARAMS)
+
+        records, frames = store.read_window(frame_time(2), frame_time(5))
+        assert list(records["time"]) == [
+            frame_time(i).timestamp() for i in [2, 3, 4]]
+        assert len(frames) == 3
+        for img, i in zip(frames, [2, 3, 4]):
+            assert np.array_equal(img, imgs[i])
+
+        # frames of the current chunk are readable once it is closed
+        records, frames = store.read_window(frame_time(5), frame_time(10))
+        assert list(records["slot"]) == [2]
+        store.close()
+        records, frames = store.read_window(frame_time(5), frame_time(10))
+        assert list(records["slot"]) == [2, 0]
+        assert np.array_equal(frames[1], imgs[6])
+
+        records, frames = store.read_window(frame_time(10), frame_time(20))
+        assert len(records) == 0
+        assert frames == []
+
+    def test_reopen(self, tmpdir):
+        store = ChunkedFrameStore(str(tmpdir), chunk_frames=3)
+        store.append(frame_time(0), image(), PARAMS)
+        store.close()
+        store = ChunkedFrameStore(str(tmpdir), chunk_frames=3)
+        store.append(frame_time(1), image(), PARAMS)
+        store.close()
+        # frames of a new run go to a new chunk
+        assert store.chunks() == [0, 1]
+        records, frames = store.read_window(frame_time(0), frame_time(2))
+        assert list(records["chunk"]) == [0, 1]
+        assert len(frames) == 2
+
+    def test_crash(self, tmpdir):
+        crashed = ChunkedFrameStore(str(tmpdir), chunk_frames=2)
+        for i in range(3):
+            crashed.append(frame_time(i), image(), PARAMS)
+        # the process crashed without closing the store, the reference
+        # keeps the zip file from being closed on garbage collection
+        store = ChunkedFrameStore(str(tmpdir), chunk_frames=2)
+        assert store.size() == directory_size(str(tmpdir))
+        store.append(frame_time(3), image(), PARAMS)
+        store.close()
+        # only the frame of the unclosed chunk is lost
+        records, frames = store.read_window(frame_time(0), frame_time(4))
+        assert list(records["chunk"]) == [0, 0, 2]
+        assert len(frames) == 3
+
+        # the leftover of the crash is deleted first
+        store.delete_oldest(store.size() - 1)
+        assert not os.path.exists(store.chunk_path(1) + ".open")
+        assert store.chunks() == [0, 2]
+
+    def test_crash_unindexed_chunk(self, tmpdir):
+        store = ChunkedFrameStore(str(tmpdir), chunk_frames=2)
+        for i in range(2):
+            store.append(frame_time(i), image(), PARAMS)
+        store.close()
+        # the process crashed while writing the first frame of chunk 1
+        leftover = store.chunk_path(1) + ".open"
+        with open(leftover, "wb") as f:
+            f.write(b"PK\x03\x04")
+        store = ChunkedFrameStore(str(tmpdir), chunk_frames=2)
+        assert store.chunk == 2
+        store.append(frame_time(2), image(), PARAMS)
+        assert store.size() == directory_size(str(tmpdir))
+
+        # only the leftover is deleted, not the current chunk
+        store.delete_oldest(store.size() - 1)
+        assert not os.path.exists(leftover)
+        assert os.path.exists(store.chunk_path(2) + ".open")
+        assert store.size() == directory_size(str(tmpdir))
+        store.close()
+        records, frames = store.read_window(frame_time(0), frame_time(3))
+        assert list(records["chunk"]) == [0, 0, 2]
+        assert len(frames) == 3
+
+    def test_empty(self, tmpdir):
+        store = ChunkedFrameStore(str(tmpdir.join("new")))
+        assert len(store.index()) == 0
+        records, frames = store.read_window(0, 1e10)
+        assert len(records) == 0
+
+    def test_delete_oldest(self, tmpdir):
+        store = ChunkedFrameStore(str(tmpdir), chunk_frames=1)
+        for i in range(4):
+            store.append(frame_time(i), image(), PARAMS)
+        chunk_size = os.path.getsize(store.chunk_path(0))
+        store.delete_oldest(store.size() - chunk_size)
+        assert store.chunks() == [1, 2]
+        assert store.size() == directory_size(str(tmpdir))
+        # the current chunk is kept
+        store.delete_oldest(0)
+        assert store.chunks() == []
+        store.close()
+        assert store.chunks() == [3]
+
+        # frames of deleted chunks are skipped
+        records, frames = store.read_window(frame_time(0), frame_time(4))
+        assert list(records["chunk"]) == [3]
+        assert len(frames) == 1
+
+
+def test_render_frame_reuses_figure(tmpdir):
+    figure = Figure()
+    for i in range(2):
+        filename = str(tmpdir.join("frame{}".format(i)))
+        render_frame(image(), PARAMS, filename, figure)
+        assert os.path.exists(filename + ".png")
+        assert os.path.exists(filename + "_zoomed.png")
+    # the axes of the previous frame are removed
+    assert len(figure.axes) == 3
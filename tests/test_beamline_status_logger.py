@@ -0,0 +1,136 @@
+from importlib.machinery import SourceFileLoader
+import json
+import os
+import signal
+import threading
+import time
+import types
+import pytest
+
+
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+
+GOOD = """
+[source]
+class = TINECameraSource
+
+[sink]
+class = InfluxDBSink
+
+[timer]
+class = SynchronizedPeriodicTimer
+period = 1
+"""
+
+
+def load_script():
+    path = os.path.join(ROOT, "bin", "beamline_status_logger")
+    loader = SourceFileLoader("beamline_status_logger", path)
+    module = types.ModuleType(loader.name)
+    loader.exec_module(module)
+    return module
+
+
+class BlockingLogger:
+    def __init__(self):
+        self.event = threading.Event()
+
+    def run(self):
+        self.event.wait()
+
+    def abort(self):
+        self.event.set()
+
+    def close(self):
+        pass
+
+
+def write(directory, name, text, mtime):
+    path = directory.join(name)
+    path.write(text)
+    # file systems may have a coarse time resolution
+    os.utime(str(path), (mtime, mtime))
+
+
+def read_health(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def script(monkeypatch):
+    script = load_script()
+    monkeypatch.setattr(script, "create_Logger",
+                        lambda config, name: BlockingLogger())
+    handlers = {}
+    monkeypatch.setattr(script.signal, "signal",
+                        lambda signum, handler: handlers.update(
+                            {signum: handler}))
+    script.handlers = handlers
+    return script
+
+
+def supervise(script, tmpdir, watch, check):
+    # runs `check` while supervising the loggers in tmpdir
+    health_file = str(tmpdir.join("health.json"))
+
+    def stop():
+        try:
+            check(lambda: read_health(health_file))
+        finally:
+            wait_for(lambda: signal.SIGTERM in script.handlers)
+            script.handlers[signal.SIGTERM](signal.SIGTERM, None)
+
+    t = threading.Thread(target=stop)
+    t.start()
+    try:
+        script.supervise(str(tmpdir.join("configs")), 0.05, health_file,
+                         watch)
+    finally:
+        t.join()
+    return read_health(health_file)
+
+
+class TestSupervise:
+    @pytest.fixture
+    def configs(self, tmpdir):
+        configs = tmpdir.mkdir("configs")
+        write(configs, "good.logger", GOOD, 1)
+        write(configs, "bad.logger", "[source\n", 1)
+        return configs
+
+    def test_unparsable_file(self, script, tmpdir, configs):
+        def check(health):
+            wait_for(lambda: health().get("bad", {}).get("restarts", 0) >= 2)
+            assert health()["good"]["state"] == "running"
+
+        health = supervise(script, tmpdir, None, check)
+        # the file is retried with backoff
+        assert health["bad"]["failures"] >= 2
+        assert "no section headers" in health["bad"]["last_error"]
+        assert health["good"]["restarts"] == 0
+
+    def test_unparsable_file_watch(self, script, tmpdir, configs):
+        def check(health):
+            wait_for(lambda: health().get("bad", {}).get("failures", 0) >= 1)
+            write(configs, "bad.logger", GOOD, 2)
+            wait_for(lambda: health()["bad"]["state"] == "running")
+            write(configs, "new.logger", "[source\n", 2)
+            wait_for(lambda: health().get("new", {}).get("failures", 0) >= 1)
+            os.remove(str(configs.join("new.logger")))
+            wait_for(lambda: "new" not in health())
+
+        health = supervise(script, tmpdir, 0.01, check)
+        assert health["bad"]["state"] == "stopped"
+        assert health["good"]["restarts"] == 0
@@ -0,0 +1,112 @@
+from BeamlineStatusLogger.config import (
+    ConfigError, ConfigWatcher, config_chain, config_files, parse_config_file)
+import os
+import pytest
+
+
+BASE = """
+[sink]
+class = InfluxDBSink
+database = test
+measurement = beam
+
+[timer]
+class = SynchronizedPeriodicTimer
+period = 1
+"""
+
+
+def camera(device):
+    return """
+[based on]
+base.conf
+
+[source]
+class = TangoDeviceAttributeSource
+device_name = {}
+attribute_name = image
+""".format(device)
+
+
+def write(directory, name, text, mtime=None):
+    path = directory.join(name)
+    path.write(text)
+    if mtime is not None:
+        # file systems may have a coarse time resolution
+        os.utime(str(path), (mtime, mtime))
+    return str(path)
+
+
+@pytest.fixture
+def config_dir(tmpdir):
+    write(tmpdir, "base.conf", BASE, 1)
+    write(tmpdir, "cam1.logger", camera("p02/cam/1"), 1)
+    write(tmpdir, "cam2.logger", camera("p02/cam/2"), 1)
+    return tmpdir
+
+
+def test_parse_config_file(config_dir):
+    config = parse_config_file(str(config_dir.join("cam1.logger")))
+    assert config["source"]["device_name"] == "p02/cam/1"
+    assert config["sink"]["database"] == "test"
+    assert config["timer"]["period"] == 1
+    assert "based on" not in config
+
+
+def test_config_chain(config_dir):
+    path = str(config_dir.join("cam1.logger"))
+    assert config_chain(path) == [path, str(config_dir.join("base.conf"))]
+    write(config_dir, "loop.logger", "[based on]\nloop.logger\n")
+    with pytest.raises(ConfigError):
+        config_chain(str(config_dir.join("loop.logger")))
+
+
+def test_config_files(config_dir):
+    assert [os.path.basename(path) for path in
+            config_files(str(config_dir))] == ["cam1.logger", "cam2.logger"]
+    path = str(config_dir.join("base.conf"))
+    assert config_files(path) == [path]
+
+
+class TestConfigWatcher:
+    def test_poll(self, config_dir):
+        watcher = ConfigWatcher(str(config_dir))
+        assert watcher.poll() == (["cam1", "cam2"], [], [])
+        assert watcher.poll() == ([], [], [])
+        assert watcher.configs["cam2"]["source"]["device_name"] == \
+            "p02/cam/2"
+        assert watcher.paths["cam1"] == str(config_dir.join("cam1.logger"))
+
+        write(config_dir, "cam2.logger", camera("p02/cam/22"), 2)
+        write(config_dir, "cam3.logger", camera("p02/cam/3"), 2)
+        os.remove(str(config_dir.join("cam1.logger")))
+        assert watcher.poll() == (["cam3"], ["cam2"], ["cam1"])
+        assert watcher.configs["cam2"]["source"]["device_name"] == \
+            "p02/cam/22"
+        assert set(watcher.configs) == {"cam2", "cam3"}
+
+    def test_base_changed(self, config_dir):
+        watcher = ConfigWatcher(str(config_dir))
+        watcher.poll()
+        write(config_dir, "base.conf", BASE.replace("period = 1",
+                                                    "period = 5"), 2)
+        assert watcher.poll() == ([], ["cam1", "cam2"], [])
+        assert watcher.configs["cam1"]["timer"]["period"] == 5
+
+    def test_touched(self, config_dir):
+        watcher = ConfigWatcher(str(config_dir))
+        watcher.poll()
+        write(config_dir, "cam1.logger",
+              "# a comment\n" + camera("p02/cam/1"), 2)
+        assert watcher.poll() == ([], [], [])
+
+    def test_invalid_file(self, config_dir):
+        watcher = ConfigWatcher(str(config_dir))
+        watcher.poll()
+        write(config_dir, "cam1.logger", "[source\n", 2)
+        assert watcher.poll() == ([], [], [])
+        # the last valid configuration is kept
+        assert watcher.configs["cam1"]["source"]["device_name"] == \
+            "p02/cam/1"
+        write(config_dir, "cam1.logger", camera("p02/cam/11"), 3)
+        assert watcher.poll() == ([], ["cam1"], [])
@@ -1,5 +1,7 @@
-from BeamlineStatusLogger.logger import Logger
+from BeamlineStatusLogger.logger import Logger, AsyncLogger, LoggerStats
+import BeamlineStatusLogger.logger as logger_module
 from time import sleep
+import asyncio
 from threading import Thread
 import pytest
 
@@ -55,6 +57,25 @@ class MockTimer:
         self.arg = None
 
 
+class AsyncMockSource(MockSource):
+    async def read(self):
+        await asyncio.sleep(0)
+        return self.ret
+
+
+class AsyncMockSink(MockSink):
+    async def write(self, arg):
+        await asyncio.sleep(0)
+        self.arg = arg
+        return True
+
+
+class AsyncMockTimer(MockTimer):
+    async def __call__(self, arg):
+        await asyncio.sleep(0.01)
+        return MockTimer.__call__(self, arg)
+
+
 @pytest.fixture
 def mockSource():
     return MockSource(0)
@@ -155,3 +176,201 @@ class TestLogger:
         logger.abort()
         # wait until logger finished aborting
         t.join()
+
+    def test_close(self, mockSource, mockSink, mockTimer):
+        closed = []
+
+        class ClosingProcessor(MockProcessor):
+            def close(self):
+                closed.append(self)
+
+        procs = [ClosingProcessor(1), MockProcessor(2), ClosingProcessor(3)]
+        logger = Logger(mockSource, procs, mockSink, mockTimer)
+        logger.close()
+        assert closed == [procs[0], procs[2]]
+
+
+class TestAsyncLogger:
+    def test_init_sync_timer(self, mockSource, mockSink, mockTimer):
+        with pytest.raises(TypeError):
+            AsyncLogger(mockSource, [], mockSink, mockTimer)
+
+    def test_run_async(self):
+        procs = [MockProcessor(1), MockProcessor(2)]
+        source = AsyncMockSource(0)
+        sink = AsyncMockSink()
+        timer = AsyncMockTimer(max_call=10)
+        logger = AsyncLogger(source, procs, sink, timer)
+        asyncio.run(logger.run())
+        assert procs[0].arg == 0
+        assert procs[1].arg == 1
+        assert sink.arg == 2
+        assert timer.call_count == 10
+
+    def test_run_sync_components(self, mockSource, mockSink):
+        timer = AsyncMockTimer(max_call=10)
+        logger = AsyncLogger(mockSource, adder(1), mockSink, timer)
+        asyncio.run(logger.run())
+        assert mockSink.arg == 1
+        assert timer.arg
+        assert timer.call_count == 10
+
+    def test_run_many_abort(self):
+        sinks = [AsyncMockSink() for i in range(10)]
+        loggers = [AsyncLogger(AsyncMockSource(i), [], sink, AsyncMockTimer())
+                   for i, sink in enumerate(sinks)]
+
+        async def run():
+            tasks = [asyncio.ensure_future(logger.run())
+                     for logger in loggers]
+            while not all(sink.arg is not None for sink in sinks):
+                await asyncio.sleep(0.01)
+            for logger in loggers:
+                logger.abort()
+            await asyncio.wait_for(asyncio.gather(*tasks), 5)
+
+        asyncio.run(run())
+        assert [sink.arg for sink in sinks] == list(range(10))
+
+
+class CollectingSink:
+    def __init__(self, success=True):
+        self.data = []
+        self.success = success
+
+    def write(self, data):
+        self.data.append(data)
+        return self.success
+
+
+class MockClock:
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+class TestLoggerStats:
+    def test_add(self):
+        stats = LoggerStats(CollectingSink())
+        for duration in [1, 3, 2]:
+            stats.add("read", duration)
+        stats.add_cycle(4, period=5)
+        stats.add_cycle(6, period=5)
+        stats.add_cycle(6)
+        data = stats.to_data()
+        assert data.value == {"cycles": 3, "overruns": 1, "read_count": 3,
+                              "read_mean": 2, "read_max": 3}
+
+    def test_write(self, monkeypatch):
+        clock = MockClock()
+        monkeypatch.setattr(logger_module, "monotonic", clock)
+        sink = CollectingSink()
+        stats = LoggerStats(sink, interval=60, metadata={"logger": "LM10"})
+        stats.add("read", 1)
+        stats.add_cycle(1)
+        assert not stats.due()
+        clock.time = 60
+        assert stats.due()
+        stats.write()
+        assert len(sink.data) == 1
+        assert sink.data[0].value["read_count"] == 1
+        assert sink.data[0].metadata == {"logger": "LM10"}
+        assert sink.data[0].metadata is not stats.metadata
+        assert stats.cycles == 0
+        assert not stats.due()
+        # nothing is written without new durations
+        stats.write()
+        assert len(sink.data) == 1
+
+    def test_write_failure(self):
+        class FailingSink:
+            def write(self, data):
+                raise IOError()
+
+        stats = LoggerStats(FailingSink())
+        stats.add_cycle(1)
+        stats.write()
+        assert stats.cycles == 0
+
+    def test_run(self, mockSource, mockSink):
+        stats_sink = CollectingSink()
+        stats = LoggerStats(stats_sink, interval=3600)
+        timer = MockTimer(max_call=10)
+        timer.period = 5
+        logger = Logger(mockSource, [adder(1), adder(2)], mockSink, timer,
+                        stats=stats)
+        logger.run()
+        assert mockSink.arg == 3
+        # the remaining statistics are written when the logger stops
+        assert len(stats_sink.data) == 1
+        value = stats_sink.data[0].value
+        assert value["cycles"] == 9
+        assert value["overruns"] == 0
+        for stage in ["timer", "read", "processor0_<lambda>",
+                      "processor1_<lambda>", "write"]:
+            assert value[stage + "_count"] == 9
+            assert value[stage + "_max"] >= value[stage + "_mean"]
+
+    def test_run_overrun(self, mockSource, mockSink):
+        stats_sink = CollectingSink()
+        timer = MockTimer(max_call=4)
+        timer.period = 0.01
+
+        def slow(data):
+            sleep(0.02)
+            return data
+
+        logger = Logger(mockSource, slow, mockSink, timer,
+                        stats=LoggerStats(stats_sink))
+        logger.run()
+        assert stats_sink.data[0].value["overruns"] == 3
+
+    def test_run_async(self):
+        stats_sink = CollectingSink()
+        timer = AsyncMockTimer(max_call=5)
+        sink = AsyncMockSink()
+        logger = AsyncLogger(AsyncMockSource(0), adder(1), sink, timer,
+                             stats=LoggerStats(stats_sink))
+        asyncio.run(logger.run())
+        assert sink.arg == 1
+        value = stats_sink.data[0].value
+        assert value["cycles"] == 4
+        assert value["processor0_<lambda>_count"] == 4
+
+    def test_close(self, mockSource, mockSink, mockTimer):
+        closed = []
+
+        class ClosingSink(CollectingSink):
+            def close(self):
+                closed.append(self)
+
+        stats_sink = ClosingSink()
+        logger = Logger(mockSource, [], mockSink, mockTimer,
+                        stats=LoggerStats(stats_sink))
+        logger.close()
+        assert closed == [stats_sink]
+
+    def test_watch(self):
+        stats = LoggerStats(CollectingSink())
+        count = 3
+        stats.watch("dropped", lambda: count)
+        count = 5
+        assert stats.to_data().value["dropped"] == 2
+        stats.write()
+        count = 6
+        assert stats.to_data().value["dropped"] == 1
+
+    def test_run_dropped(self, mockSource, mockSink):
+        mockSource.dropped = 0
+
+        def drop(data):
+            mockSource.dropped += 2
+            return data
+
+        stats_sink = CollectingSink()
+        logger = Logger(mockSource, drop, mockSink, MockTimer(max_call=4),
+                        stats=LoggerStats(stats_sink))
+        logger.run()
+        assert stats_sink.data[0].value["source_dropped"] == 6
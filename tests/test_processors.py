@@ -1,13 +1,41 @@
 import BeamlineStatusLogger.processors as procs
-from BeamlineStatusLogger.processors import PeakFitter, ToString
+from BeamlineStatusLogger.processors import (
+    PeakFitter, ToString, DeadPixelMap)
 from BeamlineStatusLogger.sources import Data
 import BeamlineStatusLogger.utils as utils
 import numpy as np
 from datetime import datetime
 import os
+import subprocess
+import sys
+import time
 from unittest.mock import Mock
 import pytest
 
+ROOT = os.path.join(os.path.dirname(__file__), os.pardir)
+
+
+def exit_worker(img):
+    os._exit(1)
+
+
+def imported_modules(code):
+    # the modules imported by `code` in a fresh interpreter
+    code += "; import sys; print(' '.join(sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True)
+    return {name.split(".")[0] for name in out.stdout.split()}
+
+
+def test_lazy_imports():
+    modules = imported_modules("import BeamlineStatusLogger.processors")
+    assert not modules & {"scipy", "skimage", "matplotlib"}
+
+    modules = imported_modules("import BeamlineStatusLogger.processors as p; "
+                               "p.PeakFitter()")
+    assert {"scipy", "skimage"} <= modules
+    assert "matplotlib" not in modules
+
 
 class TestToString:
     def test_to_string(self):
@@ -50,7 +78,7 @@ class TestPeakFitter:
         assert proc_data.metadata["id"] == 1234
 
     def test_peak_fitter_beam(self, monkeypatch):
-        def mockreturn(img):
+        def mockreturn(img, **kwargs):
                 return 0, 1, 2, 3, 4, 5, 6, 7
         monkeypatch.setattr(utils, 'get_peak_parameters', mockreturn)
 
@@ -71,7 +99,7 @@ class TestPeakFitter:
         assert proc_data.metadata["id"] == 1234
 
     def test_peak_fitter_beam_key(self, monkeypatch):
-        def mockreturn(img):
+        def mockreturn(img, **kwargs):
                 return 0, 1, 2, 3, 4, 5, 6, 7
         monkeypatch.setattr(utils, 'get_peak_parameters', mockreturn)
 
@@ -93,22 +121,239 @@ class TestPeakFitter:
         assert proc_data.value["cutoff"] == 7
         assert proc_data.metadata["id"] == 1234
 
-    def test_peak_fitter_convert_float(self, monkeypatch):
+    def test_peak_fitter_no_copy(self, monkeypatch):
+        calls = []
+
+        def mockreturn(img, **kwargs):
+            calls.append((img, kwargs["buffers"]))
+            return 0, 1, 2, 3, 4, 5, 6, 7
+        monkeypatch.setattr(utils, 'get_peak_parameters', mockreturn)
+
+        frame = np.random.randint(0, 255, (600, 800))
+        pf = PeakFitter("frame")
+        for i in range(2):
+            data = Data(datetime(2018, 8, 28),
+                        {"frame": frame, "quality": 0},
+                        metadata={"id": 1234})
+            pf(data)
+        # the image is converted by get_peak_parameters into the buffers
+        assert calls[0][0] is frame
+        assert isinstance(calls[0][1], utils.WorkBuffers)
+        assert calls[1][1] is calls[0][1]
+
+    def test_peak_fitter_dtype(self, monkeypatch):
+        dtypes = []
+
+        def mockreturn(img, **kwargs):
+            dtypes.append(kwargs["dtype"])
+            return 0, 1, 2, 3, 4, 5, 6, 7
+        monkeypatch.setattr(utils, 'get_peak_parameters', mockreturn)
+
+        img = np.random.randint(0, 255, (600, 800)).astype(np.uint8)
+        pf = PeakFitter(dtype="float64")
+        pf(Data(datetime(2018, 8, 28), img))
+        pf = PeakFitter(binning=2)
+        pf(Data(datetime(2018, 8, 28), img))
+        assert dtypes == [np.float64, np.float32]
+
+    def test_peak_fitter_background(self, monkeypatch):
+        estimators = []
+
+        def mockreturn(img, **kwargs):
+            estimators.append(kwargs["background"])
+            return 0, 1, 2, 3, 4, 5, 6, 7
+        monkeypatch.setattr(utils, 'get_peak_parameters', mockreturn)
+
+        pf = PeakFitter(background="histogram", background_smoothing=0.9)
+        for i in range(2):
+            pf(Data(datetime(2018, 8, 28), np.zeros((600, 800), np.uint16)))
+        assert estimators[0] is estimators[1]
+        assert estimators[0].method == "histogram"
+        assert estimators[0].smoothing == 0.9
+
+        with pytest.raises(ValueError):
+            PeakFitter(background="mean")
+        with pytest.raises(ValueError):
+            PeakFitter(process_pool=True, background_smoothing=0.9)
+
+    def test_peak_fitter_track(self, monkeypatch):
+        calls = []
+
+        def mock_get(img, **kwargs):
+            calls.append("get")
+            return 0, 1, 2, 3, 4, 5, 6, 7
+
+        def mock_track(img, p_last, n_sigma, max_drift, max_residual,
+                       improve):
+            calls.append("track")
+            assert improve
+            assert p_last == (0, 1, 2, 3, 4, 5, 6, 7)
+            assert n_sigma == 4
+            assert max_drift == 5
+            assert max_residual == 0.2
+            return 10, 11, 12, 13, 14, 15, 16, 17
+
+        monkeypatch.setattr(utils, 'get_peak_parameters', mock_get)
+        monkeypatch.setattr(utils, 'track_peak_parameters', mock_track)
+
+        pf = PeakFitter(track=True, track_window=4, track_drift=5,
+                        track_residual=0.2)
+        data = Data(datetime(2018, 8, 28), np.random.randn(600, 800))
+        proc_data = pf(data)
+        assert calls == ["get"]
+        assert proc_data.value["mu_x"] == 2
+        assert pf.last_fit == (0, 1, 2, 3, 4, 5, 6, 7)
+
+        data = Data(datetime(2018, 8, 28), np.random.randn(600, 800))
+        proc_data = pf(data)
+        assert calls == ["get", "track"]
+        assert proc_data.value["mu_x"] == 12
+        assert pf.last_fit == (10, 11, 12, 13, 14, 15, 16, 17)
+
+    def test_peak_fitter_track_fallback(self, monkeypatch):
+        calls = []
+
+        def mock_get(img, **kwargs):
+            calls.append("get")
+            return 0, 1, 2, 3, 4, 5, 6, 7
+
+        def mock_track(img, p_last, **kwargs):
+            calls.append("track")
+            raise utils.TrackingError()
+
+        monkeypatch.setattr(utils, 'get_peak_parameters', mock_get)
+        monkeypatch.setattr(utils, 'track_peak_parameters', mock_track)
+
+        pf = PeakFitter(track=True)
+        for i in range(2):
+            data = Data(datetime(2018, 8, 28), np.random.randn(600, 800))
+            proc_data = pf(data)
+            assert proc_data.value["mu_x"] == 2
+        assert calls == ["get", "track", "get"]
+
+    def test_peak_fitter_track_lost(self, monkeypatch):
+        def mock_get(img, **kwargs):
+            raise utils.LargeNoiseError()
+
+        def mock_track(img, p_last, **kwargs):
+            raise utils.TrackingError()
+
+        monkeypatch.setattr(utils, 'get_peak_parameters', mock_get)
+        monkeypatch.setattr(utils, 'track_peak_parameters', mock_track)
+
+        pf = PeakFitter(track=True)
+        pf.last_fit = (0, 1, 2, 3, 4, 5, 6, 7)
+        data = Data(datetime(2018, 8, 28), np.random.randn(600, 800))
+        proc_data = pf(data)
+        assert proc_data.value["beam_on"] is False
+        assert pf.last_fit is None
+
+    @pytest.mark.parametrize('repeat', range(3))
+    def test_peak_fitter_process_pool(self, repeat):
+        utils.np.random.seed(1234*repeat)
+        img, p, cutoff, s_noise = utils.create_test_image()
+
+        pf_local = PeakFitter()
+        pf_pool = PeakFitter(process_pool=True)
+        try:
+            for i in range(2):
+                data = Data(datetime(2018, 8, 28), img.copy())
+                expected = pf_local(data).value
+                data = Data(datetime(2018, 8, 28), img.copy())
+                proc_data = pf_pool(data)
+                assert proc_data.value == expected
+        finally:
+            pf_pool.close()
+
+    def test_peak_fitter_process_pool_no_beam(self):
+        utils.np.random.seed(1234)
+        img, p, cutoff, s_noise = utils.create_test_image(peak=False)
+
+        pf = PeakFitter(process_pool=True)
+        try:
+            proc_data = pf(Data(datetime(2018, 8, 28), img))
+        finally:
+            pf.close()
+        assert proc_data.value["beam_on"] is False
+
+    def test_peak_fitter_broken_pool(self):
+        utils.np.random.seed(1234)
+        img, p, cutoff, s_noise = utils.create_test_image()
+        expected = PeakFitter()(Data(datetime(2018, 8, 28), img.copy())).value
+
+        pf = PeakFitter(process_pool=True)
+        call = pf.call
+        calls = []
+
+        def break_once(func, img, *args, **kwargs):
+            calls.append(func)
+            if len(calls) == 1:
+                # kills a worker, which breaks the pool
+                return call(exit_worker, img)
+            return call(func, img, *args, **kwargs)
+
+        pf.call = break_once
+        try:
+            proc_data = pf(Data(datetime(2018, 8, 28), img.copy()))
+        finally:
+            call.close()
+        assert len(calls) == 2
+        assert proc_data.value == expected
+
+    def test_peak_fitter_broken_pool_retry(self):
+        utils.np.random.seed(1234)
+        img, p, cutoff, s_noise = utils.create_test_image()
+        pf = PeakFitter()
+        pf.call = Mock(side_effect=procs.BrokenProcessPool())
+        proc_data = pf(Data(datetime(2018, 8, 28), img))
+        assert proc_data.failure is None
+        assert proc_data.value["beam_on"] is False
+        assert pf.call.call_count == 2
+
+    def test_shared_image_caller_reuse(self):
+        call = procs.SharedImageCaller()
+        try:
+            img = np.arange(12.).reshape(3, 4)
+            assert call(np.sum, img) == img.sum()
+            shm = call.shm
+            assert call(np.sum, img[:2]) == img[:2].sum()
+            assert call.shm is shm
+            img = np.arange(120.).reshape(10, 12)
+            assert call(np.sum, img) == img.sum()
+            assert call.shm is not shm
+        finally:
+            call.close()
+
+    def test_shared_image_caller_broken_pool(self):
+        call = procs.SharedImageCaller()
+        try:
+            img = np.arange(12.).reshape(3, 4)
+            with pytest.raises(procs.BrokenProcessPool):
+                call(exit_worker, img)
+            assert call(np.sum, img) == img.sum()
+        finally:
+            call.close()
+
+    def test_peak_fitter_binning(self, monkeypatch):
         dtype = None
+        binning = None
 
-        def mockreturn(img):
-                nonlocal dtype
-                dtype = img.dtype
-                return 0, 1, 2, 3, 4, 5, 6, 7
+        def mockreturn(img, **kwargs):
+            nonlocal dtype, binning
+            dtype = img.dtype
+            binning = kwargs["binning"]
+            return 0, 1, 2, 3, 4, 5, 6, 7
         monkeypatch.setattr(utils, 'get_peak_parameters', mockreturn)
 
         data = Data(datetime(2018, 8, 28),
-                    {"frame": np.random.randint(0, 255, (600, 800)),
-                     "quality": 0},
+                    {"frame": np.random.randint(0, 255, (600, 800),
+                                                dtype="u1")},
                     metadata={"id": 1234})
-        pf = PeakFitter("frame")
-        pf(data)
-        assert dtype == np.float64
+        pf = PeakFitter("frame", binning=4)
+        proc_data = pf(data)
+        assert binning == 4
+        assert dtype == np.uint8
+        assert proc_data.value["mu_x"] == 2
 
     def test_peak_fitter_failure(self):
         ex = Exception("An error occured")
@@ -123,16 +368,12 @@ class TestPeakFitter:
 
     @pytest.mark.parametrize('do_log', [True, False])
     def test_peak_fitter_log(self, monkeypatch, do_log, tmpdir):
-        mocksave = Mock()
-        mockplot = Mock()
-        mocksavefig = Mock()
-        monkeypatch.setattr(procs.np, 'save', mocksave)
-        monkeypatch.setattr(procs.utils, 'plot_gauss', mockplot)
-        monkeypatch.setattr(procs.plt, 'savefig', mocksavefig)
+        mockarchiver = Mock()
+        monkeypatch.setattr(procs, 'FrameArchiver', mockarchiver)
 
         params = 0, 1, 2, 3, 4, 5, 6, 7
 
-        def mockreturn(img):
+        def mockreturn(img, **kwargs):
                 return params
         monkeypatch.setattr(utils, 'get_peak_parameters', mockreturn)
 
@@ -202,35 +443,182 @@ class TestPeakFitter:
             assert pf.last_theta == theta
             assert pf.last_cutoff == cutoff
 
-            basename = os.path.join(str(tmpdir), "img_"+time2.isoformat())
+            (directory,), kwargs = mockarchiver.call_args
+            assert directory == str(tmpdir)
+            assert kwargs == {"max_rate": 1, "max_bytes": None,
+                              "render": True, "format": "files",
+                              "chunk_frames": 100}
 
-            assert mocksave.call_count == 1
-            assert mockplot.call_count == 2
-            assert mocksavefig.call_count == 2
-
-            (fname, array), kwargs = mocksave.call_args
-            assert fname == basename
-            assert (array == img2).all()
-            assert not kwargs
-
-            (array, p_fit), kwargs = mockplot.call_args_list[0]
+            submit = pf.archiver.submit
+            assert submit.call_count == 1
+            (timestamp, array, p_fit), kwargs = submit.call_args
+            assert timestamp == time2
             assert (array == img2).all()
             assert p_fit == params2
             assert not kwargs
-
-            (array, p_fit), kwargs = mockplot.call_args_list[1]
-            assert (array == img2).all()
-            assert p_fit == params2
-            assert kwargs == {"zoom": True}
-
-            (fname,), kwargs = mocksavefig.call_args_list[0]
-            assert fname == basename + ".png"
-            assert not kwargs
-
-            (fname,), kwargs = mocksavefig.call_args_list[1]
-            assert fname == basename + "_zoomed.png"
-            assert not kwargs
         else:
-            assert mocksave.call_count == 0
-            assert mockplot.call_count == 0
-            assert mocksavefig.call_count == 0
+            assert mockarchiver.call_count == 0
+            assert pf.archiver is None
+
+
+def dead_pixel_image(shape=(40, 60)):
+    np.random.seed(1234)
+    # a gradient keeps improve_img from replacing the noise
+    img = np.linspace(0, 200, shape[1]) + np.random.randn(*shape)
+    dead = [(0, 0), (5, 7), (5, 8), (20, 30), (39, 59)]
+    for pixel in dead:
+        img[pixel] = 1000
+    return img, dead
+
+
+class TestDeadPixelMap:
+    def test_learn(self):
+        img, dead = dead_pixel_image()
+        dpm = DeadPixelMap(img.shape, learn_frames=3)
+        assert dpm.needs_update()
+        for i in range(3):
+            assert not dpm.ready
+            dpm.update(utils.improve_img(img) != img)
+        assert dpm.ready
+        assert not dpm.needs_update()
+        assert sorted(zip(*np.nonzero(dpm.mask))) == dead
+
+    def test_threshold(self):
+        dpm = DeadPixelMap((10, 10), learn_frames=4, threshold=0.5)
+        replaced = np.zeros((10, 10), bool)
+        replaced[1, 1] = True
+        dpm.update(replaced)
+        replaced[2, 2] = True
+        dpm.update(replaced)
+        replaced[1, 1] = False
+        dpm.update(replaced)
+        replaced[3, 3] = True
+        dpm.update(replaced)
+        assert sorted(zip(*np.nonzero(dpm.mask))) == [(1, 1), (2, 2)]
+
+    def test_correct(self):
+        img, dead = dead_pixel_image()
+        mask = np.zeros(img.shape, bool)
+        mask[tuple(zip(*dead))] = True
+        dpm = DeadPixelMap(img.shape)
+        dpm.set_mask(mask)
+        corrected = dpm.correct(img)
+        assert corrected is not img
+        assert img[5, 7] == 1000
+        assert np.all(corrected < 300)
+        assert np.array_equal(corrected[~mask], img[~mask])
+        # only the good neighbours are used
+        neighbours = [img[4, 6], img[4, 7], img[4, 8], img[5, 6],
+                      img[6, 6], img[6, 7], img[6, 8]]
+        assert corrected[5, 7] == np.median(neighbours)
+        assert corrected[0, 0] == np.median([img[0, 1], img[1, 0],
+                                             img[1, 1]])
+
+    def test_correct_isolated(self):
+        img = np.zeros((5, 5))
+        dpm = DeadPixelMap(img.shape)
+        dpm.set_mask(np.ones(img.shape, bool))
+        assert np.array_equal(dpm.correct(img), img)
+
+    def test_correct_wrong_shape(self):
+        dpm = DeadPixelMap((5, 5))
+        dpm.set_mask(np.zeros((5, 5), bool))
+        with pytest.raises(ValueError):
+            dpm.correct(np.zeros((5, 6)))
+
+    def test_persistence(self, tmpdir):
+        path = str(tmpdir.join("cam_10x10.npz"))
+        dpm = DeadPixelMap((10, 10), path, learn_frames=1)
+        replaced = np.zeros((10, 10), bool)
+        replaced[3, 4] = True
+        dpm.update(replaced)
+        assert os.path.exists(path)
+        loaded = DeadPixelMap((10, 10), path)
+        assert loaded.ready
+        assert np.array_equal(loaded.mask, dpm.mask)
+        assert loaded.created == dpm.created
+
+    def test_persistence_wrong_shape(self, tmpdir):
+        path = str(tmpdir.join("cam.npz"))
+        dpm = DeadPixelMap((10, 10), path)
+        dpm.set_mask(np.zeros((10, 10), bool))
+        dpm.save()
+        assert not DeadPixelMap((10, 11), path).ready
+
+    def test_max_age(self, monkeypatch):
+        dpm = DeadPixelMap((10, 10), learn_frames=2, max_age=60)
+        dpm.set_mask(np.zeros((10, 10), bool), created=time.time() - 100)
+        assert dpm.needs_update()
+        replaced = np.zeros((10, 10), bool)
+        replaced[1, 2] = True
+        dpm.update(replaced)
+        # the old map is used until the new one is complete
+        assert not dpm.mask.any()
+        dpm.update(replaced)
+        assert dpm.mask[1, 2]
+        assert not dpm.needs_update()
+
+
+class TestPeakFitterDeadPixels:
+    def test_init(self, tmpdir):
+        with pytest.raises(ValueError):
+            PeakFitter(dead_pixel_dir=str(tmpdir))
+        with pytest.raises(ValueError):
+            PeakFitter(dead_pixel_dir=str(tmpdir.join("missing")),
+                       camera="LM10")
+
+    def test_dead_pixel_map(self, monkeypatch, tmpdir):
+        calls = []
+
+        def mock_get(img, binning, improve, dtype, buffers, background):
+            calls.append((img.copy(), improve))
+            return 0, 1, 2, 3, 4, 5, 6, 7
+
+        monkeypatch.setattr(utils, 'get_peak_parameters', mock_get)
+        img, dead = dead_pixel_image()
+        pf = PeakFitter(dead_pixel_dir=str(tmpdir),
+                        camera="haspp02ch1:10000/hasylab/p02_lm10/output",
+                        dead_pixel_frames=2)
+        for i in range(3):
+            pf(Data(datetime(2018, 8, 28), img.copy()))
+        assert all(not improve for _, improve in calls)
+        # improve_img while learning, afterwards the dead pixel map
+        expected = utils.improve_img(img)
+        assert np.array_equal(calls[0][0], expected)
+        assert np.all(calls[2][0] < 300)
+        path = tmpdir.join("haspp02ch1_10000_hasylab_p02_lm10_output_"
+                           "40x60.npz")
+        assert path.check()
+
+        # a new instance loads the map
+        pf = PeakFitter(dead_pixel_dir=str(tmpdir),
+                        camera="haspp02ch1:10000/hasylab/p02_lm10/output")
+        pf(Data(datetime(2018, 8, 28), img.copy()))
+        assert not pf.dead_pixel_maps[img.shape].needs_update()
+        assert np.array_equal(calls[3][0], calls[2][0])
+
+    def test_relearn(self, monkeypatch, tmpdir):
+        calls = []
+
+        def mock_get(img, binning, improve, dtype, buffers, background):
+            calls.append(img.copy())
+            return 0, 1, 2, 3, 4, 5, 6, 7
+
+        monkeypatch.setattr(utils, 'get_peak_parameters', mock_get)
+        img, dead = dead_pixel_image()
+        pf = PeakFitter(dead_pixel_dir=str(tmpdir), camera="LM10",
+                        dead_pixel_frames=2)
+        for i in range(2):
+            pf(Data(datetime(2018, 8, 28), img.copy()))
+        dead_pixels = pf.dead_pixel_maps[img.shape]
+        corrected = dead_pixels.correct(img)
+        assert np.array_equal(calls[-1], corrected)
+
+        # the outdated map is used while it is learned again
+        dead_pixels.created -= dead_pixels.max_age + 1
+        pf(Data(datetime(2018, 8, 28), img.copy()))
+        assert dead_pixels.needs_update()
+        assert np.array_equal(calls[-1], corrected)
+        pf(Data(datetime(2018, 8, 28), img.copy()))
+        assert not dead_pixels.needs_update()
+        assert np.array_equal(calls[-1], corrected)
@@ -1,10 +1,15 @@
-from BeamlineStatusLogger.sinks import InfluxDBSink, filter_nones
+from BeamlineStatusLogger import sinks
+from BeamlineStatusLogger.sinks import (
+    InfluxDBSink, BufferedInfluxDBSink, filter_nones)
 from BeamlineStatusLogger.sources import Data
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
 from datetime import datetime
 from pytz import timezone
 import pytest
 import os
+import threading
+import time
 import uuid
 
 
@@ -149,3 +154,340 @@ class TestInfluxDBSink:
         assert len(rows) == 1
         assert rows[0]["time"] == '2018-08-15T17:37:39.524288Z'
         assert rows[0]["error"] == "msg"
+
+
+@pytest.fixture
+def mock_client(mocker):
+    mock = mocker.patch.object(sinks, "InfluxDBClient")
+    mocker.patch.object(sinks, "influxdb_clients", sinks.InfluxDBClientPool())
+    client = mock.return_value
+    client.get_list_database.return_value = [{"name": "test"}]
+    client.write_points.return_value = True
+    return client
+
+
+class TestInfluxDBClientPool:
+    def test_get(self, mocker):
+        mock = mocker.patch.object(
+            sinks, "InfluxDBClient",
+            side_effect=lambda *args, **kwargs: object())
+        pool = sinks.InfluxDBClientPool()
+        client = pool.get("localhost", 8086, "test")
+        assert pool.get("localhost", "8086", "test") is client
+        assert pool.get("localhost", 8086, "other") is not client
+        assert pool.get("localhost", 8086, "test", ssl=True) is not client
+        assert len(pool) == 3
+        mock.assert_any_call("localhost", 8086, database="test")
+        pool.clear()
+        assert pool.get("localhost", 8086, "test") is not client
+
+    def test_shared_by_sinks(self, mock_client):
+        sink1 = InfluxDBSink("test", "dummy")
+        sink2 = InfluxDBSink("test", "other")
+        assert sink1.client is sink2.client
+        assert len(sinks.influxdb_clients) == 1
+
+
+def make_data(i):
+    return Data(datetime(2018, 8, 15, 17, 37, i), i,
+                metadata={"attribute": "postition"})
+
+
+class TestBufferedInfluxDBSink:
+    def test_batches(self, mock_client):
+        sink = BufferedInfluxDBSink("test", "dummy", batch_size=3,
+                                    flush_interval=100)
+        try:
+            for i in range(7):
+                assert sink.write(make_data(i))
+            assert sink.flush(timeout=5)
+        finally:
+            sink.close(timeout=5)
+        batches = [args[0] for args, kwargs
+                   in mock_client.write_points.call_args_list]
+        assert [len(b) for b in batches] == [3, 3, 1]
+        values = [p["fields"]["value"] for b in batches for p in b]
+        assert values == list(range(7))
+        assert batches[0][0]["measurement"] == "dummy"
+        assert batches[0][0]["tags"]["attribute"] == "postition"
+
+    def test_flush_interval(self, mock_client):
+        sink = BufferedInfluxDBSink("test", "dummy", batch_size=100,
+                                    flush_interval=0.1)
+        try:
+            assert sink.write(make_data(0))
+            start = time.time()
+            while (not mock_client.write_points.called
+                   and time.time() - start < 5):
+                time.sleep(0.01)
+            assert mock_client.write_points.call_count == 1
+        finally:
+            sink.close(timeout=5)
+
+    def test_backpressure(self, mock_client):
+        release = threading.Event()
+
+        def slow_write(points):
+            release.wait(5)
+            return True
+        mock_client.write_points.side_effect = slow_write
+
+        sink = BufferedInfluxDBSink("test", "dummy", batch_size=1,
+                                    max_queue=2)
+        try:
+            results = [sink.write(make_data(i)) for i in range(10)]
+            assert not all(results)
+            release.set()
+            assert sink.flush(timeout=5)
+            assert sink.write(make_data(11))
+        finally:
+            release.set()
+            sink.close(timeout=5)
+
+    def test_write_failure(self, mock_client):
+        sink = BufferedInfluxDBSink("test", "dummy", batch_size=1)
+        try:
+            mock_client.write_points.side_effect = ConnectionError()
+            sink.write(make_data(0))
+            assert sink.flush(timeout=5)
+            assert not sink.write(make_data(1))
+            mock_client.write_points.side_effect = None
+            assert sink.flush(timeout=5)
+            assert sink.write(make_data(2))
+        finally:
+            sink.close(timeout=5)
+
+    @pytest.mark.parametrize("value", [None, {"value": None}])
+    def test_write_none(self, mock_client, value):
+        sink = BufferedInfluxDBSink("test", "dummy")
+        try:
+            data = Data(datetime(2018, 8, 15), value)
+            assert not sink.write(data)
+            assert sink.flush(timeout=5)
+        finally:
+            sink.close(timeout=5)
+        (points,), kwargs = mock_client.write_points.call_args
+        assert points[0]["fields"] == {"NoValue": True}
+
+    def test_write_data_failure(self, mock_client):
+        sink = BufferedInfluxDBSink("test", "dummy")
+        try:
+            data = Data(datetime(2018, 8, 15), None, failure=Exception("msg"))
+            assert not sink.write(data)
+        finally:
+            sink.close(timeout=5)
+        (points,), kwargs = mock_client.write_points.call_args
+        assert points[0]["fields"] == {"error": "msg"}
+
+    def test_close(self, mock_client):
+        sink = BufferedInfluxDBSink("test", "dummy")
+        sink.write(make_data(0))
+        sink.close(timeout=5)
+        assert not sink._thread.is_alive()
+        assert mock_client.write_points.call_count == 1
+        assert not sink.flush(timeout=5)
+
+
+class TestLineProtocolSpool:
+    def test_append_claim_release(self, tmpdir):
+        spool = sinks.LineProtocolSpool(str(tmpdir), segment_age=0)
+        spool.append(["a", "b"])
+        spool.append(["c"])
+        path = spool.claim()
+        with open(path) as f:
+            assert f.read().splitlines() == ["a", "b", "c"]
+        assert spool.claim() is None
+        spool.release(path, done=False)
+        path = spool.claim()
+        assert path is not None
+        spool.release(path, done=True)
+        assert spool.claim() is None
+        assert spool.size() == 0
+
+    def test_segments(self, tmpdir):
+        spool = sinks.LineProtocolSpool(str(tmpdir), segment_bytes=10)
+        for i in range(5):
+            spool.append(["line{:02d}".format(i)] * 2)
+        lines = []
+        path = spool.claim()
+        while path:
+            with open(path) as f:
+                lines.extend(f.read().splitlines())
+            spool.release(path, done=True)
+            path = spool.claim()
+        assert lines == sorted(["line{:02d}".format(i) for i in range(5)]*2)
+
+    def test_max_bytes(self, tmpdir):
+        spool = sinks.LineProtocolSpool(str(tmpdir), max_bytes=100,
+                                        segment_bytes=10)
+        for i in range(100):
+            spool.append(["line{:02d}".format(i)])
+        assert spool.size() <= 100
+        spool.close()
+        # the newest lines are kept
+        path = spool.claim()
+        last = None
+        while path:
+            with open(path) as f:
+                last = f.read().splitlines()[-1]
+            spool.release(path, done=True)
+            path = spool.claim()
+        assert last == "line99"
+
+    def test_recover(self, tmpdir, monkeypatch):
+        spool = sinks.LineProtocolSpool(str(tmpdir))
+        spool.append(["a"])
+        monkeypatch.setattr(sinks, "_pid_alive", lambda pid: False)
+        # simulate a restart after a crash
+        spool2 = sinks.LineProtocolSpool(str(tmpdir))
+        path = spool2.claim()
+        with open(path) as f:
+            assert f.read() == "a\n"
+        spool2.release(path, done=False)
+
+    def test_segment_age(self, tmpdir):
+        spool = sinks.LineProtocolSpool(str(tmpdir), segment_age=60)
+        spool.append(["a"])
+        # a young segment is not closed for every replay attempt
+        assert spool.claim() is None
+        assert spool.claim() is None
+        spool.append(["b"])
+        assert len(tmpdir.listdir()) == 1
+        spool.segment_age = 0
+        path = spool.claim()
+        with open(path) as f:
+            assert f.read().splitlines() == ["a", "b"]
+        spool.release(path, done=True)
+
+    def test_reject(self, tmpdir):
+        spool = sinks.LineProtocolSpool(str(tmpdir), segment_age=0)
+        spool.append(["a"])
+        path = spool.reject(spool.claim())
+        assert path.endswith(".rejected")
+        assert spool.claim() is None
+        with open(path) as f:
+            assert f.read() == "a\n"
+
+    def test_max_bytes_rejected(self, tmpdir):
+        spool = sinks.LineProtocolSpool(str(tmpdir), max_bytes=20,
+                                        segment_bytes=1)
+        spool.append(["rejected"])
+        spool.reject(spool.claim())
+        spool.append(["line00"])
+        spool.append(["line01"])
+        # rejected segments are deleted first
+        assert not tmpdir.listdir(fil=lambda p: p.ext == ".rejected")
+        assert len(tmpdir.listdir()) == 2
+
+
+class TestInfluxDBSinkSpool:
+    def test_spool_and_replay(self, mock_client, tmpdir):
+        mock_client.write_points.side_effect = ConnectionError()
+        sink = InfluxDBSink("test", "dummy", spool_dir=str(tmpdir),
+                            spool_segment_age=0, replay_interval=1000,
+                            replay_batch_size=2)
+        try:
+            for i in range(5):
+                assert sink.write(make_data(i))
+            assert sink.replay() == 0
+            assert sink.spool.size() > 0
+
+            mock_client.write_points.side_effect = None
+            assert sink.replay() == 5
+            assert sink.spool.size() == 0
+        finally:
+            sink.close()
+
+        args, kwargs = mock_client.write_points.call_args_list[-1]
+        assert kwargs == {"protocol": "line"}
+        assert len(args[0]) == 1
+        assert args[0][0].startswith("dummy,attribute=postition value=4i ")
+
+    def test_replay_partial_failure(self, mock_client, tmpdir):
+        mock_client.write_points.return_value = False
+        sink = InfluxDBSink("test", "dummy", spool_dir=str(tmpdir),
+                            spool_segment_age=0, replay_interval=1000,
+                            replay_batch_size=2)
+        try:
+            for i in range(5):
+                assert sink.write(make_data(i))
+            mock_client.write_points.return_value = True
+            mock_client.write_points.side_effect = [True, False]
+            assert sink.replay() == 2
+            # the whole segment is written again
+            mock_client.write_points.side_effect = None
+            assert sink.replay() == 5
+        finally:
+            sink.close()
+
+    def test_rejected_points(self, mock_client, tmpdir):
+        mock_client.write_points.side_effect = InfluxDBClientError(
+            "field type conflict", 400)
+        sink = InfluxDBSink("test", "dummy", spool_dir=str(tmpdir),
+                            spool_segment_age=0, replay_interval=1000)
+        try:
+            assert not sink.write(make_data(0))
+            assert sink.spool.size() == 0
+            # server errors are transient
+            mock_client.write_points.side_effect = InfluxDBServerError("down")
+            assert sink.write(make_data(1))
+            mock_client.write_points.side_effect = InfluxDBClientError(
+                "timeout", 503)
+            assert sink.write(make_data(2))
+            assert sink.spool.size() > 0
+        finally:
+            sink.close()
+
+    def test_replay_rejected_segment(self, mock_client, tmpdir):
+        mock_client.write_points.side_effect = ConnectionError()
+        sink = InfluxDBSink("test", "dummy", spool_dir=str(tmpdir),
+                            spool_segment_age=0, replay_interval=1000)
+        try:
+            assert sink.write(make_data(0))
+            sink.spool.close()
+            first = tmpdir.join("test").listdir()[0]
+            os.utime(str(first), (1, 1))
+            assert sink.write(make_data(1))
+            sink.spool.close()
+
+            mock_client.write_points.side_effect = [
+                InfluxDBClientError("field type conflict", 400), True]
+            # the rejected segment does not block the newer one
+            assert sink.replay() == 1
+            mock_client.write_points.side_effect = None
+            assert sink.replay() == 0
+            assert mock_client.write_points.call_count == 4
+            paths = tmpdir.join("test").listdir()
+            assert [path.ext for path in paths] == [".rejected"]
+            assert paths[0].purebasename == first.purebasename
+        finally:
+            sink.close()
+
+    def test_replay_thread(self, mock_client, tmpdir):
+        mock_client.write_points.side_effect = ConnectionError()
+        sink = InfluxDBSink("test", "dummy", spool_dir=str(tmpdir),
+                            spool_segment_age=0, replay_interval=0.05)
+        try:
+            assert sink.write(make_data(0))
+            mock_client.write_points.side_effect = None
+            start = time.time()
+            while sink.spool.size() and time.time() - start < 5:
+                time.sleep(0.01)
+            assert sink.spool.size() == 0
+        finally:
+            sink.close()
+
+    def test_buffered_spool(self, mock_client, tmpdir):
+        mock_client.write_points.side_effect = ConnectionError()
+        sink = BufferedInfluxDBSink("test", "dummy", spool_dir=str(tmpdir),
+                                    spool_segment_age=0,
+                                    replay_interval=1000, batch_size=3)
+        try:
+            for i in range(3):
+                assert sink.write(make_data(i))
+            assert sink.flush(timeout=5)
+            assert sink.write(make_data(3))
+            mock_client.write_points.side_effect = None
+            assert sink.replay() == 3
+        finally:
+            sink.close(timeout=5)
@@ -1,7 +1,15 @@
 from BeamlineStatusLogger import sources
 from BeamlineStatusLogger.sources import (
-    TangoDeviceAttributeSource, TINECameraSource)
+    TangoDeviceAttributeSource, TangoDeviceAttributesSource,
+    TangoEventSource, AsyncTangoDeviceAttributeSource, TINECameraSource,
+    MissingDataException, DeviceProxyPool, LatestOnlySource, Data)
+from BeamlineStatusLogger.logger import Logger, LoggerStats
+from BeamlineStatusLogger.timer import (
+    ArrivalTimer, SynchronizedPeriodicTimer)
 import numpy as np
+import asyncio
+import threading
+import time
 import PyTango as tango
 import datetime
 from pytz import timezone
@@ -76,6 +84,384 @@ class TestTangoDeviceAttributeSource:
         assert data.metadata["attribute"] == attribute_name
 
 
+def connection_error():
+    err = tango.DevError()
+    err.reason = "API_CantConnectToDevice"
+    err.desc = "Failed to connect to device"
+    return tango.DevFailed(err)
+
+
+class TestDeviceProxyPool:
+    @pytest.fixture(autouse=True)
+    def mock_proxy(self, monkeypatch):
+        self.created = []
+
+        def create(name):
+            proxy = MockAttributesDevice(name)
+            self.created.append(proxy)
+            return proxy
+        monkeypatch.setattr(sources.tango, "DeviceProxy", create)
+        monkeypatch.setattr(sources, "device_proxies", DeviceProxyPool())
+
+    def test_get_shared(self):
+        pool = DeviceProxyPool()
+        p1 = pool.get("mock/device/1")
+        p2 = pool.get("Mock/Device/1")
+        p3 = pool.get("mock/device/2")
+        assert p1 is p2
+        assert p1 is not p3
+        assert len(self.created) == 2
+        assert len(pool) == 2
+
+    def test_get_failure(self, monkeypatch):
+        pool = DeviceProxyPool()
+
+        def fail(name):
+            raise connection_error()
+        monkeypatch.setattr(sources.tango, "DeviceProxy", fail)
+        with pytest.raises(tango.DevFailed):
+            pool.get("mock/device/1")
+        assert len(pool) == 0
+
+    def test_get_threads(self):
+        pool = DeviceProxyPool()
+        proxies = []
+        threads = [threading.Thread(
+                       target=lambda: proxies.append(pool.get("a/b/c")))
+                   for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(self.created) == 1
+        assert all(p is self.created[0] for p in proxies)
+
+    def test_reconnect(self):
+        pool = DeviceProxyPool()
+        old = pool.get("mock/device/1")
+        new = pool.reconnect("mock/device/1", old)
+        assert new is not old
+        assert pool.get("mock/device/1") is new
+        # a second source with the broken proxy gets the replacement
+        assert pool.reconnect("mock/device/1", old) is new
+        assert len(self.created) == 2
+
+    def test_sources_share_proxy(self):
+        s1 = TangoDeviceAttributeSource("mock/device/1", "a")
+        s2 = TangoDeviceAttributesSource("mock/device/1", ["a", "b"])
+        assert s1.device is s2.device
+        assert len(self.created) == 1
+
+    def test_source_reconnect(self, monkeypatch):
+        s = TangoDeviceAttributeSource("mock/device/1", "a")
+        old = s.device
+        err = connection_error()
+
+        def mockreturn(attribute_name):
+            raise err
+        monkeypatch.setattr(old, "read_attribute", mockreturn, raising=False)
+        data = s.read()
+        assert data.failure is err
+        assert s.device is not old
+        assert sources.device_proxies.get("mock/device/1") is s.device
+
+    def test_source_no_reconnect(self, monkeypatch):
+        s = TangoDeviceAttributeSource("mock/device/1", "a")
+        old = s.device
+
+        def mockreturn(attribute_name):
+            raise tango.DevFailed()
+        monkeypatch.setattr(old, "read_attribute", mockreturn, raising=False)
+        s.read()
+        assert s.device is old
+
+
+class MockDeviceAttribute:
+    def __init__(self, value, time, quality=tango.AttrQuality.ATTR_VALID,
+                 failed=False):
+        self.value = value
+        self.time = time
+        self.quality = quality
+        self.has_failed = failed
+
+    def get_date(self):
+        return tango.TimeVal.fromtimestamp(self.time)
+
+    def get_err_stack(self):
+        err = tango.DevError()
+        err.reason = "API_AttrNotFound"
+        err.desc = "Attribute not found"
+        return [err]
+
+
+class MockAttributesDevice:
+    def __init__(self, device_name):
+        self.device_name = device_name
+        self.attributes = {}
+        self.calls = []
+
+    def read_attributes(self, attribute_names):
+        self.calls.append(list(attribute_names))
+        return [self.attributes[name] for name in attribute_names]
+
+
+@pytest.fixture
+def mock_device(monkeypatch):
+    device = MockAttributesDevice("mock/device/1")
+    monkeypatch.setattr(sources.tango, "DeviceProxy", lambda name: device)
+    monkeypatch.setattr(sources, "device_proxies", DeviceProxyPool())
+    return device
+
+
+class TestTangoDeviceAttributesSource:
+    def test_init_success(self, mock_device):
+        s = TangoDeviceAttributesSource("mock/device/1", ["a", "b"])
+        assert s.attribute_names == ["a", "b"]
+        assert s.device is mock_device
+        assert s.metadata == {}
+
+    def test_init_string(self, mock_device):
+        s = TangoDeviceAttributesSource("mock/device/1", "a, b,c")
+        assert s.attribute_names == ["a", "b", "c"]
+
+    def test_init_empty(self, mock_device):
+        with pytest.raises(ValueError):
+            TangoDeviceAttributesSource("mock/device/1", [])
+
+    def test_init_metadata_contains_quality(self, mock_device):
+        with pytest.raises(ValueError):
+            TangoDeviceAttributesSource("mock/device/1", ["a", "b"],
+                                        metadata={"quality_b": "bad"})
+
+    def test_read_success(self, mock_device):
+        tz = timezone("Europe/Berlin")
+        mock_device.attributes = {
+            "a": MockDeviceAttribute(1.5, 100),
+            "b": MockDeviceAttribute(
+                np.arange(3), 101, tango.AttrQuality.ATTR_ALARM)
+        }
+        s = TangoDeviceAttributesSource("mock/device/1", ["a", "b"],
+                                        metadata={"device": "dev"}, tz=tz)
+        data = s.read()
+        assert mock_device.calls == [["a", "b"]]
+        assert data.failure is None
+        assert data.timestamp == datetime.datetime.fromtimestamp(101, tz)
+        assert data.value["a"] == 1.5
+        assert np.all(data.value["b"] == np.arange(3))
+        assert data.metadata == {"device": "dev",
+                                 "quality_a": "ATTR_VALID",
+                                 "quality_b": "ATTR_ALARM"}
+        assert data.metadata is not s.metadata
+
+    def test_read_partial_failure(self, mock_device):
+        mock_device.attributes = {
+            "a": MockDeviceAttribute(None, 0, failed=True),
+            "b": MockDeviceAttribute(2, 100)
+        }
+        s = TangoDeviceAttributesSource("mock/device/1", ["a", "b"])
+        data = s.read()
+        assert data.failure is None
+        assert data.value == {"a": None, "b": 2}
+        assert data.metadata["quality_a"] == "ATTR_INVALID"
+        assert data.metadata["quality_b"] == "ATTR_VALID"
+
+    def test_read_all_failed(self, mock_device):
+        mock_device.attributes = {
+            "a": MockDeviceAttribute(None, 0, failed=True),
+        }
+        s = TangoDeviceAttributesSource("mock/device/1", ["a"],
+                                        metadata={"device": "dev"})
+        data = s.read()
+        assert isinstance(data.failure, tango.DevFailed)
+        assert data.failure.args[0].reason == "API_AttrNotFound"
+        assert data.value is None
+        assert data.metadata == {"device": "dev"}
+
+    def test_read_failure(self, mock_device, monkeypatch):
+        s = TangoDeviceAttributesSource("mock/device/1", ["a"])
+        ex = tango.DevFailed()
+
+        def mockreturn(attribute_names):
+            raise ex
+        monkeypatch.setattr(mock_device, "read_attributes", mockreturn)
+        data = s.read()
+        assert data.failure is ex
+        assert data.value is None
+
+    def test_read_tango(self):
+        device_name = "sys/tg_test/1"
+        attribute_names = ["float_scalar", "double_scalar", "float_scala"]
+        s = TangoDeviceAttributesSource(device_name, attribute_names)
+        data = s.read()
+        assert data.failure is None
+        assert data.value["float_scalar"] == 0
+        assert data.value["float_scala"] is None
+        assert data.metadata["quality_float_scala"] == "ATTR_INVALID"
+
+
+class MockEvent:
+    def __init__(self, attr_value=None, errors=None):
+        self.attr_value = attr_value
+        self.errors = errors
+        self.err = errors is not None
+
+
+class MockEventDevice:
+    """Generates Tango events without a device server"""
+    def __init__(self, device_name):
+        self.device_name = device_name
+        self.subscriptions = {}
+        self.next_id = 1
+
+    def subscribe_event(self, attribute_name, event_type, callback):
+        event_id = self.next_id
+        self.next_id += 1
+        self.subscriptions[event_id] = (attribute_name, event_type, callback)
+        return event_id
+
+    def unsubscribe_event(self, event_id):
+        del self.subscriptions[event_id]
+
+    def push(self, value, time, quality=tango.AttrQuality.ATTR_VALID):
+        for _, _, callback in list(self.subscriptions.values()):
+            callback(MockEvent(MockDeviceAttribute(value, time, quality)))
+
+    def push_error(self):
+        errors = MockDeviceAttribute(None, 0).get_err_stack()
+        for _, _, callback in list(self.subscriptions.values()):
+            callback(MockEvent(errors=errors))
+
+
+@pytest.fixture
+def mock_event_device(monkeypatch):
+    device = MockEventDevice("mock/device/1")
+    monkeypatch.setattr(sources.tango, "DeviceProxy", lambda name: device)
+    monkeypatch.setattr(sources, "device_proxies", DeviceProxyPool())
+    return device
+
+
+class MockSink:
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        self.data.append(data)
+        return True
+
+
+class TestTangoEventSource:
+    def test_init_success(self, mock_event_device):
+        s = TangoEventSource("mock/device/1", "a", event_type="periodic")
+        attribute_name, event_type, _ = \
+            mock_event_device.subscriptions[s.event_id]
+        assert attribute_name == "a"
+        assert event_type == tango.EventType.PERIODIC_EVENT
+
+    def test_init_unknown_event_type(self, mock_event_device):
+        with pytest.raises(ValueError):
+            TangoEventSource("mock/device/1", "a", event_type="archive")
+
+    def test_read_buffered(self, mock_event_device):
+        tz = timezone("Europe/Berlin")
+        s = TangoEventSource("mock/device/1", "a", metadata={"b": 1}, tz=tz)
+        mock_event_device.push(1, 100)
+        mock_event_device.push(2, 101, tango.AttrQuality.ATTR_CHANGING)
+        data = s.read()
+        assert data.value == {"a": 1}
+        assert data.timestamp == datetime.datetime.fromtimestamp(100, tz)
+        assert data.metadata == {"b": 1, "quality": "ATTR_VALID"}
+        data = s.read()
+        assert data.value == {"a": 2}
+        assert data.metadata["quality"] == "ATTR_CHANGING"
+
+    def test_read_empty(self, mock_event_device):
+        s = TangoEventSource("mock/device/1", "a")
+        data = s.read()
+        assert isinstance(data.failure, MissingDataException)
+        assert data.value is None
+
+    def test_read_error_event(self, mock_event_device):
+        s = TangoEventSource("mock/device/1", "a")
+        mock_event_device.push_error()
+        data = s.read()
+        assert isinstance(data.failure, tango.DevFailed)
+        assert data.value is None
+
+    def test_buffer_full(self, mock_event_device):
+        s = TangoEventSource("mock/device/1", "a", max_buffer=2)
+        for i in range(3):
+            mock_event_device.push(i, 100 + i)
+        assert s.dropped == 1
+        assert [s.read().value["a"] for i in range(2)] == [1, 2]
+
+    def test_wait(self, mock_event_device):
+        s = TangoEventSource("mock/device/1", "a")
+        assert not s.wait(0.01)
+        threading.Timer(0.05, mock_event_device.push, (1, 100)).start()
+        assert s.wait(5)
+
+    def test_close(self, mock_event_device):
+        s = TangoEventSource("mock/device/1", "a")
+        s.close()
+        assert mock_event_device.subscriptions == {}
+        s.close()
+
+    def test_logger(self, mock_event_device):
+        s = TangoEventSource("mock/device/1", "a")
+        sink = MockSink()
+        logger = Logger(s, [], sink, ArrivalTimer())
+        t = threading.Thread(target=logger.run)
+        t.start()
+        for i in range(5):
+            mock_event_device.push(i, 100 + i)
+        while len(sink.data) < 5:
+            threading.Event().wait(0.01)
+        logger.abort()
+        t.join(5)
+        assert not t.is_alive()
+        assert [data.value["a"] for data in sink.data] == list(range(5))
+
+
+@pytest.fixture(scope="module")
+def tango_loop():
+    # PyTango binds its asyncio executor to the first event loop of a thread
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+class TestAsyncTangoDeviceAttributeSource:
+    def test_init_metadata_contains_quality(self):
+        device_name = "sys/tg_test/1"
+        attribute_name = "float_scalar"
+        with pytest.raises(ValueError):
+            AsyncTangoDeviceAttributeSource(device_name, attribute_name,
+                                            metadata={"quality": "bad"})
+
+    def test_read_success(self, tango_loop):
+        device_name = "sys/tg_test/1"
+        attribute_name = "float_scalar"
+        maxdelta = datetime.timedelta(seconds=5)
+        s = AsyncTangoDeviceAttributeSource(
+            device_name, attribute_name,
+            metadata={"attribute": attribute_name})
+        data = tango_loop.run_until_complete(s.read())
+        now = datetime.datetime.now(timezone("Europe/Berlin"))
+        assert data.timestamp - now < maxdelta
+        assert data.failure is None
+        assert data.value[attribute_name] == 0
+        assert data.metadata is not s.metadata
+        assert data.metadata["attribute"] == attribute_name
+
+    def test_read_wrong_device(self, tango_loop):
+        device_name = "sys/tg_test/2"
+        attribute_name = "float_scalar"
+        s = AsyncTangoDeviceAttributeSource(device_name, attribute_name)
+        data = tango_loop.run_until_complete(s.read())
+        assert isinstance(data.failure, tango.DevFailed)
+        assert data.value is None
+
+
 @pytest.fixture
 def tine_data():
     img = np.arange(15, dtype="u1").reshape(3, 5)
@@ -167,6 +553,95 @@ class TestTINECameraImage:
         with pytest.raises(ValueError):
             sources.tine_image_to_numpy(data)
 
+    def test_get_tine_image_view(self, tine_data):
+        img, reply = tine_data
+        data = reply["data"]
+        data["imageBytes"] = bytearray(data["imageBytes"])
+        result = sources.tine_image_to_numpy(data)
+        assert not result.flags.writeable
+        assert np.shares_memory(result, np.frombuffer(data["imageBytes"],
+                                                      "u1"))
+
+    @pytest.mark.parametrize("byteorder", ["<", ">"])
+    def test_get_tine_image_byteorder(self, byteorder):
+        img = np.arange(0, 60000, 4000, dtype=byteorder + "u2").reshape(3, 5)
+        frameHeader = dict(aoiHeight=-1, sourceHeight=3, aoiWidth=-1,
+                           sourceWidth=5, bytesPerPixel=2)
+        data = dict(frameHeader=frameHeader, imageBytes=img.tobytes())
+        result = sources.tine_image_to_numpy(data, byteorder=byteorder)
+        assert result.dtype.byteorder in (byteorder, "=")
+        np.testing.assert_array_equal(result, img)
+
+    def test_get_tine_image_aoi(self):
+        frame = np.arange(48, dtype="<u2").reshape(6, 8)
+        frameHeader = dict(aoiHeight=3, sourceHeight=6, aoiWidth=4,
+                           sourceWidth=8, xStart=2, yStart=1,
+                           bytesPerPixel=2)
+        data = dict(frameHeader=frameHeader, imageBytes=frame.tobytes())
+        result = sources.tine_image_to_numpy(data)
+        np.testing.assert_array_equal(result, frame[1:4, 2:6])
+
+        # only the AOI is transmitted
+        data["imageBytes"] = frame[1:4, 2:6].tobytes()
+        result = sources.tine_image_to_numpy(data)
+        np.testing.assert_array_equal(result, frame[1:4, 2:6])
+
+    def test_get_tine_image_aoi_invalid(self):
+        frame = np.arange(48, dtype="u1").reshape(6, 8)
+        frameHeader = dict(aoiHeight=3, sourceHeight=6, aoiWidth=4,
+                           sourceWidth=8, xStart=5, yStart=1,
+                           bytesPerPixel=1)
+        data = dict(frameHeader=frameHeader, imageBytes=frame.tobytes())
+        with pytest.raises(ValueError):
+            sources.tine_image_to_numpy(data)
+
+    def test_get_tine_image_padding(self):
+        padded = np.arange(24, dtype="u1").reshape(3, 8)
+        frameHeader = dict(aoiHeight=-1, sourceHeight=3, aoiWidth=-1,
+                           sourceWidth=5, bytesPerPixel=1)
+        data = dict(frameHeader=frameHeader, imageBytes=padded.tobytes())
+        result = sources.tine_image_to_numpy(data)
+        np.testing.assert_array_equal(result, padded[:, :5])
+
+    @pytest.mark.parametrize(("pixel_format", "bits"),
+                             [("mono10p", 10), ("mono12p", 12)])
+    def test_get_tine_image_packed(self, pixel_format, bits):
+        np.random.seed(1234)
+        img = np.random.randint(0, 2**bits, (3, 8)).astype(np.uint16)
+        # pack least significant bits first
+        stream = np.zeros(img.size*bits, np.uint8)
+        for i, pixel in enumerate(img.ravel()):
+            for b in range(bits):
+                stream[i*bits + b] = (pixel >> b) & 1
+        packed = np.packbits(stream, bitorder="little").tobytes()
+        frameHeader = dict(aoiHeight=-1, sourceHeight=3, aoiWidth=-1,
+                           sourceWidth=8, bytesPerPixel=2)
+        data = dict(frameHeader=frameHeader, imageBytes=packed)
+        result = sources.tine_image_to_numpy(data, pixel_format=pixel_format)
+        assert result.dtype == np.uint16
+        assert not result.flags.writeable
+        np.testing.assert_array_equal(result, img)
+
+        data["imageBytes"] = packed[:-1]
+        with pytest.raises(ValueError):
+            sources.tine_image_to_numpy(data, pixel_format=pixel_format)
+
+    def test_get_tine_image_rgb(self):
+        rgb = np.arange(45, dtype="u1").reshape(3, 5, 3)
+        frameHeader = dict(aoiHeight=-1, sourceHeight=3, aoiWidth=-1,
+                           sourceWidth=5, bytesPerPixel=3)
+        data = dict(frameHeader=frameHeader, imageBytes=rgb.tobytes())
+        result = sources.tine_image_to_numpy(data, pixel_format="rgb8")
+        assert result.shape == (3, 5)
+        np.testing.assert_allclose(
+            result, 0.2125*rgb[..., 0] + 0.7154*rgb[..., 1] +
+            0.0721*rgb[..., 2], rtol=1e-6)
+
+    def test_get_tine_image_unknown_format(self, tine_data):
+        img, reply = tine_data
+        with pytest.raises(ValueError):
+            sources.tine_image_to_numpy(reply["data"], pixel_format="yuv")
+
 
 class TestTINECameraSource:
     dummy_address = "/CONTEXT/server/device"
@@ -266,3 +741,205 @@ class TestTINECameraSource:
         assert data.value is None
         assert data.metadata is not s.metadata
         assert data.metadata["device"] == self.dummy_address
+
+
+class ManualTimer:
+    def __init__(self):
+        self.ticks = threading.Semaphore(0)
+        self.event = threading.Event()
+        self.calls = []
+
+    def __call__(self, success=True):
+        self.calls.append(success)
+        while not self.ticks.acquire(timeout=0.01):
+            if self.event.is_set():
+                return False
+        return not self.event.is_set()
+
+    def tick(self, n=1):
+        for i in range(n):
+            self.ticks.release()
+
+    def abort(self):
+        self.event.set()
+
+    def reset(self):
+        self.event.clear()
+
+
+class CountingSource:
+    def __init__(self):
+        self.count = 0
+        self.error = None
+        self.closed = False
+        self.metadata = {"device": "camera"}
+
+    def read(self):
+        if self.error:
+            raise self.error
+        self.count += 1
+        return Data(datetime.datetime.now(), self.count,
+                    metadata=self.metadata.copy())
+
+    def close(self):
+        self.closed = True
+
+
+def wait_for(condition, timeout=5):
+    event = threading.Event()
+    for i in range(int(timeout/0.01)):
+        if condition():
+            return True
+        event.wait(0.01)
+    return False
+
+
+class TestLatestOnlySource:
+    @pytest.fixture
+    def latest(self):
+        timer = ManualTimer()
+        s = LatestOnlySource(CountingSource(), timer, timeout=0.05)
+        yield s, timer
+        s.close()
+
+    def test_read_newest(self, latest):
+        s, timer = latest
+        timer.tick(3)
+        assert wait_for(lambda: s.frames == 3)
+        data = s.read()
+        assert data.value == 3
+        assert data.metadata == {"device": "camera"}
+        assert s.dropped == 2
+        # every data object is returned only once
+        data = s.read()
+        assert isinstance(data.failure, MissingDataException)
+        assert data.metadata == {"device": "camera"}
+
+    def test_read_blocks(self, latest):
+        s, timer = latest
+        s.timeout = 5
+        threading.Timer(0.05, timer.tick).start()
+        assert s.read().value == 1
+        assert s.dropped == 0
+
+    def test_wait(self, latest):
+        s, timer = latest
+        assert not s.wait(0.01)
+        timer.tick()
+        assert s.wait(5)
+        abort = threading.Event()
+        abort.set()
+        s.read()
+        assert not s.wait(5, abort)
+
+    def test_read_exception(self, latest):
+        s, timer = latest
+        s.source.error = OSError("camera offline")
+        timer.tick()
+        assert wait_for(lambda: s.frames == 1)
+        data = s.read()
+        assert data.failure is s.source.error
+        timer.tick()
+        assert wait_for(lambda: len(timer.calls) == 3)
+        assert timer.calls[1:] == [False, False]
+
+    def test_close(self):
+        timer = ManualTimer()
+        s = LatestOnlySource(CountingSource(), timer)
+        s.close()
+        assert not s.thread.is_alive()
+        assert s.source.closed
+
+    def test_logger(self, latest):
+        s, timer = latest
+        sink = MockSink()
+
+        def slow(data):
+            # more frames arrive while processing
+            timer.tick(3)
+            assert wait_for(lambda: s.frames == data.value + 3)
+            return data
+
+        logger = Logger(s, slow, sink, ArrivalTimer())
+        t = threading.Thread(target=logger.run)
+        t.start()
+        timer.tick()
+        assert wait_for(lambda: len(sink.data) == 2)
+        logger.abort()
+        t.join(5)
+        assert not t.is_alive()
+        # only the newest of the frames read during processing is used
+        assert [data.value for data in sink.data[:2]] == [1, 4]
+        assert s.dropped >= 2
+
+    def test_logger_no_backlog(self):
+        # reads every 10 ms and processing takes 50 ms
+        s = LatestOnlySource(CountingSource(), SynchronizedPeriodicTimer(0.01))
+        sink = MockSink()
+        lags = []
+
+        def slow(data):
+            lags.append(s.frames - data.value)
+            time.sleep(0.05)
+            return data
+
+        logger = Logger(s, slow, sink, ArrivalTimer())
+        t = threading.Thread(target=logger.run)
+        t.start()
+        try:
+            assert wait_for(lambda: len(sink.data) >= 8)
+        finally:
+            logger.abort()
+            t.join(5)
+            s.close()
+        assert not t.is_alive()
+        # every cycle starts with the newest frame instead of lagging more
+        # and more behind
+        assert max(lags) <= 1
+        assert s.dropped >= len(sink.data)
+        values = [data.value for data in sink.data]
+        assert values == sorted(set(values))
+
+    def test_feedback(self, latest):
+        s, timer = latest
+        assert s.period is None
+        s.feedback(False)
+        timer.tick()
+        assert wait_for(lambda: len(timer.calls) == 2)
+        s.feedback(True)
+        timer.tick()
+        assert wait_for(lambda: len(timer.calls) == 3)
+        # the reads count as failed while the sink fails
+        assert timer.calls == [True, False, True]
+
+    def test_logger_stats(self):
+        s = LatestOnlySource(CountingSource(), SynchronizedPeriodicTimer(0.01))
+        sink = MockSink()
+        stats_sink = MockSink()
+
+        def slow(data):
+            time.sleep(0.03)
+            return data
+
+        logger = Logger(s, slow, sink, ArrivalTimer(),
+                        stats=LoggerStats(stats_sink, interval=3600))
+        assert logger.timer.period == 0.01
+        t = threading.Thread(target=logger.run)
+        t.start()
+        try:
+            assert wait_for(lambda: len(sink.data) >= 3)
+        finally:
+            logger.abort()
+            t.join(5)
+            s.close()
+        # the processing is slower than the reads
+        value = stats_sink.data[0].value
+        assert value["overruns"] == value["cycles"] >= 3
+        assert value["source_dropped"] > 0
+
+    def test_bind(self):
+        timer = ManualTimer()
+        timer.bind = lambda source: setattr(timer, "source", source)
+        s = LatestOnlySource(CountingSource(), timer)
+        assert timer.source is s.source
+        s.close()
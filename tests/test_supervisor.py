@@ -0,0 +1,174 @@
+from BeamlineStatusLogger.supervisor import Supervisor
+import asyncio
+import json
+import threading
+import time
+import pytest
+
+
+class BlockingLogger:
+    def __init__(self):
+        self.event = threading.Event()
+        self.closed = False
+
+    def run(self):
+        self.event.wait()
+
+    def abort(self):
+        self.event.set()
+
+    def close(self):
+        self.closed = True
+
+
+class FailingLogger(BlockingLogger):
+    def run(self):
+        raise RuntimeError("camera gone")
+
+
+class AsyncBlockingLogger(BlockingLogger):
+    async def run(self):
+        while not self.event.is_set():
+            await asyncio.sleep(0.01)
+
+
+class Factory:
+    def __init__(self, *loggers):
+        # the last logger is repeated for further calls
+        self.loggers = list(loggers)
+        self.created = []
+
+    def __call__(self):
+        cls = self.loggers.pop(0) if len(self.loggers) > 1 else self.loggers[0]
+        if isinstance(cls, Exception):
+            raise cls
+        logger = cls()
+        self.created.append(logger)
+        return logger
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+class TestSupervisor:
+    def test_init(self):
+        with pytest.raises(ValueError):
+            Supervisor({}, jitter=2)
+
+    def test_delay(self):
+        supervisor = Supervisor({}, backoff=1, max_backoff=5, jitter=0.5)
+        for failures, delay in [(1, 1), (2, 2), (3, 4), (4, 5), (10, 5)]:
+            assert delay/2 <= supervisor.delay(failures) <= delay
+        supervisor.jitter = 0
+        assert supervisor.delay(3) == 4
+
+    def test_restart_failed_logger(self):
+        good = Factory(BlockingLogger)
+        bad = Factory(FailingLogger, FailingLogger, BlockingLogger)
+        supervisor = Supervisor({"good": good, "bad": bad}, backoff=0.01,
+                                jitter=0)
+        supervisor.start()
+        wait_for(lambda: supervisor.health()["bad"]["restarts"] == 2 and
+                 supervisor.health()["bad"]["state"] == "running")
+        health = supervisor.health()
+        assert health["bad"]["failures"] == 2
+        assert "camera gone" in health["bad"]["last_error"]
+        assert health["good"]["state"] == "running"
+        assert health["good"]["restarts"] == 0
+        # the other logger was never interrupted
+        assert len(good.created) == 1
+        assert all(logger.closed for logger in bad.created[:2])
+
+        supervisor.stop()
+        supervisor.join()
+        health = supervisor.health()
+        assert health["good"]["state"] == "stopped"
+        assert health["bad"]["state"] == "stopped"
+        assert good.created[0].closed
+        assert bad.created[-1].closed
+
+    def test_factory_failure(self):
+        factory = Factory(OSError("device not exported"), BlockingLogger)
+        supervisor = Supervisor({"camera": factory}, backoff=0.01)
+        supervisor.start()
+        wait_for(lambda: supervisor.health()["camera"]["state"] == "running")
+        assert supervisor.health()["camera"]["restarts"] == 1
+        supervisor.stop()
+        supervisor.join()
+
+    def test_permanent_error(self):
+        factory = Factory(ValueError("invalid config"))
+        supervisor = Supervisor({"camera": factory}, backoff=0.01,
+                                permanent_errors=(ValueError,))
+        assert not supervisor.run()
+        health = supervisor.health()["camera"]
+        assert health["state"] == "failed"
+        assert health["restarts"] == 0
+
+    def test_stop_during_backoff(self):
+        supervisor = Supervisor({"bad": Factory(FailingLogger)}, backoff=60)
+        supervisor.start()
+        wait_for(lambda: supervisor.health()["bad"]["state"] == "backoff")
+        t0 = time.monotonic()
+        supervisor.stop()
+        supervisor.join()
+        assert time.monotonic() - t0 < 1
+        assert supervisor.health()["bad"]["state"] == "stopped"
+
+    def test_async_loggers(self):
+        factories = {"a": Factory(AsyncBlockingLogger),
+                     "b": Factory(FailingLogger, AsyncBlockingLogger)}
+        supervisor = Supervisor(factories, backoff=0.01)
+        supervisor.start()
+        wait_for(lambda: supervisor.health()["b"]["restarts"] == 1 and
+                 all(health["state"] == "running"
+                     for health in supervisor.health().values()))
+        loop = supervisor._loop
+        supervisor.stop()
+        supervisor.join()
+        assert loop.is_closed()
+        assert all(factory.created[-1].closed
+                   for factory in factories.values())
+
+    def test_add_remove(self):
+        first = Factory(BlockingLogger)
+        supervisor = Supervisor({"first": first})
+        supervisor.add("second", Factory(BlockingLogger))
+        with pytest.raises(ValueError):
+            supervisor.add("first", Factory(BlockingLogger))
+        supervisor.start()
+        wait_for(lambda: all(health["state"] == "running"
+                             for health in supervisor.health().values()))
+
+        third = Factory(BlockingLogger)
+        supervisor.add("third", third)
+        wait_for(lambda: supervisor.health()["third"]["state"] == "running")
+
+        supervisor.remove("second")
+        assert set(supervisor.health()) == {"first", "third"}
+        # the others keep running
+        assert not first.created[0].event.is_set()
+        assert not third.created[0].event.is_set()
+
+        supervisor.stop()
+        supervisor.join()
+        assert first.created[0].closed
+        assert third.created[0].closed
+
+    def test_health_file(self, tmpdir):
+        path = str(tmpdir.join("health.json"))
+        supervisor = Supervisor({"camera": Factory(BlockingLogger)},
+                                health_file=path)
+        supervisor.start()
+        wait_for(lambda: supervisor.health()["camera"]["state"] == "running")
+        with open(path) as f:
+            assert json.load(f)["camera"]["state"] == "running"
+        supervisor.stop()
+        supervisor.join()
+        with open(path) as f:
+            assert json.load(f) == supervisor.health()
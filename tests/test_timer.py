@@ -1,7 +1,11 @@
 from BeamlineStatusLogger.timer import SynchronizedPeriodicTimer
 from BeamlineStatusLogger.timer import PeriodicTimer
+from BeamlineStatusLogger.timer import AsyncSynchronizedPeriodicTimer
+from BeamlineStatusLogger.timer import ArrivalTimer
 import BeamlineStatusLogger.timer as timer
+import asyncio
 import random
+import threading
 import pytest
 from pytest import approx
 
@@ -151,6 +155,73 @@ class TestSynchronizedPeriodicTimer:
             assert mockEvent.arg == arg
 
 
+class TestAsyncSynchronizedPeriodicTimer:
+    def test_timer(self, mockTime, monkeypatch):
+        t = AsyncSynchronizedPeriodicTimer(5)
+        delays = []
+
+        async def wait_for(aw, timeout):
+            aw.close()
+            delays.append(timeout)
+            raise asyncio.TimeoutError
+
+        async def run():
+            for time in [100, 100.1, 104.9, 105]:
+                mockTime.time = time
+                assert await t()
+
+        monkeypatch.setattr(timer.asyncio, "wait_for", wait_for)
+        asyncio.run(run())
+        assert delays == approx([5, 4.9, 0.1, 5])
+
+    def test_timer_failure(self, mockTime, monkeypatch):
+        t = AsyncSynchronizedPeriodicTimer(5, p_max=50, fail_tol=0)
+        delays = []
+
+        async def wait_for(aw, timeout):
+            aw.close()
+            delays.append(timeout)
+            raise asyncio.TimeoutError
+
+        async def run():
+            for success, time in [(False, 100), (False, 110), (True, 130)]:
+                mockTime.time = time
+                assert await t(success)
+
+        monkeypatch.setattr(timer.asyncio, "wait_for", wait_for)
+        asyncio.run(run())
+        assert delays == approx([10, 20, 5])
+
+    def test_timer_abort(self):
+        t = AsyncSynchronizedPeriodicTimer(60)
+
+        async def run():
+            assert await t()
+
+        async def abort_and_run():
+            loop = asyncio.get_running_loop()
+            task = loop.create_task(run())
+            await asyncio.sleep(0.1)
+            # abort from another thread while the timer sleeps
+            threading.Thread(target=t.abort).start()
+            with pytest.raises(AssertionError):
+                await asyncio.wait_for(task, 5)
+            assert not await t()
+
+        asyncio.run(abort_and_run())
+
+    def test_timer_reset(self):
+        t = AsyncSynchronizedPeriodicTimer(0.05)
+
+        async def run():
+            t.abort()
+            assert not await t()
+            t.reset()
+            assert await t()
+
+        asyncio.run(run())
+
+
 class TestPeriodicTimer:
     def test_init(self, mockTime):
         mt = mockTime
@@ -160,3 +231,83 @@ class TestPeriodicTimer:
         assert t.offset == 3
         assert t.p_min == t.period
         assert t.p_max >= t.period
+
+
+class MockEventSource:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.timeouts = []
+
+    def push(self):
+        with self.condition:
+            self.pending += 1
+            self.condition.notify_all()
+
+    def wait(self, timeout=None, abort=None):
+        self.timeouts.append(timeout)
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.pending or abort.is_set(), timeout)
+
+    def interrupt(self):
+        with self.condition:
+            self.condition.notify_all()
+
+
+class BackgroundSource(MockEventSource):
+    # a source read in the background with a period of 5 s
+    period = 5
+
+    def __init__(self):
+        super().__init__()
+        self.successes = []
+
+    def feedback(self, success):
+        self.successes.append(success)
+
+
+class TestArrivalTimer:
+    def test_bind_no_wait(self):
+        t = ArrivalTimer()
+        with pytest.raises(TypeError):
+            t.bind(object())
+
+    def test_unbound(self):
+        t = ArrivalTimer()
+        with pytest.raises(RuntimeError):
+            t()
+
+    def test_timer(self):
+        source = MockEventSource()
+        t = ArrivalTimer(timeout=3)
+        t.bind(source)
+        source.push()
+        assert t()
+        assert t(False)
+        assert source.timeouts == [3, 3]
+
+    def test_feedback(self):
+        source = MockEventSource()
+        t = ArrivalTimer(timeout=0.01)
+        t.bind(source)
+        assert t.period is None
+        # sources without feedback ignore the success
+        assert t(False)
+
+        source = BackgroundSource()
+        t.bind(source)
+        t(False)
+        t(True)
+        assert source.successes == [False, True]
+        assert t.period == 5
+
+    def test_timer_abort(self):
+        source = MockEventSource()
+        t = ArrivalTimer()
+        t.bind(source)
+        threading.Timer(0.05, t.abort).start()
+        assert not t()
+        t.reset()
+        source.push()
+        assert t()
@@ -4,6 +4,8 @@ import pytest
 from pytest import approx
 from glob import glob
 import numpy as np
+import tracemalloc
+from scipy.signal import convolve2d
 
 
 def eccentricity(sx, sy):
@@ -50,7 +52,9 @@ class TestUtils:
 
         img, p, cutoff, s_noise = utils.create_test_image(peak=False)
 
-        with pytest.raises(utils.LargeNoiseError):
+        # usually a LargeNoiseError, but some noise only frames are close to
+        # the threshold and are rejected as having too many regions instead
+        with pytest.raises(utils.FittingError):
             utils.get_peak_parameters(img)
 
     @pytest.mark.parametrize('file, params', [
@@ -136,3 +140,407 @@ class TestUtils:
 
         with pytest.raises((utils.LargeNoiseError, utils.SmallRegionError)):
             utils.get_peak_parameters(img)
+
+    @pytest.mark.parametrize('repeat', range(5))
+    def test_gauss2d_cut_jacobian(self, repeat):
+        utils.np.random.seed(1234*repeat)
+        h, a, x0, y0, sx, sy, theta = utils.random_gauss_params()
+        p = np.array([h, a, x0, y0, sx, sy, theta])
+        cutoff = h + 0.8*a
+        y, x = np.indices((600, 800), dtype=np.float64)
+
+        res, jac = utils.gauss2d_cut_jacobian(x, y, *p, cutoff)
+        np.testing.assert_allclose(
+            res, utils.gauss2d_cut(x, y, *p, cutoff))
+        assert (jac[res >= cutoff] == 0).all()
+
+        # compare with central differences away from the cutoff
+        for i in range(len(p)):
+            dp = np.zeros_like(p)
+            dp[i] = 1e-6*max(abs(p[i]), 1)
+            num = (utils.gauss2d(x, y, *(p + dp)) -
+                   utils.gauss2d(x, y, *(p - dp)))/(2*dp[i])
+            inner = res < cutoff - 1e-3*a
+            np.testing.assert_allclose(jac[inner, i], num[inner],
+                                       rtol=1e-4, atol=1e-6*a)
+
+    @pytest.mark.parametrize('repeat', range(5))
+    def test_fit_gauss2d_cut_stable_analytic(self, repeat):
+        utils.np.random.seed(1234*repeat)
+        h, a, x0, y0, sx, sy, theta = utils.random_gauss_params()
+        cutoff = h + 0.8*a
+        img = np.fromfunction(
+            lambda x, y: utils.gauss2d_cut(y, x, h, a, x0, y0, sx, sy,
+                                           theta, cutoff), (600, 800))
+        img = img[int(y0)-50:int(y0)+50, int(x0)-50:int(x0)+50]
+        p0 = (0, 2*cutoff, 50, 50, 8, 8, 0.5)
+
+        p_analytic = utils.fit_gauss2d_cut_stable(img, *p0, cutoff)
+        p_numeric = utils.fit_gauss2d_cut_stable(img, *p0, cutoff,
+                                                 analytic=False)
+        assert p_analytic == approx(p_numeric, rel=1e-3, abs=1e-3)
+
+    @staticmethod
+    def create_strong_test_image():
+        h, a, x0, y0, sx, sy, theta, img_gauss, cutoff, s_noise = [0]*10
+        while (cutoff-h) <= 4*s_noise or eccentricity(sx, sy) > 0.95:
+            img_gauss, p, cutoff, s_noise = utils.create_test_image()
+            h, a, x0, y0, sx, sy, theta = p
+        return img_gauss
+
+    @pytest.mark.parametrize('repeat', range(10))
+    def test_track_peak_parameters(self, repeat):
+        utils.np.random.seed(1234*repeat)
+        img = self.create_strong_test_image()
+
+        p_full = utils.get_peak_parameters(img)
+        h, a, x0, y0, sx, sy, theta, cutoff = p_full
+        p_last = h, a, x0 + 2, y0 - 2, 1.1*sx, 0.9*sy, theta, cutoff
+
+        p_track = utils.track_peak_parameters(img, p_last)
+        h_t, a_t, x0_t, y0_t, sx_t, sy_t, theta_t, cutoff_t = p_track
+
+        assert x0_t == approx(x0, abs=0.1)
+        assert y0_t == approx(y0, abs=0.1)
+        assert sx_t == approx(sx, rel=0.05)
+        assert sy_t == approx(sy, rel=0.05)
+
+    @pytest.mark.parametrize('repeat', range(5))
+    def test_track_peak_parameters_drift(self, repeat):
+        utils.np.random.seed(1234*repeat)
+        img = self.create_strong_test_image()
+
+        h, a, x0, y0, sx, sy, theta, cutoff = utils.get_peak_parameters(img)
+        p_last = h, a, x0 + 15, y0, sx, sy, theta, cutoff
+
+        with pytest.raises(utils.TrackingError):
+            utils.track_peak_parameters(img, p_last, n_sigma=10,
+                                        max_drift=10)
+
+    @pytest.mark.parametrize('repeat', range(5))
+    def test_track_peak_parameters_no_peak(self, repeat):
+        utils.np.random.seed(1234*repeat)
+        img, p, cutoff, s_noise = utils.create_test_image(peak=False)
+        p_last = (*p, cutoff)
+
+        with pytest.raises(utils.FittingError):
+            utils.track_peak_parameters(img, p_last)
+
+    @staticmethod
+    def noise_threshold_image(a, d=0):
+        # a noise-free peak on a background of 10, optionally with a
+        # checkerboard of amplitude d that no Gaussian can fit
+        y, x = np.indices((100, 100))
+        img = utils.gauss2d(x, y, 10, a, 50, 50, 4, 5, 0.3)
+        img[50, 50] = 10 + a
+        return img + d*np.where((x + y) % 2, -1, 1)
+
+    def test_track_peak_parameters_noise_thresholds(self, monkeypatch):
+        sigma = 2
+        monkeypatch.setattr(utils, "estimate_noise", lambda *a, **k: sigma)
+
+        def track(a, d=0, max_residual=None):
+            p_last = (10, a, 51, 49, 4.2, 4.8, 0.3, 10 + a)
+            return utils.track_peak_parameters(
+                self.noise_threshold_image(a, d), p_last, improve=False,
+                max_residual=max_residual)
+
+        # peaks lower than 6 sigma are rejected
+        with pytest.raises(utils.TrackingError, match="noise"):
+            track(0.95*6*sigma)
+        assert track(1.05*6*sigma)[2] == approx(50)
+
+        # the residual excess is sqrt(d**2 - sigma**2), i.e., 1.5 for
+        # d = 2.5 and 2.87 for d = 3.5, relative to a peak of about 32.5
+        track(30, d=2.5, max_residual=0.05)
+        with pytest.raises(utils.TrackingError, match="residual"):
+            track(30, d=2.5, max_residual=0.04)
+        with pytest.raises(utils.TrackingError, match="residual"):
+            track(30, d=3.5, max_residual=0.08)
+        track(30, d=3.5, max_residual=0.09)
+
+    @pytest.mark.parametrize('sigma', [0.5, 2])
+    def test_noise_threshold_consistent(self, monkeypatch, sigma):
+        # the full search and tracking reject the same peaks
+        monkeypatch.setattr(utils, "estimate_noise", lambda *a, **k: sigma)
+        for a, accepted in [(0.95*6*sigma, False), (1.05*6*sigma, True)]:
+            img = self.noise_threshold_image(a)
+            p_last = (10, a, 51, 49, 4.2, 4.8, 0.3, 10 + a)
+            if accepted:
+                for p in [utils.get_peak_parameters(img, improve=False),
+                          utils.track_peak_parameters(img, p_last,
+                                                      improve=False)]:
+                    assert (p[2], p[3]) == approx((50, 50), abs=0.1)
+            else:
+                with pytest.raises(utils.LargeNoiseError):
+                    utils.get_peak_parameters(img, improve=False)
+                with pytest.raises(utils.TrackingError, match="noise"):
+                    utils.track_peak_parameters(img, p_last, improve=False)
+
+    def test_bin_image(self):
+        img = np.arange(7*9, dtype="u2").reshape(7, 9)
+        binned = utils.bin_image(img, 2)
+        assert binned.shape == (3, 4)
+        assert binned[0, 0] == np.mean(img[:2, :2])
+        assert binned[2, 3] == np.mean(img[4:6, 6:8])
+
+    @pytest.mark.parametrize('dtype', [np.float64, np.float32])
+    @pytest.mark.parametrize('repeat', range(10))
+    def test_improve_img_fast(self, repeat, dtype):
+        utils.np.random.seed(1234*repeat)
+        img, p, cutoff, s_noise = utils.create_test_image(peak=repeat > 2)
+        img = img.astype(dtype)
+
+        expected = utils.improve_img(img, method="median")
+        img_fast = utils.improve_img(img)
+        assert img_fast.dtype == img.dtype
+        assert np.array_equal(img_fast, expected)
+
+    @pytest.mark.parametrize('file', glob("tests/images/*/*.png"))
+    def test_improve_img_fast_images(self, file):
+        img = imageio.imread(file, as_gray=True)
+        expected = utils.improve_img(img, method="median")
+        assert np.array_equal(utils.improve_img(img), expected)
+
+    def test_improve_img_fast_uint(self):
+        utils.np.random.seed(1234)
+        img, p, cutoff, s_noise = utils.create_test_image()
+        img = np.clip(2*img, 0, 255).astype(np.uint8)
+        expected = utils.improve_img(img.astype(np.float64), method="median")
+        assert np.array_equal(utils.improve_img(img), expected)
+
+    def test_improve_img_fast_dead_pixel(self):
+        img = np.full((20, 30), 3.0)
+        img[0, 0] = 100
+        img[10, 10] = -100
+        img[5:10, 20:25] = 50
+        img_fast = utils.improve_img(img)
+        assert img_fast[0, 0] == 3
+        assert img_fast[10, 10] == 3
+        # only the corners of extended regions are affected
+        assert np.all(img_fast[6:9, 20:25] == 50)
+        assert np.array_equal(img_fast, utils.improve_img(img, "median"))
+        assert img[0, 0] == 100
+
+    def test_improve_img_unknown_method(self):
+        with pytest.raises(ValueError):
+            utils.improve_img(np.zeros((10, 10)), method="mean")
+
+    @pytest.mark.parametrize('dtype', [np.float64, np.float32, np.uint8])
+    @pytest.mark.parametrize('chunk_rows', [1, 7, 256])
+    def test_estimate_noise(self, dtype, chunk_rows):
+        np.random.seed(1234)
+        img = (100*np.random.rand(53, 41)).astype(dtype)
+
+        M = [[1, -2, 1],
+             [-2, 4, -2],
+             [1, -2, 1]]
+        expected = np.sum(np.abs(convolve2d(img.astype(np.float64), M,
+                                            mode="valid")))
+        expected *= np.sqrt(0.5*np.pi)/(6*39*51)
+
+        sigma = utils.estimate_noise(img, chunk_rows=chunk_rows)
+        assert sigma == approx(expected, rel=1e-5)
+
+    def test_estimate_noise_gaussian(self):
+        np.random.seed(1234)
+        img = 100 + 2*np.random.randn(600, 800)
+        assert utils.estimate_noise(img) == approx(2, rel=0.01)
+
+    def test_estimate_noise_small(self):
+        with pytest.raises(ValueError):
+            utils.estimate_noise(np.zeros((2, 10)))
+
+    @pytest.mark.parametrize('binning', [2, 4])
+    @pytest.mark.parametrize('repeat', range(10))
+    def test_get_peak_parameters_binning(self, repeat, binning):
+        utils.np.random.seed(1234*repeat)
+
+        # ensure strong enough signal without large eccentricity
+        h, a, x0, y0, sx, sy, theta, img_gauss, cutoff, s_noise = [0]*10
+        while (cutoff-h) <= 4*s_noise or eccentricity(sx, sy) > 0.95:
+            img_gauss, p, cutoff, s_noise = utils.create_test_image()
+            h, a, x0, y0, sx, sy, theta = p
+
+        p_full = utils.get_peak_parameters(img_gauss)
+        p_fit = utils.get_peak_parameters(img_gauss, binning=binning)
+        h_f, a_f, x0_f, y0_f, sx_f, sy_f, theta_f, cutoff_f = p_fit
+
+        assert x0_f == approx(x0, rel=1e-3)
+        assert y0_f == approx(y0, rel=1e-3)
+        assert sx_f == approx(sx, rel=0.1)
+        assert sy_f == approx(sy, rel=0.1)
+        assert p_fit[2:4] == approx(p_full[2:4], abs=0.1)
+        assert p_fit[4:6] == approx(p_full[4:6], rel=1e-2)
+
+    @pytest.mark.parametrize('dtype', [np.float32, np.float64])
+    def test_bin_image_dtype(self, dtype):
+        img = np.arange(24, dtype=np.uint16).reshape(4, 6)
+        binned = utils.bin_image(img, 2, dtype=dtype)
+        assert binned.dtype == dtype
+        assert binned == approx(utils.bin_image(img, 2))
+
+    @pytest.mark.parametrize('binning', [1, 2])
+    @pytest.mark.parametrize('file', glob("tests/images/beam/*.npy"))
+    def test_get_peak_parameters_dtype(self, file, binning):
+        img = np.load(file)
+
+        p_single = utils.get_peak_parameters(img, binning=binning)
+        p_double = utils.get_peak_parameters(img, binning=binning,
+                                             dtype=np.float64)
+        assert all(isinstance(p, float) for p in p_single)
+        assert p_single[2:4] == approx(p_double[2:4], abs=1e-2)
+        assert p_single[4:6] == approx(p_double[4:6], rel=1e-3)
+
+    @pytest.mark.parametrize('repeat', range(10))
+    def test_get_peak_parameters_binning_no_peak(self, repeat):
+        utils.np.random.seed(1234*repeat)
+
+        img, p, cutoff, s_noise = utils.create_test_image(peak=False)
+
+        with pytest.raises(utils.FittingError):
+            utils.get_peak_parameters(img, binning=4)
+
+    @pytest.mark.parametrize('file', glob("tests/images/beam/*.npy"))
+    def test_get_peak_parameters_binning_beam_raw(self, file):
+        img = np.load(file)
+
+        p_fit = utils.get_peak_parameters(img, binning=2)
+        p_full = utils.get_peak_parameters(img)
+        assert p_fit[2:4] == approx(p_full[2:4], abs=0.5)
+
+    @pytest.mark.parametrize('file', glob("tests/images/beam/*.npy"))
+    def test_get_peak_parameters_not_improved(self, file):
+        img = np.load(file)
+        original = img.copy()
+
+        p_fit = utils.get_peak_parameters(utils.improve_img(img),
+                                          improve=False)
+        p_full = utils.get_peak_parameters(img)
+        assert np.array_equal(img, original)
+        assert p_fit == approx(p_full)
+
+    def test_work_buffers(self):
+        buffers = utils.WorkBuffers()
+        a = buffers.get("a", (10, 20), np.float32)
+        assert a.shape == (10, 20) and a.dtype == np.float32
+        assert buffers.get("a", (10, 20), "float32") is a
+        assert buffers.get("b", (10, 20), np.float32) is not a
+        assert buffers.nbytes == 2*a.nbytes
+        b = buffers.get("a", (10, 21), np.float32)
+        assert b is not a
+        assert buffers.get("a", (10, 21), np.float64) is not b
+
+    @pytest.mark.parametrize('dtype', [np.float64, np.float32, np.uint16])
+    @pytest.mark.parametrize('repeat', range(5))
+    def test_improve_img_buffers(self, repeat, dtype):
+        utils.np.random.seed(1234*repeat)
+        img, p, cutoff, s_noise = utils.create_test_image(n_dead=100)
+        img = np.abs(img).astype(dtype)
+
+        buffers = utils.WorkBuffers()
+        for i in range(2):
+            improved = utils.improve_img(img, buffers=buffers)
+            assert np.array_equal(improved, utils.improve_img(img))
+
+    @pytest.mark.parametrize('file', glob("tests/images/*/*.npy"))
+    def test_find_roi_buffers(self, file):
+        img = np.load(file).astype(np.float64)
+        img -= np.median(img)
+        thresh = utils.find_threshold(img)
+
+        try:
+            expected = utils.find_roi(img, thresh)
+        except utils.FittingError as err:
+            with pytest.raises(type(err)):
+                utils.find_roi(img, thresh, buffers=utils.WorkBuffers())
+        else:
+            roi = utils.find_roi(img, thresh, buffers=utils.WorkBuffers())
+            assert roi.bbox == expected.bbox
+            assert roi.centroid == approx(expected.centroid)
+
+    @pytest.mark.parametrize('binning', [1, 2])
+    @pytest.mark.parametrize('file', glob("tests/images/beam/*.npy"))
+    def test_get_peak_parameters_buffers(self, file, binning):
+        img = np.load(file)
+
+        buffers = utils.WorkBuffers()
+        expected = utils.get_peak_parameters(img, binning=binning)
+        for i in range(2):
+            p_fit = utils.get_peak_parameters(img, binning=binning,
+                                              buffers=buffers)
+            assert p_fit == expected
+
+    def test_get_peak_parameters_allocations(self):
+        utils.np.random.seed(1234)
+        img, p, cutoff, s_noise = utils.create_test_image(
+            shape=(1200, 1600), s_noise=0.5, n_dead=100)
+        img = np.round(img).clip(0).astype(np.uint16)
+        buffers = utils.WorkBuffers()
+        # the first call allocates the buffers
+        utils.get_peak_parameters(img, buffers=buffers)
+        nbytes = buffers.nbytes
+
+        tracemalloc.start()
+        try:
+            utils.get_peak_parameters(img, buffers=buffers)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert buffers.nbytes == nbytes
+        # only the region of interest and small arrays are allocated, i.e.,
+        # much less than one float32 frame
+        assert peak < img.size
+
+    @pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+    @pytest.mark.parametrize('shape', [(20, 30), (21, 30)])
+    def test_estimate_background_histogram(self, shape, dtype):
+        utils.np.random.seed(1234)
+        img = np.random.randint(0, 200, shape).astype(dtype)
+        # both, odd and even numbers of pixels
+        for view in [img, img[1:, 1:]]:
+            bg = utils.estimate_background(view, method="histogram")
+            assert bg == np.median(view)
+
+    def test_estimate_background_methods(self):
+        img = np.load(glob("tests/images/beam/*.npy")[0])
+        median = utils.estimate_background(img)
+        assert utils.estimate_background(img, buffers=utils.WorkBuffers()
+                                         ) == median
+        assert utils.estimate_background(
+            img.astype(np.uint8), method="histogram") == median
+        assert utils.estimate_background(
+            img, method="subsample", step=1) == median
+        assert utils.estimate_background(
+            img, method="subsample") == approx(median, abs=2)
+        # falls back to the subsample for other types
+        assert utils.estimate_background(
+            img, method="histogram") == utils.estimate_background(
+                img, method="subsample")
+        with pytest.raises(ValueError):
+            utils.estimate_background(img, method="mean")
+
+    def test_background_estimator(self):
+        with pytest.raises(ValueError):
+            utils.BackgroundEstimator("mean")
+        with pytest.raises(ValueError):
+            utils.BackgroundEstimator(smoothing=1)
+
+        estimator = utils.BackgroundEstimator(smoothing=0.75)
+        assert estimator(np.full((10, 10), 8.0)) == 8
+        assert estimator(np.full((10, 10), 12.0)) == 9
+        assert estimator(np.full((10, 10), 12.0)) == 9.75
+        estimator.reset()
+        assert estimator(np.full((10, 10), 4.0)) == 4
+
+    @pytest.mark.parametrize('method', ["subsample", "histogram"])
+    @pytest.mark.parametrize('file', glob("tests/images/beam/*.npy"))
+    def test_get_peak_parameters_background(self, file, method):
+        img = np.load(file).astype(np.uint8)
+
+        estimator = utils.BackgroundEstimator(method, smoothing=0.5)
+        p_full = utils.get_peak_parameters(img)
+        for i in range(3):
+            p_fit = utils.get_peak_parameters(img, background=estimator)
+            assert p_fit[2:4] == approx(p_full[2:4], abs=0.1)
+            assert p_fit[4:6] == approx(p_full[4:6], rel=1e-2)